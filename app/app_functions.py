@@ -1,5 +1,6 @@
 import os
 import re
+import json
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 import numpy as np
@@ -8,6 +9,12 @@ import streamlit as st
 from pathlib import Path
 import base64
 import plotly.io as pio
+from figure_cache import create_figure_cache
+from gene_search import GeneNames
+from genome_index import GenomeIndex, PositionIndex, build_gene_index, gene_rows, merge_intervals
+from schemas import SCHEMAS, read_table
+from shared_tables import load_shared_table
+from startup_profile import timed_step
 
 
 def isoform_to_gene(isoform):
@@ -15,37 +22,79 @@ def isoform_to_gene(isoform):
     return match[0] if match is not None else None
 
 
+def isoforms_to_genes(isoforms):
+
+    # isoform_to_gene on a whole column: the regex runs once per distinct transcript name
+    isoforms = pd.Series(isoforms, dtype='category')
+    names = isoforms.cat.categories
+    genes = names.astype(str).str.extract(r"(\w+.\d+)", expand=False)
+
+    return isoforms.map(dict(zip(names, genes))).astype(object)
+
+
 @st.cache_data(show_spinner=False)
 def get_gene_ref(genes, GENES):
     GENESNAME = genes[genes['CDS'].isin(GENES)]
-    GENESNAME['name'] = GENESNAME.apply(lambda x: x['name'] if x['name'] == x['name'] else x['CDS'], axis=1)
+
+    # genes without common name are named after their CDS
+    CDS = GENESNAME['CDS'].astype(object)
+    GENESNAME = GENESNAME.assign(name=GENESNAME['name'].where(GENESNAME['name'].notna(), CDS))
     GENESNAME = GENESNAME.iloc[GENESNAME.name.str.lower().argsort()]
     GENESNAME = GENESNAME.set_index('CDS')['name'].to_dict()
 
-    return GENESNAME
+    return GeneNames(GENESNAME)
 
 
 @st.cache_data(show_spinner=False)
 def get_atg_position(atg):
-    # convert transcript name to gene name
-    atg['gene'] = atg['transcript'].apply(lambda x: isoform_to_gene(x))
-    return {gene: list(set(positions['CDS_start'])) for gene, positions in atg.groupby('gene')}
 
+    # convert transcript name to gene name, distinct CDS start positions of each gene
+    positions = pd.DataFrame({'gene': isoforms_to_genes(atg['transcript']).to_numpy(),
+                              'CDS_start': atg['CDS_start'].to_numpy()})
+    positions = positions.dropna(subset=['gene']).drop_duplicates()
 
-@st.cache_data(show_spinner=False)
+    positions, index = build_gene_index(positions, 'gene')
+    starts = positions['CDS_start'].tolist()
+
+    return {gene: starts[start:stop] for gene, (start, stop) in index.items()}
+
+
+def load_reference_table(filepath, table, column=None):
+
+    def loader():
+        frame = read_table(filepath, table)
+        # stored sorted by gene, so that build_gene_index can use the shared rows as they are
+        return frame if column is None else frame.sort_values(column, kind='mergesort')
+
+    # parsed once per host, then memory-mapped by every app process (see shared_tables.py)
+    with timed_step('load', os.path.basename(filepath)):
+        return load_shared_table(table, [filepath], loader, version=json.dumps([SCHEMAS[table], column]))
+
+
+# cache_resource: the shared tables are returned as they are instead of a copy for every session
+@st.cache_resource(show_spinner=False)
 def get_reference_files():
     path = os.getcwd()
 
-    exons = pd.read_csv(f'{path}/app/src/exon_coordinates.tsv', sep='\t')
-    genes = pd.read_csv(f'{path}/app/src/genes_coordinates.tsv', sep='\t')
-    dataset = pd.read_csv(f'{path}/app/src/SL_&_mimic_positions.tsv', sep='\t')
-    atg = pd.read_csv(f'{path}/app/src/CDS_start_positions.tsv', sep='\t')
+    exons = load_reference_table(f'{path}/app/src/exon_coordinates.tsv', 'exons', 'gene')
+    genes = load_reference_table(f'{path}/app/src/genes_coordinates.tsv', 'genes', 'CDS')
+    dataset = load_reference_table(f'{path}/app/src/SL_&_mimic_positions.tsv', 'dataset', 'gene')
+    atg = load_reference_table(f'{path}/app/src/CDS_start_positions.tsv', 'atg')
 
     GENES = list(set(dataset['gene']))
     GENESNAME = get_gene_ref(genes, GENES)
     ATGPOSITIONS = get_atg_position(atg)
 
-    return genes, exons, dataset, GENES, GENESNAME, ATGPOSITIONS
+    # gene-keyed row ranges for per-gene lookups, genes & exons coordinates indexed by gene and by window
+    GENEINDEX = {}
+    dataset, GENEINDEX['dataset'] = build_gene_index(dataset, 'gene')
+    GENEINDEX['genome'] = genome = GenomeIndex(genes, exons)
+    genes, exons = genome.genes, genome.exons
+
+    # start positions sorted by chromosome & position for the region mode
+    GENEINDEX['positions'] = PositionIndex(dataset, genome)
+
+    return genes, exons, dataset, GENES, GENESNAME, ATGPOSITIONS, GENEINDEX
 
 
 def get_legend_filepath(legend_type):
@@ -53,49 +102,43 @@ def get_legend_filepath(legend_type):
     return f'{path}/app/src/legend.png' if legend_type == 'plot1' else f'{path}/app/src/features_legend.png'
 
 
-def overlapping_exons(start, end, exon):
-    x, y = exon
-    return not x <= start < y and not x <= end < y
+def gene_model(gene, genes_coord, exons_coord, gene_index=None):
+    """Gene bounds, length and shapes of the gene model (line and exons, on the upper subplot)."""
 
-
-def plotly_gene_structure(fig, gene, genes_coord, exons_coord):
-
-    # Select exons for gene of interest and remove duplicates
-    exons_coord = exons_coord.loc[exons_coord['gene'] == gene].drop_duplicates(['start', 'end']).sort_values('start')
+    gene_index = gene_index or {}
 
     #### DRAW LINE FIRST
 
+    genome = gene_index.get('genome')
+
     # get start / end coordinates for the gene
-    gene_start = genes_coord.loc[genes_coord['CDS'] == gene, 'start'].values[0]
-    gene_end = genes_coord.loc[genes_coord['CDS'] == gene, 'end'].values[0]
+    if genome is not None:
+        _, _, gene_start, gene_end = genome.gene(gene)
+
+    else:
+        gene_coord = gene_rows(genes_coord, gene, column='CDS')
+        gene_start = gene_coord['start'].values[0]
+        gene_end = gene_coord['end'].values[0]
 
     # Calculate isoform length
     gene_length = gene_end - gene_start
 
     # Create gene line to be plotted
-    fig.add_shape(type="line", x0=gene_start, y0=0.5, x1=gene_end, y1=0.5,
-                  line=dict(color="black", width=1.5),
-                  row=1, col=1)
+    shapes = [dict(type="line", x0=gene_start, y0=0.5, x1=gene_end, y1=0.5,
+                   line=dict(color="black", width=1.5),
+                   xref='x', yref='y')]
 
     #### THEN DRAW EXONS
 
-    # Process exons
-    exons_set = []
-
-    for _, exon in exons_coord.iterrows():
-
-        start = exon['start']
-        end = exon['end']
-
-        set_size = len(exons_set)
-
-        if set_size == 0:
-            exons_set.append((start, end))
+    # Merged exons of the gene (precomputed in get_reference_files), genes without exons are drawn as a line
+    if genome is not None:
+        exons_set, strand = genome.exon_set(gene) or ([], None)
 
-        elif all(overlapping_exons(start, end, exons_set[n]) for n in range(set_size)):
-            exons_set.append((start, end))
-
-    strand = exons_coord['strand'].unique()[0]
+    else:
+        exons_coord = gene_rows(exons_coord, gene).sort_values('start', kind='mergesort')
+        _, starts, ends = merge_intervals(exons_coord['start'].values, exons_coord['end'].values)
+        exons_set = list(zip(starts, ends))
+        strand = exons_coord['strand'].values[0] if len(exons_coord) > 0 else None
 
     l = gene_length + gene_length * 0.2
     arrow_size = 0.02 * l
@@ -112,23 +155,23 @@ def plotly_gene_structure(fig, gene, genes_coord, exons_coord):
 
                 xn = start + arrow_size
 
-                fig.add_shape(type="path", path=f' M{start},0.5 L{xn},1 H{end} V0, H{xn} Z',
-                              fillcolor="LightSkyBlue",
-                              line=dict(color="black", width=2),
-                              row=1, col=1)
+                shapes.append(dict(type="path", path=f' M{start},0.5 L{xn},1 H{end} V0, H{xn} Z',
+                                   fillcolor="LightSkyBlue",
+                                   line=dict(color="black", width=2),
+                                   xref='x', yref='y'))
 
             else:
 
-                fig.add_shape(type="path", path=f' M{start},0.5 L{end},1 V0 Z',
-                              fillcolor="LightSkyBlue",
-                              line=dict(color="black", width=2),
-                              row=1, col=1)
+                shapes.append(dict(type="path", path=f' M{start},0.5 L{end},1 V0 Z',
+                                   fillcolor="LightSkyBlue",
+                                   line=dict(color="black", width=2),
+                                   xref='x', yref='y'))
 
         elif strand == '-' and i > 0:
 
-            fig.add_shape(type="rect", x0=start, y0=0, x1=end, y1=1,
-                          line=dict(color="black", width=2), fillcolor="LightSkyBlue",
-                          row=1, col=1)
+            shapes.append(dict(type="rect", x0=start, y0=0, x1=end, y1=1,
+                               line=dict(color="black", width=2), fillcolor="LightSkyBlue",
+                               xref='x', yref='y'))
 
         # sense strand last exon
         elif strand == '+' and i + 1 == len(exons_set):
@@ -137,76 +180,67 @@ def plotly_gene_structure(fig, gene, genes_coord, exons_coord):
 
                 xn = end - arrow_size
 
-                fig.add_shape(type="path", path=f' M{start},0 V1 H{xn} L{end},0.5 L{xn},0 Z',
-                              fillcolor="LightPink",
-                              line=dict(color="black", width=2),
-                              row=1, col=1)
+                shapes.append(dict(type="path", path=f' M{start},0 V1 H{xn} L{end},0.5 L{xn},0 Z',
+                                   fillcolor="LightPink",
+                                   line=dict(color="black", width=2),
+                                   xref='x', yref='y'))
             else:
 
-                fig.add_shape(type="path", path=f' M{start},0  V1 L{end},0.5 Z',
-                              fillcolor="LightSkyBlue",
-                              line=dict(color="black", width=2),
-                              row=1, col=1)
+                shapes.append(dict(type="path", path=f' M{start},0  V1 L{end},0.5 Z',
+                                   fillcolor="LightSkyBlue",
+                                   line=dict(color="black", width=2),
+                                   xref='x', yref='y'))
 
         # sense strand
         elif strand == '+' and i < len(exons_set):
 
-            fig.add_shape(type="rect", x0=start, y0=0, x1=end, y1=1,
-                          line=dict(color="black", width=2), fillcolor="LightPink",
-                          row=1, col=1)
+            shapes.append(dict(type="rect", x0=start, y0=0, x1=end, y1=1,
+                               line=dict(color="black", width=2), fillcolor="LightPink",
+                               xref='x', yref='y'))
 
         # unknown strand
         else:
 
-            fig.add_shape(type="rect", x0=start, y0=0, x1=end, y1=1,
-                          line=dict(color="black", width=2), fillcolor="grey",
-                          row=1, col=1)
+            shapes.append(dict(type="rect", x0=start, y0=0, x1=end, y1=1,
+                               line=dict(color="black", width=2), fillcolor="grey",
+                               xref='x', yref='y'))
 
-    return gene_start, gene_end, gene_length
+    return gene_start, gene_end, gene_length, shapes
 
 
-def plot_gene_start(dataset, gene, genes_coord, exons_coord, ATGPOSITION, show_atg=True):
+def plotly_gene_structure(fig, gene, genes_coord, exons_coord, gene_index=None):
+    gene_start, gene_end, gene_length, shapes = gene_model(gene, genes_coord, exons_coord, gene_index)
 
-    fig = make_subplots(rows=2, cols=1, row_heights=[2, 10], shared_xaxes=True, vertical_spacing=0.02)
+    # shapes are added at once: add_shape validates again every shape already in the figure
+    fig.update_layout(shapes=[*fig.layout.shapes, *shapes])
 
-    # plot gene model ---------------------------------
-    start, end, length = plotly_gene_structure(fig, gene, genes_coord, exons_coord)
+    return gene_start, gene_end, gene_length
 
-    # lock y axis range on gene model subplot and remove axis/grid/etc
-    fig.update_yaxes(fixedrange=True, range=[-1, 2], row=1, col=1)
-    fig.update_xaxes(visible=False, row=1, col=1)
-    fig.update_yaxes(visible=False, row=1, col=1)
 
-    # plot gene data points ---------------------------------
+def add_positions(fig, data):
 
-    gene_data = dataset[dataset['gene'] == gene]
+    # start positions as dots colored by their SL / hairpin / unidentified reads, on the lower subplot
+    # percentages are stored as float32, recover their 2-decimals values
+    percentages = ['%SL', '%hairpin', '%unidentified']
+    data = data.assign(**{col: data[col].astype('float64').round(2) for col in percentages})
 
-    x = list(gene_data['position'])
-    y = list(gene_data['total'])
+    x = list(data['position'])
+    y = list(data['total'])
 
-    r = [i / 100 * 255 for i in list(gene_data['%SL'])]
-    g = [i / 100 * 255 for i in list(gene_data['%hairpin'])]
-    b = [i / 100 * 255 for i in list(gene_data['%unidentified'])]
+    r = [i / 100 * 255 for i in list(data['%SL'])]
+    g = [i / 100 * 255 for i in list(data['%hairpin'])]
+    b = [i / 100 * 255 for i in list(data['%unidentified'])]
     col = list(zip(r, g, b))
     col = [f'rgb({r},{g},{b})' for r, g, b in list(col)]
 
     fig.add_trace(go.Scatter(x=x, y=y, mode='markers', marker=dict(color=col, size=10)), row=2, col=1)
 
-    # plot ATG ---------------------------------
-
-    if show_atg and gene in ATGPOSITION:
-        ATG = ATGPOSITION[gene]
-
-        for _atg in ATG:
-            fig.add_vline(x=_atg, line_width=2, line_dash="dot", line_color="#36454F", row=2, col=1, layer='below')
-
     # add custom hovering infos ---------------------------------
 
-    gene_data['SL2_ratio'] = round(gene_data['SL2_ratio'] * 100, 2)
-    gene_data['SL2_ratio'] = gene_data['SL2_ratio'].fillna('N/A')
+    data['SL2_ratio'] = round(data['SL2_ratio'] * 100, 2)
+    data['SL2_ratio'] = data['SL2_ratio'].fillna('N/A')
 
-    cstm = np.stack((gene_data['%SL'], gene_data['%hairpin'], gene_data['%unidentified'], gene_data['SL2_ratio']),
-                    axis=-1)
+    cstm = np.stack((data['%SL'], data['%hairpin'], data['%unidentified'], data['SL2_ratio']), axis=-1)
 
     hovertemplate = ('<b>Position:</b> %{x}<br>'
                      '<b>Reads:</b> %{y}<br>' +
@@ -218,6 +252,11 @@ def plot_gene_start(dataset, gene, genes_coord, exons_coord, ATGPOSITION, show_a
 
     fig.update_traces(customdata=cstm, hovertemplate=hovertemplate, row=2, col=1)
 
+    return y
+
+
+def style_positions_plot(fig):
+
     # add x and y axis labels ---------------------------------
 
     fig['layout']['yaxis2']['title'] = '<b>Number of reads</b>'
@@ -225,14 +264,6 @@ def plot_gene_start(dataset, gene, genes_coord, exons_coord, ATGPOSITION, show_a
 
     # plots settings ---------------------------------
 
-    _start = start - (length * 0.1)
-    _end = end + (length * 0.1)
-    max_val = max(y)
-
-    fig.update_layout(xaxis_range=[_start, _end], yaxis2 = dict(range=[-(0.05*max_val), (max_val*1.05)]),
-                      width=890, height=500, margin=dict(l=0, r=10, b=0, t=0),
-                      plot_bgcolor="rgb(255,255,255,255)")
-
     fig.update_yaxes(zeroline=False, showline=True, linewidth=1.2, linecolor='#36454F', mirror=True,
                      showgrid=True, gridwidth=0.5, gridcolor='lightgrey',
                      tickformat=',', ticks="outside", tickcolor='black', ticklen=5,
@@ -245,20 +276,223 @@ def plot_gene_start(dataset, gene, genes_coord, exons_coord, ATGPOSITION, show_a
                      ticks="outside", tickcolor='black', ticklen=5,
                      title_font=dict(size=16, color='#36454F', family='Roboto'))
 
+
+def plot_gene_start(dataset, gene, genes_coord, exons_coord, ATGPOSITION, show_atg=True, gene_index=None):
+
+    fig = make_subplots(rows=2, cols=1, row_heights=[2, 10], shared_xaxes=True, vertical_spacing=0.02)
+
+    # plot gene model ---------------------------------
+    start, end, length = plotly_gene_structure(fig, gene, genes_coord, exons_coord, gene_index)
+
+    # lock y axis range on gene model subplot and remove axis/grid/etc
+    fig.update_yaxes(fixedrange=True, range=[-1, 2], row=1, col=1)
+    fig.update_xaxes(visible=False, row=1, col=1)
+    fig.update_yaxes(visible=False, row=1, col=1)
+
+    # plot gene data points ---------------------------------
+
+    gene_data = gene_rows(dataset, gene, (gene_index or {}).get('dataset'))
+    y = add_positions(fig, gene_data)
+
+    # plot ATG ---------------------------------
+
+    if show_atg and gene in ATGPOSITION:
+        ATG = ATGPOSITION[gene]
+
+        for _atg in ATG:
+            fig.add_vline(x=_atg, line_width=2, line_dash="dot", line_color="#36454F", row=2, col=1, layer='below')
+
+    # plots settings ---------------------------------
+
+    _start = start - (length * 0.1)
+    _end = end + (length * 0.1)
+    max_val = max(y)
+
+    fig.update_layout(xaxis_range=[_start, _end], yaxis2 = dict(range=[-(0.05*max_val), (max_val*1.05)]),
+                      width=890, height=500, margin=dict(l=0, r=10, b=0, t=0),
+                      plot_bgcolor="rgb(255,255,255,255)")
+
+    style_positions_plot(fig)
+
     return fig
 
 
-def download_plotly_static(fig, gene, generef):
+# Region mode: start positions of every gene of a genomic window
+
+# widest window shown, and number of start positions drawn at most (see thin_positions)
+MAX_REGION = 2_000_000
+MAX_POINTS = 5000
+
+
+def parse_region(text, genome, GENESNAME):
+    """(chromosome, start, end) of 'chromosome:start-end' or of genes separated by commas (operons),
+    None when the region is invalid."""
+
+    match = re.fullmatch(r'\s*(\w+)\s*:\s*([\d,]+)\s*-\s*([\d,]+)\s*', text)
+
+    if match is not None:
+        chromosome, start, end = match[1], int(match[2].replace(',', '')), int(match[3].replace(',', ''))
+        if (chromosome, '+') not in genome.strands and (chromosome, '-') not in genome.strands:
+            return None
+        if start >= end or end - start > MAX_REGION:
+            return None
+        return chromosome, start, end
+
+    # genes: common names or CDS, all on the same chromosome
+    coordinates = []
+    for name in text.split(','):
+        gene = GENESNAME.to_cds(name) or name.strip()
+        if genome.gene(gene) is None:
+            return None
+        coordinates.append(genome.gene(gene))
+
+    if len({chromosome for chromosome, _, _, _ in coordinates}) != 1:
+        return None
+
+    # same margins as the gene plots
+    start, end = min(start for _, _, start, _ in coordinates), max(end for _, _, _, end in coordinates)
+    length = end - start
+    if length > MAX_REGION:
+        return None
+    return coordinates[0][0], int(start - length * 0.1), int(end + length * 0.1)
+
+
+def move_region(region, action, genome):
+
+    # pan by half a window, zoom by a factor 2 around the center of the window
+    chromosome, start, end = region
+    width = end - start
+    center = (start + end) // 2
+
+    if action == 'left':
+        start, end = start - width // 2, end - width // 2
+    elif action == 'right':
+        start, end = start + width // 2, end + width // 2
+    elif action == 'zoom in':
+        start, end = center - max(width // 4, 50), center + max(width // 4, 50)
+    elif action == 'zoom out':
+        width = min(width * 2, MAX_REGION)
+        start, end = center - width // 2, center + width // 2
+
+    # windows stay on the chromosome (up to the end of its last gene)
+    length = genome.chromosome_end(chromosome)
+    if end > length:
+        start, end = start - (end - length), length
+    if start < 0:
+        start, end = 0, min(end - start, max(length, 1))
+    return chromosome, start, end
+
+
+def thin_positions(data, start, end, max_points=MAX_POINTS):
+
+    # large windows: the position with the most reads of each of max_points bins is kept
+    if len(data) <= max_points:
+        return data
+
+    bins = (data['position'].to_numpy().astype(np.int64) - start) * max_points // (end - start + 1)
+    order = np.lexsort((-data['total'].to_numpy(), bins))
+    first = order[np.r_[True, bins[order][1:] != bins[order][:-1]]]
+
+    return data.iloc[np.sort(first)]
+
+
+def plot_region(dataset, chromosome, start, end, ATGPOSITION, gene_index, show_atg=True, max_points=MAX_POINTS):
+    """Gene models and start positions of chromosome:start-end.
+
+    Only the rows of the window and of one window width on each side are sent to the browser (a pan
+    smaller than the window is drawn without reloading), see PositionIndex. Returns the figure, the genes
+    and the number of start positions of the window.
+    """
+
+    genome, positions = gene_index['genome'], gene_index['positions']
+    width = end - start
+    loaded_start, loaded_end = max(start - width, 0), end + width
+
+    fig = make_subplots(rows=2, cols=1, row_heights=[2, 10], shared_xaxes=True, vertical_spacing=0.02)
+
+    # plot gene models ---------------------------------
+
+    # shapes & names of all genes are set at once (see plotly_gene_structure)
+    genes = genome.genes_in(chromosome, loaded_start, loaded_end)
+    shapes, names = [], []
+
+    for gene in genes:
+        gene_start, gene_end, _, gene_shapes = gene_model(gene, genome.genes, genome.exons, gene_index)
+        shapes.extend(gene_shapes)
+        names.append(dict(x=(gene_start + gene_end) / 2, y=1.6, text=f'<i>{gene}</i>', showarrow=False,
+                          font=dict(size=11, color='#36454F'), xref='x', yref='y'))
+
+    # plot ATG ---------------------------------
+
+    if show_atg:
+        shapes.extend(dict(type='line', x0=_atg, x1=_atg, y0=0, y1=1, xref='x2', yref='y2 domain', layer='below',
+                           line=dict(width=2, dash='dot', color='#36454F'))
+                      for gene in genes for _atg in ATGPOSITION.get(gene, []))
+
+    fig.update_layout(shapes=shapes, annotations=names)
+    fig.update_yaxes(fixedrange=True, range=[-1, 2], row=1, col=1)
+    fig.update_xaxes(visible=False, row=1, col=1)
+    fig.update_yaxes(visible=False, row=1, col=1)
+
+    # plot data points ---------------------------------
+
+    data = thin_positions(dataset.iloc[positions.window(chromosome, loaded_start, loaded_end)],
+                          loaded_start, loaded_end, max_points)
+    add_positions(fig, data)
+
+    # plots settings ---------------------------------
+
+    visible = data['position'].between(start, end)
+    max_val = data.loc[visible, 'total'].max() if visible.any() else 1
+
+    fig.update_layout(xaxis_range=[start, end], yaxis2=dict(range=[-(0.05*max_val), (max_val*1.05)]),
+                      width=890, height=500, margin=dict(l=0, r=10, b=0, t=0),
+                      plot_bgcolor="rgb(255,255,255,255)")
+
+    style_positions_plot(fig)
+
+    return fig, genome.genes_in(chromosome, start, end), len(positions.window(chromosome, start, end))
+
+
+@st.cache_resource(show_spinner=False)
+def get_figure_cache():
+    # one cache per process, shared by all sessions
+    return create_figure_cache()
+
+
+def image_cache_key(gene, show_atg, title, fmt='png', width=1200, height=900, scale=2):
+    return 'image', gene, show_atg, title, fmt, width, height, scale
+
+
+def plot_title(gene, name=None):
+    # plain title of exported plots, used in the image cache keys of the download & the PDF export
+    return f'{name} ({gene})' if name is not None and name != gene else str(gene)
+
+
+def export_layout(fig, title):
+    # bold title, applied when the image is rendered
+    return fig.update_layout(margin=dict(l=100, r=100, b=100, t=100), title_text=f'<b>{title}</b>', title_font_size=30,
+                             title_font_family='Roboto', title_font_color='black')
+
+
+def cached_gene_plot(dataset, gene, genes_coord, exons_coord, ATGPOSITION, show_atg=True, gene_index=None):
+
+    def create():
+        return plot_gene_start(dataset, gene, genes_coord, exons_coord, ATGPOSITION, show_atg=show_atg,
+                               gene_index=gene_index).to_json()
+
+    fig_json = get_figure_cache().get_or_create(('json', gene, show_atg), create)
+    return pio.from_json(fig_json)
+
+
+def download_plotly_static(fig, gene, generef, show_atg=True):
     st.sidebar.markdown('### 3. Save plot:')
 
-    if generef is not None:
-        name_template = f'<b>{gene} ({generef}) </b>'
-    else:
-        name_template = f'<b>{gene}</b>'
+    # same title & cache key as the plots of the PDF export
+    title = plot_title(gene, generef)
 
     # modify layout for pdf + add title
-    _fig = fig.update_layout(margin=dict(l=100, r=100, b=100, t=100), title_text=name_template, title_font_size=30,
-                             title_font_family='Roboto', title_font_color='black')
+    _fig = export_layout(fig, title)
 
     # set explicit headless parameters for chromium (not sure if all are needed)
     pio.kaleido.scope.chromium_args = (
@@ -268,7 +502,9 @@ def download_plotly_static(fig, gene, generef):
         "--disable-gpu")  # tuple with chromium args
 
     # create pdf file and store in memory as bytes for st.download_button
-    plot_bytes = _fig.to_image(format="png", width=1200, height=900, scale=2)
+    key = image_cache_key(gene, show_atg, title)
+    plot_bytes = get_figure_cache().get_or_create(key, lambda: _fig.to_image(format="png", width=1200, height=900,
+                                                                              scale=2))
     st.sidebar.download_button('📥 Download', plot_bytes, file_name='test.png')
 
 
@@ -0,0 +1,99 @@
+import io
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import plotly.io as pio
+from fpdf import FPDF
+from app_functions import plot_gene_start, get_reference_files, image_cache_key, export_layout
+
+
+# reference files loaded once in each worker process (see init_worker)
+_REFERENCE = None
+
+
+def init_worker():
+    global _REFERENCE
+
+    # kaleido keeps its chromium process alive between calls: one persistent instance per worker
+    pio.kaleido.scope.chromium_args = ("--headless", "--no-sandbox", "--single-process", "--disable-gpu")
+
+    _REFERENCE = get_reference_files()
+
+
+def create_export_pool(workers=None):
+    workers = workers or min(4, os.cpu_count() or 1)
+
+    # spawn: forking the multi-threaded streamlit server is not safe
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=init_worker)
+
+
+def render_gene_plot(refgene, titleplot):
+    genes, exons, dataset, GENES, GENESNAME, ATGPOSITIONS, GENEINDEX = _REFERENCE
+
+    gene_plot = plot_gene_start(dataset, refgene, genes, exons, ATGPOSITIONS, show_atg=True, gene_index=GENEINDEX)
+
+    fig = export_layout(gene_plot, titleplot)
+
+    return fig.to_image(format='png', width=1200, height=900, scale=2)
+
+
+def export_plots_pdf(pool, genes, titles, progress=None, cache=None):
+    """PDF report of the gene plots (None when no plot could be rendered) and the titles of the failed plots.
+
+    Plots that fail to render are left out of the report. Raises BrokenProcessPool when a worker process
+    died: the pool cannot be used anymore, the plots rendered before are in the cache.
+    """
+
+    images = [None] * len(genes)
+    failed = []
+    broken = None
+    completed = 0
+
+    # plots rendered recently are taken from the figure cache
+    if cache is not None:
+        for n, (gene, title) in enumerate(zip(genes, titles)):
+            images[n] = cache.get(image_cache_key(gene, True, title))
+
+            if images[n] is not None:
+                completed += 1
+                if progress is not None:
+                    progress(completed, title)
+
+    # submit the other genes, images come back in completion order
+    futures = {pool.submit(render_gene_plot, genes[n], titles[n]): n for n in range(len(genes)) if images[n] is None}
+
+    for future in as_completed(futures):
+        n = futures[future]
+        completed += 1
+
+        try:
+            images[n] = future.result()
+        except BrokenProcessPool as error:
+            broken = error
+        except Exception:
+            failed.append(titles[n])
+        else:
+            if cache is not None:
+                cache.put(image_cache_key(genes[n], True, titles[n]), images[n])
+
+        if progress is not None:
+            progress(completed, titles[n])
+
+    # every pending plot fails once a worker died
+    if broken is not None:
+        raise broken
+
+    if all(image is None for image in images):
+        return None, failed
+
+    # pages are added in input order, png bytes are read from memory
+    pdf = FPDF(format=(180, 240), orientation="landscape")
+
+    for image in images:
+        if image is not None:
+            pdf.add_page()
+            pdf.image(io.BytesIO(image), x=15, y=20, h=150, w=200)
+
+    return bytes(pdf.output()), failed
@@ -0,0 +1,466 @@
+import os
+import time
+import tempfile
+import multiprocessing
+from itertools import tee
+import numpy as np
+import pandas as pd
+from plotly.subplots import make_subplots
+from app_functions import build_gene_index, gene_rows, get_atg_position, get_gene_ref, isoform_to_gene, \
+    plotly_gene_structure, plot_region
+from genome_index import GenomeIndex, PositionIndex, read_gene_locations
+from gene_search import GeneNames
+from page_download_plots import convert_input
+from schemas import process_memory, read_table
+from shared_tables import load_shared_table
+from tab_read_features import plot_read_features
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def synthetic_isoform(nreads, transcript_length=1500, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    # exons of a 3-exons isoform (cDNA coordinates)
+    exons = pd.DataFrame({'Transcript stable ID': 'SYN.1', 'Strand': 1, 'Exon rank in transcript': [1, 2, 3],
+                          'cDNA coding start': [1, 401, 901], 'cDNA coding end': [400, 900, transcript_length]})
+
+    start = rng.integers(0, 200, nreads)
+    aln = rng.integers(300, transcript_length - 200, nreads)
+    sc5 = -rng.integers(0, 150, nreads)
+
+    table = pd.DataFrame({'isoform': 'SYN.1', 'transcriptomic_start': start, 'SC5': sc5,
+                          'alignment_length': aln, 'SC3': aln + rng.integers(0, 100, nreads),
+                          'SSP_FOUND': rng.integers(0, 2, nreads), 'SSP_dist': -rng.integers(0, 50, nreads),
+                          'SSP_size': rng.integers(15, 27, nreads),
+                          'ROBUST_SL_FOUND': rng.integers(0, 2, nreads), 'SL_distance': -rng.integers(0, 5, nreads),
+                          'SL_score': rng.integers(8, 23, nreads),
+                          'HAIRPIN_FOUND': rng.integers(0, 2, nreads)})
+
+    table['HAIRPIN_stem1_start'] = sc5 + 10
+    table['HAIRPIN_stem1_end'] = sc5 + 22
+    table['HAIRPIN_stem2_start'] = sc5 + 30
+    table['HAIRPIN_stem2_end'] = sc5 + 42
+
+    table = table.sort_values(['isoform', 'transcriptomic_start', 'SC5'], ascending=False).reset_index(drop=True)
+
+    return table, {'SYN.1': transcript_length}, exons
+
+
+def figure_segments(fig):
+
+    # (color, dash, y, x0, x1) for every drawn segment, whatever the number of traces
+    segments = []
+
+    for trace in fig.data:
+        x, y = list(trace.x), list(trace.y)
+        for i in range(0, len(x), 3 if len(x) > 2 else 2):
+            segments.append((trace.line.color, trace.line.dash, y[i], float(x[i]), float(x[i + 1])))
+
+    return sorted(segments)
+
+
+def benchmark_read_features(nreads=2000):
+
+    table, transcripts, exons = synthetic_isoform(nreads)
+
+    (_, loop_fig), loop_time = timed(plot_read_features, 'SYN.1', table, transcripts, exons, batched=False)
+    (_, batched_fig), batched_time = timed(plot_read_features, 'SYN.1', table, transcripts, exons, batched=True)
+
+    print(f'plot_read_features - {nreads} reads')
+    for mode, fig, duration in [('loop', loop_fig, loop_time), ('batched', batched_fig, batched_time)]:
+        print(f'  {mode:<8} traces: {len(fig.data):>6} | payload: {len(fig.to_json()) / 1e6:>7.2f} MB | '
+              f'build: {duration:.3f}s')
+
+    print(f'  same segments: {figure_segments(loop_fig) == figure_segments(batched_fig)}')
+
+
+def synthetic_positions(ngenes=20000, rows_per_gene=50, seed=0):
+
+    rng = np.random.default_rng(seed)
+    nrows = ngenes * rows_per_gene
+
+    # rows of the different genes are interleaved, as in SL_&_mimic_positions.tsv
+    genes = np.array([f'GENE{i}.1' for i in range(ngenes)], dtype=object)
+    return pd.DataFrame({'gene': rng.choice(genes, nrows), 'position': rng.integers(0, 10**7, nrows),
+                         'total': rng.integers(1, 500, nrows)})
+
+
+def benchmark_gene_lookup(ngenes=1000):
+
+    dataset = synthetic_positions()
+    genes = dataset['gene'].drop_duplicates().values[:ngenes]
+
+    (indexed, index), index_time = timed(build_gene_index, dataset, 'gene')
+
+    _, scan_time = timed(lambda: [gene_rows(dataset, gene) for gene in genes])
+    _, lookup_time = timed(lambda: [gene_rows(indexed, gene, index) for gene in genes])
+
+    same = all(gene_rows(dataset, gene).reset_index(drop=True).equals(
+               gene_rows(indexed, gene, index).reset_index(drop=True)) for gene in genes[:50])
+
+    print(f'per-gene lookups - {ngenes} genes in {len(dataset):,} rows')
+    print(f'  boolean scan: {scan_time:.3f}s | index build: {index_time:.3f}s | indexed: {lookup_time:.3f}s')
+    print(f'  same rows: {same}')
+
+
+def convert_input_scan(input_list, GENES, GENESNAME):
+
+    # previous implementation: reverse lookup by scanning all names
+    converted = []
+
+    for gene in input_list:
+        if gene in GENES:
+            converted.append(gene)
+        elif gene in GENESNAME.values():
+            converted.append([i for i, v in GENESNAME.items() if gene == v][0])
+
+    return converted
+
+
+def benchmark_gene_names(ngenes=20000, ninput=500):
+
+    GENES = [f'GENE{i}.1' for i in range(ngenes)]
+    GENESNAME = GeneNames({gene: f'gen-{i}' for i, gene in enumerate(GENES)})
+
+    rng = np.random.default_rng(0)
+    input_list = [f'gen-{i}' for i in rng.integers(0, ngenes, ninput)]
+
+    scanned, scan_time = timed(convert_input_scan, input_list, GENES, GENESNAME)
+    converted, index_time = timed(convert_input, input_list, GENES, GENESNAME)
+    _, search_time = timed(lambda: [GENESNAME.search(name[:5]) for name in input_list])
+
+    print(f'common name conversion - {ninput} names among {ngenes} genes')
+    print(f'  scan: {scan_time:.3f}s | index: {index_time:.4f}s | {ninput} prefix searches: {search_time:.4f}s')
+    print(f'  same result: {scanned == converted}')
+
+
+def get_gene_ref_apply(genes, GENES):
+
+    # previous implementation: row by row apply
+    GENESNAME = genes[genes['CDS'].isin(GENES)].copy()
+    GENESNAME['name'] = GENESNAME.apply(lambda x: x['name'] if x['name'] == x['name'] else x['CDS'], axis=1)
+    GENESNAME = GENESNAME.iloc[GENESNAME.name.str.lower().argsort()]
+    return GENESNAME.set_index('CDS')['name'].to_dict()
+
+
+def get_atg_position_apply(atg):
+
+    # previous implementation: row by row apply then groupby
+    atg = atg.copy()
+    atg['gene'] = atg['transcript'].apply(lambda x: isoform_to_gene(x))
+    return {gene: list(set(positions['CDS_start'])) for gene, positions in atg.groupby('gene', observed=True)}
+
+
+def benchmark_reference_rules(ngenes=20000, transcripts_per_gene=3, seed=0):
+
+    rng = np.random.default_rng(seed)
+    CDS = [f'GENE{i}.{i % 7 + 1}' for i in range(ngenes)]
+    names = np.where(rng.random(ngenes) < 0.3, None, np.array([f'gen-{i}' for i in range(ngenes)], dtype=object))
+    genes = pd.DataFrame({'CDS': pd.Categorical(CDS), 'name': names})
+
+    transcripts = [f'{gene}{suffix}' for gene in CDS for suffix in ['a.1', 'b.1', ''][:transcripts_per_gene]]
+    atg = pd.DataFrame({'transcript': pd.Categorical(transcripts),
+                        'CDS_start': rng.integers(0, 1000, len(transcripts)).astype('int32')})
+
+    get_names, get_positions = get_gene_ref.__wrapped__, get_atg_position.__wrapped__
+
+    old_names, names_apply = timed(get_gene_ref_apply, genes, CDS)
+    new_names, names_time = timed(get_names, genes, CDS)
+    old_positions, positions_apply = timed(get_atg_position_apply, atg)
+    new_positions, positions_time = timed(get_positions, atg)
+
+    same_positions = (old_positions.keys() == new_positions.keys() and
+                      all(set(old_positions[gene]) == set(new_positions[gene]) for gene in old_positions))
+
+    print(f'reference tables - {ngenes} genes, {len(atg):,} transcripts')
+    print(f'  gene names - apply: {names_apply:.3f}s | vectorized: {names_time:.3f}s | '
+          f'same result: {list(old_names.items()) == list(dict(new_names).items())}')
+    print(f'  ATG positions - apply: {positions_apply:.3f}s | vectorized: {positions_time:.3f}s | same result: {same_positions}')
+
+
+def synthetic_genome(ngenes=20000, exons_per_gene=6, seed=0):
+
+    rng = np.random.default_rng(seed)
+    chromosomes = np.array(['I', 'II', 'III', 'IV', 'V', 'X'])
+
+    # distinct starts on every chromosome, genes of both strands overlap each other
+    chromosome = np.sort(rng.choice(chromosomes, ngenes))
+    start = rng.permutation(np.arange(ngenes) * 1000)[:ngenes] + 1
+    end = start + rng.integers(500, 20000, ngenes)
+    strand = rng.choice(['+', '-'], ngenes)
+
+    CDS = np.array([f'GENE{i}.{i % 7 + 1}' for i in range(ngenes)], dtype=object)
+    genes = pd.DataFrame({'CDS': CDS, 'name': [f'gen-{i}' for i in range(ngenes)], 'chromosome': chromosome,
+                          'strand': strand, 'start': start, 'end': end})
+
+    # exons of 2 transcripts per gene, some of them overlapping or duplicated
+    rows = np.repeat(np.arange(ngenes), exons_per_gene)
+    exon_start = start[rows] + rng.integers(0, 400, len(rows)) * (end[rows] - start[rows]) // 400
+    exon_end = np.minimum(exon_start + rng.integers(50, 600, len(rows)), end[rows])
+    exons = pd.DataFrame({'gene': CDS[rows], 'transcript': [f'{CDS[row]}{"ab"[i % 2]}' for i, row in enumerate(rows)],
+                          'chromosome': chromosome[rows], 'strand': strand[rows], 'start': exon_start, 'end': exon_end})
+
+    locations = pd.DataFrame({'wormbaseID': [f'WBGene{i:08d}' for i in range(ngenes)], 'gene': CDS, 'name': genes['name'],
+                              'strand': np.where(strand == '+', 1, -1), 'chromosome': chromosome,
+                              'start': start, 'end': end})
+
+    return genes, exons, locations
+
+
+def pairwise(iterable):
+
+    a, b = tee(iterable)
+    next(b, None)
+    return zip(a, b)
+
+
+def notebook_gene_pairs(coordinates):
+
+    # previous implementation (Fig3 notebook): sorted genes of each chromosome & strand walked in pairs
+    plus = coordinates[coordinates['strand'] == 1]
+    minus = coordinates[coordinates['strand'] == -1]
+
+    _map = {'start': 'end', 'end': 'start'}
+    minus.columns = [{**_map, **{v: k for k, v in _map.items()}}.get(x, x) for x in minus.columns]
+
+    coordinates = pd.concat([plus, minus])
+
+    up, down, up_end, orientation = [], [], [], []
+
+    for (ch, std), table in coordinates.groupby(['chromosome', 'strand']):
+        if std == 1:
+            table = table.sort_values('start', ascending=True)
+            for (i1, row1), (i2, row2) in pairwise(table.iterrows()):
+                up.append(row1["gene"])
+                up_end.append(row1["end"])
+                down.append(row2["gene"])
+                orientation.append('+')
+
+        if std == -1:
+            table = table.sort_values('end', ascending=False)
+            for (i1, row1), (i2, row2) in pairwise(table.iterrows()):
+                up.append(row1["gene"])
+                up_end.append(row1["end"])
+                down.append(row2["gene"])
+                orientation.append('-')
+
+    return pd.DataFrame(dict(upstream_gene=up, upstream_end=up_end, downstream_gene=down, sens=orientation))
+
+
+def select_exons(exonslist):
+
+    # exons drawn by GeneStructure (Fig6 notebook): exons overlapping an exon already drawn are skipped
+    exons_set = []
+    for start, end in zip(exonslist['start'], exonslist['end']):
+        if all(not (x <= start <= y or x <= end <= y) for x, y in exons_set):
+            exons_set.append((start, end))
+    return exons_set
+
+
+def notebook_gene_structure(gene, exons_file, genes_file):
+
+    # previous implementation (GeneStructure): both reference files read again for every gene
+    exonslist = pd.read_csv(exons_file, sep='\t')
+    geneslist = pd.read_csv(genes_file, sep='\t')
+
+    exonslist = exonslist.loc[exonslist['gene'] == gene].drop_duplicates(['start', 'end']).sort_values('start')
+    gene_start = geneslist.loc[geneslist['CDS'] == gene, 'start'].values[0]
+    gene_end = geneslist.loc[geneslist['CDS'] == gene, 'end'].values[0]
+
+    return select_exons(exonslist), exonslist['strand'].unique()[0], gene_start, gene_end
+
+
+def indexed_gene_structure(gene, index):
+    exonslist = index.exons_of(gene).drop_duplicates(['start', 'end']).sort_values('start')
+    _, strand, gene_start, gene_end = index.gene(gene)
+
+    return select_exons(exonslist), strand, gene_start, gene_end
+
+
+def benchmark_genome_index(ngenes=20000, nqueries=200, seed=0):
+
+    genes, exons, locations = synthetic_genome(ngenes, seed=seed)
+    rng = np.random.default_rng(seed)
+    queried = rng.choice(genes['CDS'].to_numpy(), nqueries, replace=False)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        genes.to_csv(f'{tmp}/genes_coordinates.tsv', sep='\t', index=None)
+        exons.to_csv(f'{tmp}/exon_coordinates.tsv', sep='\t', index=None)
+        locations.to_csv(f'{tmp}/prot_coding_gene_location.tsv', sep='\t', index=None, header=None)
+
+        index, build_time = timed(GenomeIndex.from_files, f'{tmp}/genes_coordinates.tsv', f'{tmp}/exon_coordinates.tsv')
+
+        # Fig3: pairs of successive genes
+        old_pairs, loop_time = timed(notebook_gene_pairs, read_gene_locations(f'{tmp}/prot_coding_gene_location.tsv'))
+        locations_index = GenomeIndex(read_gene_locations(f'{tmp}/prot_coding_gene_location.tsv'), gene_column='gene')
+        new_pairs, pairs_time = timed(locations_index.gene_pairs)
+        downstream = old_pairs.set_index('upstream_gene')['downstream_gene']
+        same_downstream = all(locations_index.downstream_gene(gene) == downstream.get(gene) for gene in queried)
+
+        # Fig6: gene structures
+        old_structures, files_time = timed(lambda: [notebook_gene_structure(
+            gene, f'{tmp}/exon_coordinates.tsv', f'{tmp}/genes_coordinates.tsv') for gene in queried[:20]])
+        new_structures, structures_time = timed(lambda: [indexed_gene_structure(gene, index) for gene in queried[:20]])
+
+    # genes overlapping windows of 100kb
+    windows = [(genes['chromosome'].iloc[i], int(genes['start'].iloc[i]) - 50000, int(genes['start'].iloc[i]) + 50000)
+               for i in rng.integers(0, ngenes, nqueries)]
+
+    def scan_window(chromosome, start, end):
+        found = genes.loc[(genes['chromosome'] == chromosome) & (genes['start'] <= end) & (genes['end'] >= start)]
+        return found.sort_values('start', kind='mergesort')['CDS'].tolist()
+
+    scanned, scan_time = timed(lambda: [scan_window(*window) for window in windows])
+    found, window_time = timed(lambda: [index.genes_in(*window) for window in windows])
+
+    # app: gene model drawn from the frames or from the index
+    def gene_models(gene_index):
+        figures = []
+        for gene in queried:
+            fig = make_subplots(rows=2, cols=1)
+            plotly_gene_structure(fig, gene, genes, exons, gene_index)
+            figures.append(fig.layout.shapes)
+        return figures
+
+    old_models, models_scan_time = timed(gene_models, None)
+    new_models, models_time = timed(gene_models, {'genome': index})
+
+    print(f'genome index - {ngenes} genes, {len(exons):,} exons (index build: {build_time:.3f}s)')
+    print(f'  Fig3 gene pairs - pairwise loop: {loop_time:.3f}s | sorted arrays: {pairs_time:.4f}s | '
+          f'same pairs: {old_pairs.equals(new_pairs)} | same downstream genes: {same_downstream}')
+    print(f'  Fig6 gene structures (20 genes) - files read on every call: {files_time:.3f}s | index: {structures_time:.4f}s | '
+          f'same structures: {old_structures == new_structures}')
+    print(f'  {nqueries} windows of 100kb - scan: {scan_time:.3f}s | index: {window_time:.4f}s | same genes: {scanned == found}')
+    print(f'  {nqueries} gene models - frames: {models_scan_time:.3f}s | index: {models_time:.3f}s | '
+          f'same shapes: {old_models == new_models}')
+
+
+def synthetic_gene_positions(genes, rows_per_gene=50, seed=0):
+
+    # SL_&_mimic_positions.tsv rows of every gene, within the gene bounds
+    rng = np.random.default_rng(seed)
+    rows = np.repeat(np.arange(len(genes)), rows_per_gene)
+    start, end = genes['start'].to_numpy()[rows], genes['end'].to_numpy()[rows]
+
+    sl = rng.integers(0, 10001, len(rows)) / 100
+    hairpin = np.round((100 - sl) * rng.random(len(rows)), 2)
+    dataset = pd.DataFrame({'gene': pd.Categorical(genes['CDS'].to_numpy()[rows]),
+                            'position': (start + rng.random(len(rows)) * (end - start)).astype('int32'),
+                            'total': rng.integers(1, 500, len(rows)).astype('int32'),
+                            '%SL': sl.astype('float32'), '%hairpin': hairpin.astype('float32'),
+                            '%unidentified': np.abs(np.round(100 - sl - hairpin, 2)).astype('float32'),
+                            'SL2_ratio': np.where(rng.random(len(rows)) < 0.5, np.nan, rng.random(len(rows)))})
+
+    return dataset.drop_duplicates(['gene', 'position']).reset_index(drop=True)
+
+
+def benchmark_region_view(ngenes=20000, nqueries=200, seed=0):
+
+    genes, exons, _ = synthetic_genome(ngenes, seed=seed)
+    dataset = synthetic_gene_positions(genes, seed=seed)
+
+    genome = GenomeIndex(genes, exons)
+    positions, build_time = timed(PositionIndex, dataset, genome)
+    gene_index = {'genome': genome, 'positions': positions}
+
+    rng = np.random.default_rng(seed)
+    windows = [(genes['chromosome'].iloc[i], int(genes['start'].iloc[i]) - 50000, int(genes['start'].iloc[i]) + 50000)
+               for i in rng.integers(0, ngenes, nqueries)]
+
+    # rows of a window: chromosome of every row from its gene, then a boolean scan
+    chromosomes = dataset['gene'].map(genes.set_index('CDS')['chromosome']).astype(str)
+
+    def scan_window(chromosome, start, end):
+        found = dataset.loc[(chromosomes == chromosome) & dataset['position'].between(start, end)]
+        return found.sort_values('position', kind='mergesort').index.tolist()
+
+    scanned, scan_time = timed(lambda: [scan_window(*window) for window in windows])
+    found, window_time = timed(lambda: [dataset.index[positions.window(*window)].tolist() for window in windows])
+
+    print(f'region mode - {len(dataset):,} start positions of {ngenes} genes (position index build: {build_time:.3f}s)')
+    print(f'  {nqueries} windows of 100kb - scan: {scan_time:.3f}s | index: {window_time:.4f}s | same rows: {scanned == found}')
+
+    # figure of a window vs the whole chromosome
+    chromosome, start, end = windows[0]
+    length = int(genes.loc[genes['chromosome'] == chromosome, 'end'].max())
+
+    for label, (start, end), max_points in [('100kb window', (start, end), 5000),
+                                            ('2Mb window', (max(min(start, length - 2_000_000), 0),
+                                                            max(min(start, length - 2_000_000), 0) + 2_000_000), 5000),
+                                            (f'whole chromosome {chromosome}', (0, length), len(dataset))]:
+        (fig, region_genes, npositions), plot_time = timed(plot_region, dataset, chromosome, start, end, {}, gene_index,
+                                                           max_points=max_points)
+        print(f'  {label:<24} {npositions:>7,} positions, {len(region_genes):>4} genes | '
+              f'points sent: {len(fig.data[0].x):>7,} | payload: {len(fig.to_json()) / 1e6:>6.2f} MB | build: {plot_time:.3f}s')
+
+
+def load_in_process(mode, filepath, barrier, results):
+
+    # modules imported by the first load are not counted
+    warmup = f'{os.path.dirname(filepath)}/warmup.tsv'
+    read_table(warmup, 'dataset')
+    load_shared_table('warmup', [warmup], lambda: read_table(warmup, 'dataset'))
+    before = process_memory()
+
+    if mode == 'read_table':
+        frame = read_table(filepath, 'dataset')
+    else:
+        frame = load_shared_table('dataset', [filepath], lambda: read_table(filepath, 'dataset'), version='benchmark')
+
+    # measured while every process holds its table
+    barrier.wait()
+    after = process_memory()
+    results.put({key: after[key] - before[key] for key in after} | {'gene': frame['gene'].memory_usage(deep=True) / 1024 ** 2})
+    barrier.wait()
+
+
+def benchmark_shared_tables(nrows=2_000_000, ngenes=20000, nprocs=4):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        # SL_&_mimic_positions.tsv: categorical gene column & numeric columns
+        rng = np.random.default_rng(0)
+        pd.DataFrame({'gene': np.array([f'GENE{i}.1' for i in range(ngenes)])[np.sort(rng.integers(0, ngenes, nrows))],
+                      'position': rng.integers(1, 10 ** 7, nrows), 'total': rng.integers(1, 10 ** 4, nrows),
+                      '%SL': rng.integers(0, 10000, nrows) / 100, '%hairpin': rng.integers(0, 10000, nrows) / 100,
+                      '%unidentified': rng.integers(0, 10000, nrows) / 100}).to_csv(f'{tmp}/positions.tsv', sep='\t', index=None)
+        pd.read_csv(f'{tmp}/positions.tsv', sep='\t', nrows=10).to_csv(f'{tmp}/warmup.tsv', sep='\t', index=None)
+
+        # the shared table is built before the app processes start (as by the first one)
+        os.environ['ELEGANS_SHARED_DIR'] = tmp
+        load_shared_table('dataset', [f'{tmp}/positions.tsv'], lambda: read_table(f'{tmp}/positions.tsv', 'dataset'),
+                          version='benchmark')
+        load_shared_table('warmup', [f'{tmp}/warmup.tsv'], lambda: read_table(f'{tmp}/warmup.tsv', 'dataset'))
+
+        context = multiprocessing.get_context('spawn')
+        print(f'Shared tables - {nrows:,} rows, {nprocs} processes')
+
+        for mode in ['read_table', 'shared']:
+            barrier, results = context.Barrier(nprocs), context.Queue()
+            processes = [context.Process(target=load_in_process, args=(mode, f'{tmp}/positions.tsv', barrier, results))
+                         for _ in range(nprocs)]
+            for process in processes:
+                process.start()
+            memory = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+
+            print(f'  {mode:<10} resident: {np.mean([m["Rss"] for m in memory]):6.1f} MB per process | '
+                  f'proportional: {sum(m["Pss"] for m in memory):6.1f} MB for {nprocs} processes | '
+                  f'gene column: {memory[0]["gene"]:.1f} MB per process')
+
+
+if __name__ == '__main__':
+    benchmark_read_features()
+    benchmark_gene_lookup()
+    benchmark_gene_names()
+    benchmark_reference_rules()
+    benchmark_genome_index()
+    benchmark_region_view()
+    benchmark_shared_tables()
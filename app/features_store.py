@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+from schemas import read_table
+
+
+def get_store_filepaths():
+    path = os.getcwd()
+
+    tsv_file = f'{path}/app/src/features_dataset.tsv'
+    store_file = f'{path}/app/src/features_dataset.feather'
+    index_file = f'{path}/app/src/features_dataset_index.tsv'
+
+    return tsv_file, store_file, index_file
+
+
+def convert_features_dataset(tsv_file, store_file, index_file, chunksize=65536):
+
+    # one-time conversion: rows are grouped by isoform (keeping file order inside each isoform)
+    dataset = read_table(tsv_file, 'features_dataset')
+    dataset = dataset.sort_values('isoform', kind='mergesort').reset_index(drop=True)
+
+    # uncompressed so the file can be memory-mapped and sliced without decoding
+    feather.write_feather(dataset, store_file, compression='uncompressed', chunksize=chunksize)
+
+    # offset index: first row and number of rows for each isoform
+    codes, _ = pd.factorize(dataset['isoform'])
+    bounds = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1], True])
+
+    index = pd.DataFrame({'isoform': dataset['isoform'].values[bounds[:-1]], 'offset': bounds[:-1],
+                          'length': np.diff(bounds)})
+    index.to_csv(index_file, sep='\t', index=None)
+
+    return index
+
+
+def open_features_store(store_file, index_file):
+
+    if not (os.path.exists(store_file) and os.path.exists(index_file)):
+        return None
+
+    # memory-mapped: only the pages of the requested rows are read from disk
+    table = feather.read_table(store_file, memory_map=True)
+
+    index = pd.read_csv(index_file, sep='\t')
+    index = {isoform: (offset, length) for isoform, offset, length in
+             zip(index['isoform'], index['offset'], index['length'])}
+
+    return table, index
+
+
+def load_isoform_features(store, isoform):
+    table, index = store
+
+    offset, length = index.get(isoform, (0, 0))
+    return table.slice(offset, length).to_pandas()
+
+
+if __name__ == '__main__':
+    convert_features_dataset(*get_store_filepaths())
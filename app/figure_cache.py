@@ -0,0 +1,76 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class FigureCache:
+    """Bounded LRU cache for rendered figures (plotly json strings and image bytes).
+
+    Entries are evicted from the least recently used one when either the number of entries or
+    the total size of the stored values goes above its limit.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 ** 2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # shared by all streamlit sessions (threads) of the process
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        size = len(value)
+
+        # values larger than the whole cache are not stored
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+
+            self.entries[key] = value
+            self.size += size
+
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def get_or_create(self, key, create):
+        value = self.get(key)
+
+        if value is None:
+            value = create()
+            self.put(key, value)
+
+        return value
+
+    def stats(self):
+        with self.lock:
+            return dict(entries=len(self.entries), bytes=self.size, hits=self.hits, misses=self.misses,
+                        evictions=self.evictions)
+
+
+def create_figure_cache():
+
+    # limits can be set per deployment through environment variables
+    max_entries = int(os.environ.get('FIGURE_CACHE_MAX_ENTRIES', 256))
+    max_bytes = int(float(os.environ.get('FIGURE_CACHE_MAX_MB', 256)) * 1024 ** 2)
+
+    return FigureCache(max_entries=max_entries, max_bytes=max_bytes)
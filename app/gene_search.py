@@ -0,0 +1,56 @@
+from bisect import bisect_left
+
+
+class GeneNames(dict):
+    """CDS -> common name mapping, with reverse (name -> CDS), case-insensitive and prefix lookups.
+
+    Behaves as the plain dict previously returned by get_gene_ref, the lookup tables are built once.
+    """
+
+    def __init__(self, names):
+        super().__init__(names)
+
+        # name -> CDS, first CDS kept when a name is shared
+        self.cds = {}
+        for cds, name in self.items():
+            self.cds.setdefault(name, cds)
+
+        # lower-case CDS and names -> CDS
+        self.lower = {}
+        for cds, name in self.items():
+            self.lower.setdefault(cds.lower(), cds)
+        for name, cds in self.cds.items():
+            self.lower.setdefault(name.lower(), cds)
+
+        # sorted keys for prefix search
+        self.sorted_keys = sorted(self.lower)
+
+    def to_cds(self, text):
+        text = text.strip()
+
+        if text in self:
+            return text
+        if text in self.cds:
+            return self.cds[text]
+
+        return self.lower.get(text.lower())
+
+    def search(self, text, k=20):
+        prefix = text.strip().lower()
+        matches = []
+
+        # exact match first
+        if prefix in self.lower:
+            matches.append(self.lower[prefix])
+
+        # then keys starting with the prefix, in alphabetical order
+        for i in range(bisect_left(self.sorted_keys, prefix), len(self.sorted_keys)):
+            key = self.sorted_keys[i]
+            if len(matches) >= k or not key.startswith(prefix):
+                break
+
+            cds = self.lower[key]
+            if cds not in matches:
+                matches.append(cds)
+
+        return matches
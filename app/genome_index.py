@@ -0,0 +1,257 @@
+import numpy as np
+import pandas as pd
+from schemas import read_table
+
+
+def build_gene_index(table, column):
+
+    # sort rows by gene (keeping file order within a gene) so each gene is a contiguous slice
+    if not table[column].is_monotonic_increasing:
+        table = table.sort_values(column, kind='mergesort').reset_index(drop=True)
+
+    # boundaries between consecutive genes (works on object and categorical columns)
+    codes, _ = pd.factorize(table[column])
+    bounds = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1], True])
+    starts, stops = bounds[:-1], bounds[1:]
+
+    # missing gene names (code -1) are not indexed
+    keep = codes[starts] >= 0
+    genes = table[column].values[starts[keep]]
+
+    return table, dict(zip(genes, zip(starts[keep], stops[keep])))
+
+
+def gene_rows(table, gene, index=None, column='gene'):
+
+    # fallback to a full scan when no index is available
+    if index is None:
+        return table[table[column] == gene]
+
+    start, stop = index.get(gene, (0, 0))
+    return table.iloc[start:stop]
+
+
+def merge_intervals(starts, ends, groups=None):
+
+    # merge overlapping [start, end) intervals (within each group) with a sort and sweep
+    starts = np.asarray(starts)
+    ends = np.asarray(ends)
+    groups = np.zeros(len(starts), dtype=int) if groups is None else np.asarray(groups)
+
+    if len(starts) == 0:
+        return groups, starts, ends
+
+    order = np.lexsort((ends, starts, groups))
+    groups, starts, ends = groups[order], starts[order], ends[order]
+
+    # an interval opens a new block when it starts after the furthest end seen so far in its group
+    running_end = pd.Series(ends).groupby(groups, sort=False).cummax().values
+
+    new_block = np.ones(len(starts), dtype=bool)
+    new_block[1:] = (groups[1:] != groups[:-1]) | (starts[1:] >= running_end[:-1])
+
+    first = np.flatnonzero(new_block)
+    return groups[first], starts[first], np.maximum.reduceat(ends, first)
+
+
+def build_exon_sets(exons):
+
+    # merged exons and strand of every gene, computed once for all genes
+    groups, starts, ends = merge_intervals(exons['start'].values, exons['end'].values, exons['gene'].values)
+    strands = exons.sort_values('start', kind='mergesort').groupby('gene', observed=True)['strand'].first().to_dict()
+
+    bounds = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1], True])
+
+    return {groups[i]: (list(zip(starts[i:j].tolist(), ends[i:j].tolist())), strands[groups[i]])
+            for i, j in zip(bounds[:-1], bounds[1:])}
+
+
+class StrandIntervals:
+    """Genes of one chromosome & strand as NumPy arrays sorted by start.
+
+    rows are the positions of the genes in the genes table of the GenomeIndex. Overlap queries
+    use the running maximum of the ends: two binary searches, then a scan of the candidates only.
+    """
+
+    def __init__(self, starts, ends, rows):
+        order = np.lexsort((ends, starts))
+        self.starts, self.ends, self.rows = starts[order], ends[order], rows[order]
+        self.max_ends = np.maximum.accumulate(self.ends)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlapping(self, start, end):
+
+        # genes with gene_start <= end and gene_end >= start (inclusive coordinates, as in the GTF)
+        first = np.searchsorted(self.max_ends, start, 'left')
+        last = np.searchsorted(self.starts, end, 'right')
+
+        found = first + np.flatnonzero(self.ends[first:last] >= start)
+        return self.rows[found]
+
+
+class GenomeIndex:
+    """Genes and exons coordinates, loaded once and queried by gene or by genomic window.
+
+    genes: one row per gene (gene_column, chromosome, strand, start, end), exons: gene, strand, start, end.
+    Strands are '+' / '-' (1 / -1 are converted). Genes of each chromosome & strand are kept sorted
+    (see StrandIntervals): window and downstream gene queries are binary searches.
+    """
+
+    def __init__(self, genes, exons=None, gene_column='CDS'):
+        # 1 / -1 in prot_coding_gene_location.tsv
+        if pd.api.types.is_numeric_dtype(genes['strand']):
+            genes = genes.assign(strand=genes['strand'].map({1: '+', -1: '-'}))
+
+        self.genes, self.gene_slices = build_gene_index(genes, gene_column)
+        self.names = self.genes[gene_column].to_numpy(dtype=object)
+
+        self.exons, self.exon_slices = (None, {}) if exons is None else build_gene_index(exons, 'gene')
+        self.exon_sets = {} if exons is None else build_exon_sets(self.exons)
+
+        self.strands = {}
+        self.order = {}
+
+        self.chromosomes = self.genes['chromosome'].astype(str).to_numpy()
+        self.gene_strands = self.genes['strand'].astype(str).to_numpy()
+        self.starts, self.ends = self.genes['start'].to_numpy(), self.genes['end'].to_numpy()
+
+        for key in sorted(set(zip(self.chromosomes, self.gene_strands))):
+            rows = np.flatnonzero((self.chromosomes == key[0]) & (self.gene_strands == key[1]))
+            self.strands[key] = StrandIntervals(self.starts[rows], self.ends[rows], rows)
+
+            # position of each gene in its chromosome & strand (first row of a gene)
+            for i, row in enumerate(self.strands[key].rows.tolist()):
+                self.order.setdefault(self.names[row], (key, i))
+
+    @classmethod
+    def from_files(cls, genes_file, exons_file=None):
+        """Index of genes_coordinates.tsv & exon_coordinates.tsv (app/src or ref folder)."""
+
+        exons = None if exons_file is None else read_table(exons_file, 'exons')
+        return cls(read_table(genes_file, 'genes'), exons)
+
+    # Queries by gene
+
+    def gene(self, gene):
+        """(chromosome, strand, start, end) of a gene, None for unknown genes."""
+
+        start, stop = self.gene_slices.get(gene, (0, 0))
+        if start == stop:
+            return None
+
+        return self.chromosomes[start], self.gene_strands[start], self.starts[start], self.ends[start]
+
+    def exons_of(self, gene):
+        """Exon rows of a gene (file order)."""
+
+        return gene_rows(self.exons, gene, self.exon_slices)
+
+    def exon_set(self, gene):
+        """Merged exons of a gene as [(start, end)] sorted by start, and its strand. None for genes without exons."""
+
+        return self.exon_sets.get(gene)
+
+    def downstream_gene(self, gene):
+        """Next gene on the same strand (same order as the gene pairs of the Fig3 notebook), None for the last one."""
+
+        if gene not in self.order:
+            return None
+
+        key, i = self.order[gene]
+        i = i + 1 if key[1] == '+' else i - 1
+
+        intervals = self.strands[key]
+        return self.names[intervals.rows[i]] if 0 <= i < len(intervals) else None
+
+    # Queries by genomic window
+
+    def chromosome_end(self, chromosome):
+        """Largest gene end of a chromosome (0 for unknown chromosomes)."""
+
+        ends = [self.strands[key].max_ends[-1] for key in [(chromosome, '+'), (chromosome, '-')]
+                if key in self.strands and len(self.strands[key]) > 0]
+        return int(max(ends)) if ends else 0
+
+    def genes_in(self, chromosome, start, end, strand=None):
+        """Genes overlapping chromosome:start-end (both strands unless strand is given), sorted by start."""
+
+        keys = [(chromosome, strand)] if strand is not None else [(chromosome, '+'), (chromosome, '-')]
+        rows = [self.strands[key].overlapping(start, end) for key in keys if key in self.strands]
+        rows = np.concatenate(rows) if rows else np.array([], dtype=np.int64)
+
+        rows = rows[np.argsort(self.starts[rows], kind='mergesort')]
+        return self.names[rows].tolist()
+
+    def nearest_downstream(self, chromosome, strand, position):
+        """First gene starting after position on a strand ('-' strand: ordered by decreasing start), or None."""
+
+        intervals = self.strands.get((chromosome, strand))
+        if intervals is None:
+            return None
+
+        if strand == '+':
+            i = np.searchsorted(intervals.starts, position, 'right')
+        else:
+            i = np.searchsorted(intervals.starts, position, 'left') - 1
+
+        return self.names[intervals.rows[i]] if 0 <= i < len(intervals) else None
+
+    def gene_pairs(self):
+        """Successive genes of each chromosome & strand: upstream_gene, upstream_end, downstream_gene, sens.
+
+        Same table as the pairwise loop of the Fig3 notebook: on the '-' strand, genes are ordered by
+        decreasing start and upstream_end is the start of the upstream gene. Chromosomes are sorted,
+        '-' strand first (strand -1 before 1).
+        """
+
+        tables = []
+        for key in sorted(self.strands, key=lambda key: (key[0], key[1] == '+')):
+            intervals = self.strands[key]
+
+            if key[1] == '+':
+                rows, ends = intervals.rows, intervals.ends
+            else:
+                rows, ends = intervals.rows[::-1], intervals.starts[::-1]
+
+            tables.append(pd.DataFrame({'upstream_gene': self.names[rows[:-1]], 'upstream_end': ends[:-1],
+                                        'downstream_gene': self.names[rows[1:]], 'sens': key[1]}))
+
+        return pd.concat(tables, ignore_index=True)
+
+
+class PositionIndex:
+    """Rows of a position table (gene, position) grouped by chromosome and sorted by position.
+
+    The chromosome of a row is the one of its gene in the GenomeIndex (rows of unknown genes are
+    not indexed): the rows of a genomic window are found with two binary searches.
+    """
+
+    def __init__(self, table, genome, column='gene'):
+        codes, genes = pd.factorize(table[column])
+        chromosomes = np.array([None if genome.gene(gene) is None else genome.gene(gene)[0] for gene in genes] + [None],
+                               dtype=object)[codes]
+        positions = table['position'].to_numpy()
+
+        self.positions, self.rows = {}, {}
+        for chromosome in sorted(set(chromosomes.tolist()) - {None}):
+            rows = np.flatnonzero(chromosomes == chromosome)
+            rows = rows[np.argsort(positions[rows], kind='mergesort')]
+            self.positions[chromosome], self.rows[chromosome] = positions[rows], rows
+
+    def window(self, chromosome, start, end):
+        """Rows with start <= position <= end on a chromosome, sorted by position."""
+
+        if chromosome not in self.positions:
+            return np.array([], dtype=np.int64)
+
+        positions = self.positions[chromosome]
+        return self.rows[chromosome][np.searchsorted(positions, start, 'left'):np.searchsorted(positions, end, 'right')]
+
+
+def read_gene_locations(filepath):
+    """prot_coding_gene_location.tsv (Fig3 notebook) as a genes table for GenomeIndex(genes, gene_column='gene')."""
+
+    return pd.read_csv(filepath, sep='\t', names=['wormbaseID', 'gene', 'name', 'strand', 'chromosome', 'start', 'end'],
+                       dtype={'chromosome': str})
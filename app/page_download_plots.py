@@ -1,8 +1,7 @@
 import streamlit as st
-import plotly.io as pio
-from app_functions import plot_gene_start, get_reference_files
-import os
-from fpdf import FPDF
+from concurrent.futures.process import BrokenProcessPool
+from app_functions import get_reference_files, get_figure_cache, plot_title
+from batch_export import create_export_pool, export_plots_pdf
 
 
 def parse_input(_input):
@@ -16,21 +15,22 @@ def parse_input(_input):
 
 def convert_input(input_list, GENES, GENESNAME):
     converted = []
+    GENES = set(GENES)
 
     for gene in input_list:
 
         # CDS format
         if gene in GENES:
             converted.append(gene)
-        # Common name
-        elif gene in GENESNAME.values():
-            gene = [i for i, v in GENESNAME.items() if gene == v][0]
-            converted.append(gene)
+        # Common name (case-insensitive)
+        elif GENESNAME.to_cds(gene) is not None:
+            converted.append(GENESNAME.to_cds(gene))
 
     return converted
 
 
 def validate_input(gene_list, GENES):
+    GENES = set(GENES)
     invalid = [g for g in gene_list if g not in GENES]
     return (False, invalid) if invalid else (True, invalid)
 
@@ -50,14 +50,26 @@ def invalid_name_error(gene_list, container):
     container.markdown(header, unsafe_allow_html=True)
 
 
-def download_plots():
+def export_error(titles):
+    _list = ', '.join(titles[:50]) + (' etc...' if len(titles) > 50 else '')
+
+    header = ("<div style=\"background: #ffe2e0; font-size: 16px; padding: 10px; border-radius: 10px; "
+              "border: 1px solid DarkRed; margin: 10px;\"><div style=\"color: darkred;\"><strong>"
+              f"Plots that could not be rendered (left out of the report):</strong></div>{_list}</div>")
 
-    #### basic settings
-    # kaleido settings
-    pio.kaleido.scope.chromium_args = ("--headless", "--no-sandbox", "--single-process", "--disable-gpu")
+    st.markdown(header, unsafe_allow_html=True)
+
+
+@st.cache_resource(show_spinner=False)
+def get_export_pool():
+    # worker processes (and their kaleido instances) are kept alive between exports
+    return create_export_pool()
+
+
+def download_plots():
 
     # get files for computation
-    genes, exons, dataset, GENES, GENESNAME, ATGPOSITIONS = get_reference_files()
+    genes, exons, dataset, GENES, GENESNAME, ATGPOSITIONS, GENEINDEX = get_reference_files()
 
     #### custom css styling
     _style = """<style>.css-qrbaxs {margin-bottom: 0px; min-height: 0.5rem;}</style>"""
@@ -112,55 +124,43 @@ def download_plots():
 
         else:
 
-            # create pdf
-            pdf = FPDF(format=(180, 240), orientation="landscape")
-
             # create progress bar
             my_bar = processing.progress(0)
-            nb = len(gene_list)
-
-            for n, refgene in enumerate(processed_list, start=0):
+            nb = len(processed_list)
 
-                common = GENESNAME[refgene]
+            titles = [plot_title(refgene, GENESNAME[refgene]) for refgene in processed_list]
 
+            def update_progress(n, titleplot):
                 # update text
-                titleplot = f'{common} ({refgene})' if common != refgene else str(refgene)
                 percent = round(n/nb*100)
-                latest_iteration.write(f'processing {titleplot} - Completed:{n}/{nb} ({percent}%)')
+                latest_iteration.write(f'processed {titleplot} - Completed:{n}/{nb} ({percent}%)')
 
                 # update bar
-                prog = n / nb
-                my_bar.progress(prog)
-
-                gene_plot = plot_gene_start(dataset, refgene, genes, exons, ATGPOSITIONS, show_atg=True)
-
-                fig = gene_plot.update_layout(margin=dict(l=100, r=100, b=100, t=100), title_text=titleplot,
-                                              title_font_size=30, title_font_family='Roboto', title_font_color='black')
-
-                # save file
-                fig.write_image(f"fig{n}.png", width=1200, height=900, scale=2)
-
-                # add to report
-                pdf.add_page()
-                pdf.image(f"fig{n}.png", x=15, y=20, h=150, w=200)
-
-                # remove figures when added to pdf report to free space
-                os.remove(f"fig{n}.png")
+                my_bar.progress(n / nb)
+
+            # render plots on the worker processes and build report in memory
+            # a worker that died (chromium crash, out of memory) breaks the pool: it is replaced and the
+            # export is tried once more, plots rendered before the crash are taken from the cache
+            pdfbytes, failed = None, titles
+            for attempt in range(2):
+                try:
+                    pdfbytes, failed = export_plots_pdf(get_export_pool(), processed_list, titles,
+                                                        progress=update_progress, cache=get_figure_cache())
+                    break
+                except BrokenProcessPool:
+                    get_export_pool.clear()
 
             # finally
             my_bar = processing.progress(100)
-            latest_iteration.write(f'Completed:{nb}/{nb} (100%)')
+            latest_iteration.write(f'Completed:{nb - len(failed)}/{nb} ({round((nb - len(failed)) / nb * 100)}%)')
 
-            pdf.output('plots_archive.pdf')
+            if failed:
+                export_error(failed)
 
             # download report
-            with open('plots_archive.pdf', 'rb') as pdf_file:
-                pdfbytes = pdf_file.read()
-
-            st.download_button(label='Download file', data=pdfbytes, file_name='elegans_trans-splicing_plots.pdf',
-                               mime='application/octet-stream')
-
-            os.remove("plots_archive.pdf")
+            if pdfbytes is not None:
+                st.download_button(label='Download file', data=pdfbytes, file_name='elegans_trans-splicing_plots.pdf',
+                                   mime='application/octet-stream')
 
 
 if __name__ == '__main__':
@@ -21,9 +21,14 @@ def chose_gene(GENES, GENESNAME):
     with cols[1]:
         if choice == 'Select from list':
 
-            refgene = st.selectbox('Select:', options=GENESNAME.values())
-            gene = [i for i, v in GENESNAME.items() if refgene == v][0]
-            return gene, refgene
+            # only the best matches are sent to the browser
+            search = st.text_input('Search:', value='')
+            gene = st.selectbox('Select:', options=GENESNAME.search(search), format_func=GENESNAME.get)
+
+            if gene is None:
+                return None, None
+
+            return gene, GENESNAME[gene]
 
         elif choice == 'Type gene name':
 
@@ -33,10 +38,10 @@ def chose_gene(GENES, GENESNAME):
             if gene in GENES:
                 refgene = GENESNAME[gene]
 
-            # Common name
-            elif gene in GENESNAME.values():
-                refgene = gene
-                gene = [i for i, v in GENESNAME.items() if gene == v][0]
+            # Common name (case-insensitive)
+            elif GENESNAME.to_cds(gene) is not None:
+                gene = GENESNAME.to_cds(gene)
+                refgene = GENESNAME[gene]
 
             else:
                 gene = None
@@ -83,6 +88,66 @@ def display_error():
     st.markdown(gene_header, unsafe_allow_html=True)
 
 
+def chose_region(genome, GENESNAME):
+    header = '<span style="font-size:110%; font-weight: bold;">Chose region to plot:</span>'
+    st.markdown(header, unsafe_allow_html=True)
+
+    text = st.text_input('Type region or gene names: (ex: I:7,950,000-8,000,000 or lev-11, F40F8.10)', value='lev-11')
+    region = parse_region(text, genome, GENESNAME)
+
+    if region is None:
+        return None
+
+    # the window is kept between reruns, and reset when another region is typed
+    if st.session_state.get('region_input') != text:
+        st.session_state['region_input'] = text
+        st.session_state['region'] = region
+
+    cols = st.columns(4)
+    buttons = [('left', '◀ Move left'), ('zoom in', 'Zoom in'), ('zoom out', 'Zoom out'), ('right', 'Move right ▶')]
+
+    for col, (action, label) in zip(cols, buttons):
+        with col:
+            if st.button(label, use_container_width=True):
+                st.session_state['region'] = move_region(st.session_state['region'], action, genome)
+
+    return st.session_state['region']
+
+
+def display_region_error():
+    region_header = ("<div style=\"background: #ffe2e0; font-size: 16px; padding: 10px; border-radius: 10px; "
+                     "border: 1px solid DarkRed; margin: 10px;\"><div style=\"color: darkred;\"><strong>Requested "
+                     "region cannot be plotted.</strong></div><br />Regions are typed as chromosome:start-end "
+                     f"(at most {MAX_REGION:,}bp) or as gene names separated by commas, all on the same "
+                     "chromosome.</div>")
+
+    st.markdown(region_header, unsafe_allow_html=True)
+
+
+def region_plots(dataset, ATGPOSITIONS, GENEINDEX, GENESNAME):
+
+    region = chose_region(GENEINDEX['genome'], GENESNAME)
+
+    if region is None:
+        display_region_error()
+
+    else:
+        chromosome, start, end = region
+
+        # only the rows around the window are queried and sent to the browser
+        region_plot, genes, npositions = plot_region(dataset, chromosome, start, end, ATGPOSITIONS, GENEINDEX)
+
+        region_header = f'<div style="font-size: 20px; text-align: center;"><b>{chromosome}:{start:,}-{end:,}</b></div>'
+        st.markdown(region_header, unsafe_allow_html=True)
+        st.caption(f'{npositions:,} start positions | {len(genes)} genes: '
+                   f'{", ".join(GENESNAME.get(gene, gene) for gene in genes[:20])}{" ..." if len(genes) > 20 else ""}')
+
+        config = {'displayModeBar': False}
+        st.plotly_chart(region_plot, use_container_width=False, config=config)
+
+        legend()
+
+
 def plot_settings():
     st.sidebar.write('### 2. Customize plot:')
     return st.checkbox('Show known ATG positions (WS270)', value=True)
@@ -101,9 +166,16 @@ def display_gene_infos(gene, refgene):
 def interactive_plots():
 
     # open ref files and cache them
-    genes, exons, dataset, GENES, GENESNAME, ATGPOSITIONS = get_reference_files()
+    genes, exons, dataset, GENES, GENESNAME, ATGPOSITIONS, GENEINDEX = get_reference_files()
     transcript_length, exons_coord, isoforms = get_read_features_files()
 
+    # one gene, or every gene of a genomic region (operons)
+    mode = st.radio('Browse by:', options=['Gene', 'Genomic region'], horizontal=True)
+
+    if mode == 'Genomic region':
+        region_plots(dataset, ATGPOSITIONS, GENEINDEX, GENESNAME)
+        return
+
     # chose gene to plot
     gene, refgene = chose_gene(GENES, GENESNAME)
 
@@ -122,7 +194,8 @@ def interactive_plots():
             display_gene_infos(gene, refgene)
 
             # generate and show gene plot
-            gene_plot = plot_gene_start(dataset, gene, genes, exons, ATGPOSITIONS, show_atg=True)
+            gene_plot = cached_gene_plot(dataset, gene, genes, exons, ATGPOSITIONS, show_atg=True,
+                                         gene_index=GENEINDEX)
 
             config = {'displayModeBar': False}
             st.plotly_chart(gene_plot, use_container_width=False, config=config)
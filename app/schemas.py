@@ -0,0 +1,113 @@
+import os
+import multiprocessing
+import pandas as pd
+
+
+# explicit dtypes of the reference tables, columns not listed keep pandas defaults
+SCHEMAS = {
+    'exons': {'gene': 'category', 'transcript': 'category', 'chromosome': 'category', 'strand': 'category',
+              'start': 'int32', 'end': 'int32'},
+
+    'genes': {'CDS': 'category', 'chromosome': 'category', 'strand': 'category',
+              'start': 'int32', 'end': 'int32'},
+
+    # percentages are stored with 2 decimals and recovered exactly by rounding (see plot_gene_start)
+    'dataset': {'gene': 'category', 'position': 'int32', 'total': 'int32',
+                '%SL': 'float32', '%hairpin': 'float32', '%unidentified': 'float32'},
+
+    'atg': {'transcript': 'category', 'CDS_start': 'int32'},
+
+    # positions are written as floats by the pre-processing notebook (123.0, blank when missing): float32 keeps
+    # them exact up to 2**24 and reads both
+    'features_dataset': {'isoform': 'category', 'transcriptomic_start': 'float32', 'SC5': 'float32',
+                         'alignment_length': 'float32', 'SC3': 'float32',
+                         'SSP_FOUND': 'bool', 'ROBUST_SL_FOUND': 'bool', 'HAIRPIN_FOUND': 'bool',
+                         'SSP_dist': 'float32', 'SSP_size': 'float32', 'SL_distance': 'float32', 'SL_score': 'float32',
+                         'HAIRPIN_stem1_start': 'float32', 'HAIRPIN_stem1_end': 'float32',
+                         'HAIRPIN_stem2_start': 'float32', 'HAIRPIN_stem2_end': 'float32'},
+}
+
+REFERENCE_FILES = {'exons': 'exon_coordinates.tsv', 'genes': 'genes_coordinates.tsv',
+                   'dataset': 'SL_&_mimic_positions.tsv', 'atg': 'CDS_start_positions.tsv',
+                   'features_dataset': 'features_dataset.tsv'}
+
+
+def file_dtypes(columns, table):
+    schema = SCHEMAS[table]
+
+    # flags are stored as 0/1 in the files, converted to bool once read
+    return {col: ('uint8' if schema[col] == 'bool' else schema[col]) for col in columns if col in schema}
+
+
+def apply_schema(frame, table):
+    schema = SCHEMAS[table]
+    return frame.astype({col: dtype for col, dtype in schema.items() if col in frame.columns})
+
+
+def read_table(filepath, table, **kwargs):
+    columns = pd.read_csv(filepath, sep='\t', nrows=0).columns
+
+    frame = pd.read_csv(filepath, sep='\t', dtype=file_dtypes(columns, table), **kwargs)
+
+    # chunked reads return an iterator of frames
+    if kwargs.get('iterator') or kwargs.get('chunksize'):
+        return (apply_schema(chunk, table) for chunk in frame)
+
+    return apply_schema(frame, table)
+
+
+def process_memory():
+
+    # resident (Rss) & proportional (Pss: shared pages divided by the number of processes mapping them) memory, in MB
+    with open('/proc/self/smaps_rollup') as smaps:
+        values = dict(line.split()[:2] for line in smaps if line.split()[0] in ('Rss:', 'Pss:'))
+    return {key[:-1]: int(value) / 1024 for key, value in values.items()}
+
+
+def table_memory(filepath, table, schema, results):
+
+    # run in a fresh process: the first read imports the parser modules, it is not counted
+    read = (lambda **kwargs: read_table(filepath, table, **kwargs)) if schema else \
+        (lambda **kwargs: pd.read_csv(filepath, sep='\t', **kwargs))
+    read(nrows=10)
+
+    before = process_memory()['Rss']
+    frame = read()
+    results.put((process_memory()['Rss'] - before, frame.memory_usage(deep=True).sum() / 1024 ** 2))
+
+
+def memory_report(path=None):
+    """Resident memory added by reading each reference table with pandas defaults and with its schema.
+
+    Each table is read in its own process, so that memory released by a previous read is not reused. The size of
+    the DataFrame itself (memory_usage) is reported next to it: the difference is kept by the parser and allocator.
+    """
+    path = path or f'{os.getcwd()}/app/src'
+    context = multiprocessing.get_context('spawn')
+
+    rows = []
+    for table, filename in REFERENCE_FILES.items():
+
+        memory = {}
+        for schema in [False, True]:
+            results = context.Queue()
+            process = context.Process(target=table_memory, args=(f'{path}/{filename}', table, schema, results))
+            process.start()
+            memory[schema] = results.get()
+            process.join()
+
+        (default, default_frame), (compact, compact_frame) = memory[False], memory[True]
+        rows.append({'table': table, 'default RSS (MB)': round(default, 1), 'schema RSS (MB)': round(compact, 1),
+                     'ratio': round(default / compact, 2), 'default frame (MB)': round(default_frame, 1),
+                     'schema frame (MB)': round(compact_frame, 1)})
+
+    report = pd.DataFrame(rows)
+    total = report.drop(columns=['table', 'ratio']).sum()
+    report.loc[len(report)] = {'table': 'total', **total,
+                               'ratio': round(total['default RSS (MB)'] / total['schema RSS (MB)'], 2)}
+
+    return report
+
+
+if __name__ == '__main__':
+    print(memory_report().to_string(index=False))
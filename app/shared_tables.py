@@ -0,0 +1,85 @@
+import os
+import fcntl
+import hashlib
+import tempfile
+import pyarrow as pa
+import pyarrow.feather as feather
+
+
+def get_shared_dir():
+    shared_dir = os.environ.get('ELEGANS_SHARED_DIR')
+
+    # RAM-backed filesystem when available, so mapped tables never hit the disk
+    if shared_dir is None:
+        root = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        shared_dir = f'{root}/elegans-trans-splicing'
+
+    os.makedirs(shared_dir, exist_ok=True)
+    return shared_dir
+
+
+# bump when the way shared tables are built changes without a change of the loader versions
+TABLES_VERSION = 2
+
+
+def source_signature(sources, version=''):
+    # a shared table is rebuilt when one of its source files or the version of its loader changes
+    # (schema & arguments): tables written by a previous deploy are not attached
+    stats = [(os.path.basename(source), os.stat(source)) for source in sources]
+    loader = hashlib.sha256(f'{TABLES_VERSION}:{version}'.encode()).hexdigest()[:16]
+
+    return ';'.join([*(f'{name}:{stat.st_size}:{stat.st_mtime_ns}' for name, stat in stats), f'loader:{loader}'])
+
+
+def attach_table(shared_file, signature):
+
+    if not os.path.exists(shared_file):
+        return None
+
+    # memory-mapped: pages are shared by every process mapping the same file
+    table = feather.read_table(shared_file, memory_map=True)
+
+    if (table.schema.metadata or {}).get(b'source') != signature.encode():
+        return None
+
+    return table
+
+
+def write_table(frame, shared_file, signature):
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, b'source': signature.encode()})
+
+    # written next to the final file then renamed, readers never see a partial file
+    tmp_file = f'{shared_file}.{os.getpid()}.tmp'
+    # a single record batch: columns split in chunks would be concatenated (copied) by to_pandas
+    feather.write_feather(table, tmp_file, compression='uncompressed', chunksize=max(table.num_rows, 1))
+    os.replace(tmp_file, shared_file)
+
+
+def load_shared_table(name, sources, loader, version=''):
+    """DataFrame returned by loader(), built once per host and memory-mapped by every process.
+
+    version describes what loader() does (schema, sort column...): the shared table is rebuilt when it changes.
+    Only numeric columns without missing values are views of the mapped file: categorical and string
+    columns are converted in every process. Callers keep the result with st.cache_resource, so that this
+    happens once per process and not once per session (see benchmark_shared_tables).
+    """
+
+    shared_file = f'{get_shared_dir()}/{name}.arrow'
+    signature = source_signature(sources, version)
+
+    table = attach_table(shared_file, signature)
+
+    if table is None:
+        with open(f'{shared_file}.lock', 'w') as lock:
+
+            # only one process parses the source files, the others wait and attach
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            table = attach_table(shared_file, signature)
+            if table is None:
+                write_table(loader(), shared_file, signature)
+                table = attach_table(shared_file, signature)
+
+    # numeric columns without missing values are not copied, categorical & string columns are
+    return table.to_pandas(split_blocks=True)
@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+
+# set ELEGANS_PROFILE_STARTUP=1 to report import and reference files loading times
+ENABLED = os.environ.get('ELEGANS_PROFILE_STARTUP', '0') == '1'
+
+TIMINGS = []
+_LOCK = threading.Lock()
+
+# import nesting depth, per thread (the warm-up thread imports modules too)
+_STATE = threading.local()
+
+
+def import_depth():
+    return getattr(_STATE, 'depth', 0)
+
+
+def record(category, name, duration):
+    if not ENABLED:
+        return
+
+    with _LOCK:
+        TIMINGS.append((category, name, duration))
+
+    print(f'[startup] {category:<6} {name:<40} {duration:8.3f}s', file=sys.stderr)
+
+
+@contextmanager
+def timed_step(category, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(category, name, time.perf_counter() - start)
+
+
+class TimedLoader:
+    """Wraps a module loader to time the execution of the module (including its own imports)."""
+
+    def __init__(self, loader, depth):
+        self.loader = loader
+        self.depth = depth
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        _STATE.depth = self.depth + 1
+        try:
+            with timed_step('import', f'{"  " * self.depth}{module.__name__}'):
+                self.loader.exec_module(module)
+        finally:
+            _STATE.depth = self.depth
+
+
+class ImportTimer:
+    """Meta path finder recording the import time of top-level modules and their direct imports."""
+
+    max_depth = 2
+
+    def find_spec(self, name, path=None, target=None):
+        if import_depth() >= self.max_depth:
+            return None
+
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = TimedLoader(spec.loader, import_depth())
+                return spec
+
+        return None
+
+
+def install_import_timer():
+    if ENABLED and not any(isinstance(finder, ImportTimer) for finder in sys.meta_path):
+        sys.meta_path.insert(0, ImportTimer())
+
+
+def timings_table():
+    import pandas as pd
+
+    # the warm-up thread may still be recording
+    with _LOCK:
+        timings = list(TIMINGS)
+
+    return pd.DataFrame(timings, columns=['step', 'name', 'seconds'])
@@ -1,9 +1,43 @@
+from startup_profile import ENABLED, install_import_timer, timed_step, timings_table
+install_import_timer()
+
+import importlib
+import threading
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx
 from streamlit_option_menu import option_menu
-from app_functions import *
-from page_infos import display_informations
-from page_interactive_plots import interactive_plots
-from page_download_plots import download_plots
+
+
+def load_page(module, function):
+    # heavy plotting / export modules are only imported when their page is selected
+    with timed_step('import', f'page {module}'):
+        return getattr(importlib.import_module(module), function)
+
+
+def warm_reference_files():
+    from app_functions import get_reference_files
+    from tab_read_features import get_read_features_files
+
+    with timed_step('warm', 'get_reference_files'):
+        get_reference_files()
+
+    with timed_step('warm', 'get_read_features_files'):
+        get_read_features_files()
+
+
+@st.cache_resource(show_spinner=False)
+def start_warmup():
+    # reference tables are loaded in background while the user is still choosing a page / gene
+    thread = threading.Thread(target=warm_reference_files, name='warm-reference-files', daemon=True)
+    add_script_run_ctx(thread)
+    thread.start()
+
+    return thread
+
+
+def show_startup_profile():
+    with st.sidebar.expander('Startup profile'):
+        st.dataframe(timings_table().sort_values('seconds', ascending=False), use_container_width=True)
 
 
 def navigation_bar():
@@ -49,15 +83,21 @@ def main():
     # choose page to show
     page = navigation_bar()
 
+    # load reference files in background
+    start_warmup()
+
     # display selected page
     if page == 'Informations':
-        display_informations()
+        load_page('page_infos', 'display_informations')()
 
     elif page == 'Interactive plot':
-        interactive_plots()
+        load_page('page_interactive_plots', 'interactive_plots')()
 
     elif page == 'Download plot(s)':
-        download_plots()
+        load_page('page_download_plots', 'download_plots')()
+
+    if ENABLED:
+        show_startup_profile()
 
 
 if __name__ == '__main__':
@@ -1,4 +1,8 @@
-from app_functions import get_legend_filepath, img_to_bytes
+from app_functions import get_legend_filepath, img_to_bytes, merge_intervals
+from features_store import get_store_filepaths, open_features_store, load_isoform_features
+from schemas import read_table
+from shared_tables import load_shared_table
+from startup_profile import timed_step
 import pandas as pd
 import os
 import streamlit as st
@@ -7,32 +11,44 @@ from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 
 
-@st.cache_data(show_spinner=False)
+def load_features_table(name, filepath):
+    # parsed once per host, then memory-mapped by every app process (see shared_tables.py)
+    with timed_step('load', os.path.basename(filepath)):
+        return load_shared_table(name, [filepath], lambda: pd.read_csv(filepath, sep='\t'), version='read_csv')
+
+
+@st.cache_resource(show_spinner=False)
 def get_read_features_files():
 
     path = os.getcwd()
 
-    transcripts = pd.read_csv(f'{path}/app/src/transcripts_length.tsv',
-                              index_col='transcript', sep='\t')
-    TRANSCRIPTS = transcripts["size"].to_dict()
+    transcripts = load_features_table('transcripts_length', f'{path}/app/src/transcripts_length.tsv')
+    TRANSCRIPTS = transcripts.set_index('transcript')["size"].to_dict()
 
-    exons = pd.read_csv(f'{path}/app/src/exon_coordinates_full.txt', sep='\t')
-    isoforms = pd.read_csv(f'{path}/app/src/isoform_list.tsv', sep='\t')
+    exons = load_features_table('exon_coordinates_full', f'{path}/app/src/exon_coordinates_full.txt')
+    isoforms = load_features_table('isoform_list', f'{path}/app/src/isoform_list.tsv')
 
 
     return TRANSCRIPTS, exons, isoforms
 
+@st.cache_resource(show_spinner=False)
+def get_features_store():
+    _, store_file, index_file = get_store_filepaths()
+    return open_features_store(store_file, index_file)
+
+
 @st.cache_data(show_spinner=False)
 def get_features_dataset(isoform):
-    path = os.getcwd()
-
-    iter_csv = pd.read_csv(f'{path}/app/src/features_dataset.tsv', sep='\t', iterator=True, chunksize=1000)
-    return pd.concat([chunk[chunk['isoform'] == isoform] for chunk in iter_csv])
 
+    # isoform-partitioned store (see features_store.py) when it has been generated
+    store = get_features_store()
+    if store is not None:
+        return load_isoform_features(store, isoform)
 
-def overlapping_exons(start, end, exon):
-    x, y = exon
-    return not x <= start < y or x <= end < y
+    # fallback: scan the whole tsv file
+    tsv_file, _, _ = get_store_filepaths()
+    iter_csv = read_table(tsv_file, 'features_dataset', iterator=True, chunksize=1000)
+    return pd.concat([chunk[chunk['isoform'] == isoform] for chunk in iter_csv])
 
 
 def plotly_isoform_structure(fig, isoform, transcript_length, exons_coord):
@@ -53,20 +69,9 @@ def plotly_isoform_structure(fig, isoform, transcript_length, exons_coord):
     #### THEN DRAW EXONS
 
     # Process exons
-    exons_set = []
-
-    for _, exon in exons_coord.iterrows():
-
-        start = exon['cDNA coding start'] - 1
-        end = exon['cDNA coding end']
-
-        set_size = len(exons_set)
-
-        if set_size == 0:
-            exons_set.append((start, end))
-
-        elif all(overlapping_exons(start, end, exons_set[n]) for n in range(set_size)):
-            exons_set.append((start, end))
+    _, starts, ends = merge_intervals(exons_coord['cDNA coding start'].values - 1,
+                                      exons_coord['cDNA coding end'].values)
+    exons_set = list(zip(starts, ends))
 
     strand = exons_coord['Strand'].unique()[0]
     strand_color = {1: "LightPink", -1: "LightSkyBlue"}
@@ -99,36 +104,8 @@ def plotly_isoform_structure(fig, isoform, transcript_length, exons_coord):
     return transcript_start, transcript_end
 
 
-def plot_read_features(isoform, isoform_table, transcript_length, exons_coord):
-
-    totreads = len(isoform_table)
+def add_read_features(fig, isoform_table):
 
-    if totreads <= 50:
-        row_heights = [6, 4]
-        height = 200
-    elif 50 < totreads <= 500:
-        row_heights = [2, 8]
-        height = 500
-    elif 500 < totreads <= 1000:
-        row_heights = [1, 9]
-        height = 800
-    else:
-        row_heights = [0.5, 9.5]
-        height = 1500
-
-    # plot setting -----------------------
-    fig = make_subplots(rows=2, cols=1, row_heights=row_heights, shared_xaxes=True, vertical_spacing=0.02)
-    fig.update_layout(height=height)
-
-    # Gene structure ----------------------
-    transcript_start, transcript_end = plotly_isoform_structure(fig, isoform, transcript_length, exons_coord)
-
-    # lock y axis range on gene model subplot and remove axis/grid/etc
-    fig.update_yaxes(fixedrange=True, range=[-1, 2], row=1, col=1)
-    fig.update_xaxes(visible=False, showgrid=False, row=1, col=1)
-    fig.update_yaxes(visible=False, showgrid=False, row=1, col=1)
-
-    # Read features ----------------------
     start_positions = []
     end_positions = []
 
@@ -191,6 +168,110 @@ def plot_read_features(isoform, isoform_table, transcript_length, exons_coord):
                                      line=dict(color='#3c9152'),
                                      hovertext='HAIRPIN', hoverinfo='text'), row=2, col=1)
 
+    return start_positions, end_positions, ymax
+
+
+def segments_trace(x0, x1, y, hovertext, **line):
+
+    # all segments of a feature class in a single trace, separated by None gaps
+    gaps = np.full(len(y), None)
+    x = np.column_stack((x0, x1, gaps)).ravel()
+    y = np.column_stack((y, y, gaps)).ravel()
+
+    return go.Scatter(x=x, y=y, mode='lines', line=line, hovertext=hovertext, hoverinfo='text')
+
+
+def add_read_features_batched(fig, isoform_table):
+
+    idx = isoform_table.index.values
+    ymax = idx[-1]
+
+    # offset transcriptomic start
+    offset = isoform_table['transcriptomic_start'].astype(int).values
+
+    # Read regions ( 5'SC, alignment, 3'SC ) -------------
+    sc5_start = isoform_table['SC5'].values + offset
+    aln_start = offset
+    aln_end = isoform_table['alignment_length'].values + offset
+    sc3_end = isoform_table['SC3'].values + offset
+
+    traces = [segments_trace(sc5_start, aln_start, idx, "5' soft-clip", color='rgba(173,216,230,0.2)'),
+              segments_trace(aln_start, aln_end, idx, "Alignement", color='rgba(128,128,128,0.2)'),
+              segments_trace(aln_end, sc3_end, idx, "3' soft-clip", color='rgba(255,182,193,0.2)')]
+
+    # SSP sequence ------------------------
+    found = (isoform_table['SSP_FOUND'] == 1).values
+    if found.any():
+        ssp = isoform_table[found]
+        ssp_distance = ssp['SSP_dist'].astype(int).values + offset[found]
+        ssp_size = ssp['SSP_size'].astype(int).values
+        traces.append(segments_trace(ssp_distance - ssp_size, ssp_distance, ssp.index.values, 'SSP sequence',
+                                     color='orange'))
+
+    # SPLICE LEADER sequence ------------------
+    found = (isoform_table['ROBUST_SL_FOUND'] == 1).values
+    if found.any():
+        sl = isoform_table[found]
+        sldist = sl['SL_distance'].astype(int).values + offset[found]
+        slscore = sl['SL_score'].astype(int).values
+        traces.append(segments_trace(sldist - slscore, sldist, sl.index.values, 'SL sequence', color='#d40f2c'))
+
+    # HAIRPIN sequence ---------------------
+    found = (isoform_table['HAIRPIN_FOUND'] == 1).values
+    if found.any():
+        hairpin = isoform_table[found]
+
+        s1_start = hairpin['HAIRPIN_stem1_start'].values + offset[found]
+        s1_end = hairpin['HAIRPIN_stem1_end'].values + offset[found]
+
+        s2_start = hairpin['HAIRPIN_stem2_start'].values + offset[found]
+        s2_end = hairpin['HAIRPIN_stem2_end'].values + offset[found]
+
+        y = hairpin.index.values
+        traces.append(segments_trace(s1_start, s1_end, y, 'HAIRPIN', color='#89e0a0'))
+        traces.append(segments_trace(s1_end, s2_start, y, 'HAIRPIN', color='black', dash='dot'))
+        traces.append(segments_trace(s2_start, s2_end, y, 'HAIRPIN', color='#3c9152'))
+
+    fig.add_traces(traces, rows=2, cols=1)
+
+    return sc5_start, sc3_end, ymax
+
+
+def plot_read_features(isoform, isoform_table, transcript_length, exons_coord, batched=True):
+
+    totreads = len(isoform_table)
+
+    if totreads <= 50:
+        row_heights = [6, 4]
+        height = 200
+    elif 50 < totreads <= 500:
+        row_heights = [2, 8]
+        height = 500
+    elif 500 < totreads <= 1000:
+        row_heights = [1, 9]
+        height = 800
+    else:
+        row_heights = [0.5, 9.5]
+        height = 1500
+
+    # plot setting -----------------------
+    fig = make_subplots(rows=2, cols=1, row_heights=row_heights, shared_xaxes=True, vertical_spacing=0.02)
+    fig.update_layout(height=height)
+
+    # Gene structure ----------------------
+    transcript_start, transcript_end = plotly_isoform_structure(fig, isoform, transcript_length, exons_coord)
+
+    # lock y axis range on gene model subplot and remove axis/grid/etc
+    fig.update_yaxes(fixedrange=True, range=[-1, 2], row=1, col=1)
+    fig.update_xaxes(visible=False, showgrid=False, row=1, col=1)
+    fig.update_yaxes(visible=False, showgrid=False, row=1, col=1)
+
+    # Read features ----------------------
+    if batched:
+        start_positions, end_positions, ymax = add_read_features_batched(fig, isoform_table)
+    else:
+        start_positions, end_positions, ymax = add_read_features(fig, isoform_table)
+
     # add x and y axis labels ---------------------------------
     fig['layout']['yaxis2']['title'] = '<b>Number of reads</b>'
     fig['layout']['xaxis2']['title'] = '<b>Reference transcript bases (nt)</b>'
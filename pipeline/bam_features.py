@@ -0,0 +1,310 @@
+import os
+import copy
+import re
+import shutil
+from multiprocessing import Pool
+import pysam
+import pandas as pd
+from softclip_store import StoreWriter, merge_stores
+
+
+# Convert isoform name into gene name
+# ex: MTCE.35.1 -> MTCE.35
+def isoform_to_gene(isoform):
+    match = re.search(r"\w+.\d+", isoform)
+    return match.group(0) if match is not None else None
+
+
+def is_primary(read):
+    # Only take into account primary reads
+    return not read.is_unmapped and not read.is_secondary and not read.is_supplementary and \
+        read.query_sequence is not None
+
+
+class GenomicStats:
+    """Read name, chromosome, genomic start & end positions (see genomic_stats in pre-processing notebook)."""
+
+    header_lines = 1
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.rows = []
+
+    def open(self):
+        self.rows = []
+
+    def add(self, read, seq, reference):
+        # 0-based start, end points to one past last coordinate
+        self.rows.append((read.query_name, reference, read.reference_start + 1, read.reference_end))
+
+    def close(self):
+        table = pd.DataFrame(self.rows, columns=['read', 'chromosome', 'genomic_start', 'genomic_end'])
+        table.to_csv(self.output_file, sep='\t', index=None)
+
+
+class TranscriptomicStats:
+    """Read name, isoform, transcriptomic positions, orientation and regions length
+    (see transcriptomic_stats in pre-processing notebook)."""
+
+    columns = ['read', 'isoform', 'read_orientation', 'softclip', 'transcriptomic_start', 'transcriptomic_end',
+               'sequence_length', 'alignment_length', 'SC5', 'alignment_start', 'alignment_end', 'SC3']
+
+    header_lines = 1
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.rows = []
+
+    def open(self):
+        self.rows = []
+
+    def add(self, read, seq, reference):
+        aln_start = read.query_alignment_start
+        aln_end = read.query_alignment_end
+        seq_length = len(seq)
+
+        # soft-clips: 5' soft-clip ranges from -n to 0 with n being the alignment start
+        self.rows.append((read.query_name, reference, 'antisense' if read.is_reverse else 'sense',
+                          1 if aln_start > 80 else 0, read.reference_start + 1, read.reference_end,
+                          seq_length, len(seq[aln_start:aln_end]), -aln_start, aln_start, aln_end,
+                          len(seq[aln_start:])))
+
+    def close(self):
+        dataframe = pd.DataFrame(self.rows, columns=self.columns)
+
+        # Find gene_ID with isoform value
+        dataframe['gene'] = dataframe['isoform'].apply(isoform_to_gene)
+
+        dataframe = dataframe[['read', 'gene'] + self.columns[1:]]
+        dataframe.to_csv(self.output_file, sep='\t', index=None)
+
+
+class SoftclipFasta:
+    """5' soft-clip sequences written as fasta, followed by the first ALN aligned bases.
+
+    SC=None keeps the full soft-clip (extract_full_softclip), otherwise only its last SC bases
+    (extract_softclip_end).
+    """
+
+    header_lines = 0
+
+    def __init__(self, output_file, SC=None, ALN=0):
+        self.output_file = output_file
+        self.SC = SC
+        self.ALN = ALN
+        self.file = None
+
+    def open(self):
+        self.file = open(self.output_file, 'w+')
+
+    def softclip(self, read, seq):
+        start = read.query_alignment_start
+
+        if self.SC is not None and start > self.SC:
+            return seq[(start - self.SC):(start + self.ALN)]
+        return seq[:(start + self.ALN)]
+
+    def add(self, read, seq, reference):
+        self.file.write(f'>{read.query_name}\n{self.softclip(read, seq)}\n')
+
+    def close(self):
+        self.file.close()
+        self.file = None
+
+
+class SoftclipBinary(SoftclipFasta):
+    """Same sequences as SoftclipFasta, written to a soft-clip store (see softclip_store.py)
+    so that motif searches read them without parsing fasta."""
+
+    def open(self):
+        self.file = StoreWriter(self.output_file)
+        self.file.open()
+
+    def add(self, read, seq, reference):
+        self.file.add(read.query_name, self.softclip(read, seq))
+
+    def merge(self, shard_files):
+        merge_stores(self.output_file, shard_files)
+
+
+def process_bam(input_file, extractors, threads=4, regions=None):
+
+    for extractor in extractors:
+        extractor.open()
+
+    # single pass: every primary read is sent to all extractors
+    # threads are used by htslib for BGZF decompression
+    with pysam.AlignmentFile(input_file, 'rb', threads=threads) as alignments:
+
+        if regions is None:
+            reads = alignments
+        else:
+            # reads overlapping the previous region are skipped, each read is seen once
+            reads = (read for contig, start, stop in regions
+                     for read in alignments.fetch(contig, start, stop) if read.reference_start >= start)
+
+        for read in reads:
+            if is_primary(read):
+                seq = read.query_sequence
+                reference = read.reference_name
+
+                for extractor in extractors:
+                    extractor.add(read, seq, reference)
+
+    for extractor in extractors:
+        extractor.close()
+
+
+def plan_shards(input_file, nshards, region_size=5_000_000):
+
+    # (contig, start, stop, expected reads) in file order, long contigs are split in regions
+    regions = []
+    with pysam.AlignmentFile(input_file, 'rb') as alignments:
+        if not alignments.has_index():
+            raise FileNotFoundError(f'{input_file}: no index found, sharded processing needs a .bai index '
+                                    f'(samtools index {input_file})')
+
+        mapped = {stat.contig: stat.mapped for stat in alignments.get_index_statistics()}
+
+        for contig, length in zip(alignments.references, alignments.lengths):
+            if mapped.get(contig, 0) == 0:
+                continue
+            for start in range(0, length, region_size):
+                stop = min(start + region_size, length)
+                regions.append((contig, start, stop, mapped[contig] * (stop - start) / length))
+
+    total = sum(region[3] for region in regions)
+
+    # consecutive regions grouped in shards of about the same number of reads
+    shards, shard, count = [], [], 0
+    for contig, start, stop, expected in regions:
+        shard.append((contig, start, stop))
+        count += expected
+        if count >= total * (len(shards) + 1) / nshards:
+            shards.append(shard)
+            shard = []
+    if shard:
+        shards.append(shard)
+
+    return shards
+
+
+def shard_extractors(extractors, index):
+    shard = [copy.copy(extractor) for extractor in extractors]
+
+    for extractor in shard:
+        extractor.output_file = f'{extractor.output_file}.shard{index}'
+
+    return shard
+
+
+def process_shard(args):
+    input_file, regions, extractors = args
+    process_bam(input_file, extractors, threads=1, regions=regions)
+
+
+def merge_shards(extractors, shards):
+
+    # shards outputs are concatenated in file order, keeping a single header
+    # (binary outputs are merged by their extractor)
+    for i, extractor in enumerate(extractors):
+        shard_files = [shard[i].output_file for shard in shards]
+
+        if hasattr(extractor, 'merge'):
+            extractor.merge(shard_files)
+        else:
+            with open(extractor.output_file, 'wb') as output:
+                for j, shard_file in enumerate(shard_files):
+                    with open(shard_file, 'rb') as file:
+                        if j > 0:
+                            for _ in range(extractor.header_lines):
+                                file.readline()
+                        shutil.copyfileobj(file, output)
+
+        for shard_file in shard_files:
+            os.remove(shard_file)
+
+
+def mapped_reads(input_file):
+    # from the BAM index, BAM files without index are never sharded
+    with pysam.AlignmentFile(input_file, 'rb') as alignments:
+        return alignments.mapped if alignments.has_index() else 0
+
+
+def plan_tasks(jobs, workers=4, shards_per_worker=4, region_size=5_000_000, min_reads=2_000_000):
+
+    # jobs: [(input_file, extractors)] -> tasks of process_shard & shards of each job (None if processed whole)
+    # a run larger than min_reads and than an even share of all reads (a straggler) is split in shards,
+    # so that it is spread over every core; other runs are processed whole, as with process_bam
+    # (on small runs or a single core, shards only add the cost of region queries & merges)
+    sizes = [mapped_reads(input_file) for input_file, _ in jobs]
+    share = sum(sizes) / workers
+
+    tasks, job_shards = [], []
+    for (input_file, extractors), size in zip(jobs, sizes):
+
+        if workers < 2 or size <= max(min_reads, share):
+            tasks.append((input_file, None, extractors))
+            job_shards.append(None)
+            continue
+
+        shards = []
+        for regions in plan_shards(input_file, workers * shards_per_worker, region_size):
+            shards.append(shard_extractors(extractors, f'{len(job_shards)}.{len(shards)}'))
+            tasks.append((input_file, regions, shards[-1]))
+        job_shards.append(shards)
+
+    return tasks, job_shards
+
+
+def merge_jobs(jobs, job_shards):
+    for (input_file, extractors), shards in zip(jobs, job_shards):
+        if shards is not None:
+            merge_shards(extractors, shards)
+
+
+def process_bams_sharded(jobs, workers=4, shards_per_worker=4, region_size=5_000_000, min_reads=2_000_000):
+
+    # the shards & whole runs of all BAMs go through the same pool
+    tasks, job_shards = plan_tasks(jobs, workers, shards_per_worker, region_size, min_reads)
+
+    with Pool(workers) as p:
+        p.map(process_shard, tasks, chunksize=1)
+
+    merge_jobs(jobs, job_shards)
+
+
+# Extractors and file names of the pre-processing notebook
+
+def genome_jobs(ID, path):
+    return f'{path}/{ID}/{ID}-genome_sorted.bam', [GenomicStats(f'{path}/{ID}-genomic_stats.tsv')]
+
+
+def transcriptome_jobs(ID, path):
+    extractors = [TranscriptomicStats(f'{path}/{ID}-transcriptome_stats.tsv'),
+                  SoftclipFasta(f'{path}/{ID}/{ID}-five_prime_softclip[SC=FULL|ALN=80].fa', ALN=80),
+                  SoftclipFasta(f'{path}/{ID}/{ID}-five_prime_softclip[SC=100|ALN=20].fa', SC=100, ALN=20)]
+
+    return f'{path}/{ID}/{ID}-transcriptome_sorted.bam', extractors
+
+
+# Handler functions
+
+def genome_features_handler(ID, path, threads=4):
+    process_bam(*genome_jobs(ID, path), threads=threads)
+
+    print(f'Completed run {ID}\n')
+
+
+def transcriptome_features_handler(ID, path, threads=4):
+    process_bam(*transcriptome_jobs(ID, path), threads=threads)
+
+    print(f'Completed run {ID}\n')
+
+
+def all_features_sharded(runs, path, workers=4):
+    jobs = [genome_jobs(ID, path) for ID in runs] + [transcriptome_jobs(ID, path) for ID in runs]
+
+    process_bams_sharded(jobs, workers=workers)
+
+    print(f'Completed runs {", ".join(runs)}\n')
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+from bam_features import process_bam
+
+
+class QualityProfile:
+    """Running sum of base qualities and number of reads at each position of a region.
+
+    Arrays grow on demand (doubling), memory depends on the longest region, not on the number of reads.
+    """
+
+    def __init__(self, size=1024):
+        self.sums = np.zeros(size, dtype=np.int64)
+        self.ends = np.zeros(size + 1, dtype=np.int64)
+        self.length = 0
+
+    def grow(self, size):
+        size = max(size, 2 * len(self.sums))
+        self.sums = np.concatenate([self.sums, np.zeros(size - len(self.sums), dtype=np.int64)])
+        self.ends = np.concatenate([self.ends, np.zeros(size + 1 - len(self.ends), dtype=np.int64)])
+
+    def add(self, qualities):
+        n = len(qualities)
+        if n > len(self.sums):
+            self.grow(n)
+
+        self.sums[:n] += qualities
+        self.ends[n] += 1
+        self.length = max(self.length, n)
+
+    def counts(self):
+
+        # reads covering position i: reads of length > i
+        return np.cumsum(self.ends[:self.length + 1][::-1])[::-1][1:]
+
+    def means(self):
+        return (self.sums[:self.length] / self.counts()).tolist()
+
+    def table(self):
+        return pd.DataFrame({'position': np.arange(self.length), 'reads': self.counts(),
+                             'quality_sum': self.sums[:self.length]})
+
+    def add_table(self, table):
+        positions = table['position'].to_numpy()
+        if len(positions) == 0:
+            return
+        if positions.max() + 1 > len(self.sums):
+            self.grow(positions.max() + 1)
+
+        self.sums[positions] += table['quality_sum'].to_numpy()
+
+        # reads ending at i: reads covering i - 1 but not i
+        reads = np.zeros(positions.max() + 2, dtype=np.int64)
+        reads[positions] = table['reads'].to_numpy()
+        self.ends[1:len(reads)] += reads[:-1] - reads[1:]
+        self.length = max(self.length, positions.max() + 1)
+
+
+class BaseQuality:
+    """Mean base quality at each position of the aligned and 5' soft-clipped regions of antisense reads
+    with a soft-clip longer than min_softclip bases (extract_BaseQuality in the Fig1 notebook).
+
+    Qualities are added to the running sums of each region straight from the pysam arrays, one read at a time.
+    The table written (region, position from the alignment start, reads, sum of qualities) is additive:
+    tables of several shards or BAM files are merged by summing them.
+    """
+
+    header_lines = 1
+
+    def __init__(self, output_file, min_softclip=80):
+        self.output_file = output_file
+        self.min_softclip = min_softclip
+        self.aligned = QualityProfile()
+        self.unaligned = QualityProfile()
+
+    def open(self):
+        self.aligned = QualityProfile()
+        self.unaligned = QualityProfile()
+
+    def add(self, read, seq, reference):
+        qualities = read.query_qualities
+
+        if qualities is not None and read.is_reverse:
+            start = read.query_alignment_start
+
+            if start > self.min_softclip:
+                qualities = np.frombuffer(qualities, dtype=np.uint8)
+
+                # soft-clip qualities from the alignment start
+                self.aligned.add(qualities[start:read.query_alignment_end])
+                self.unaligned.add(qualities[start - 1::-1])
+
+    def close(self):
+        if self.output_file is not None:
+            table = pd.concat([self.aligned.table().assign(region='aligned'),
+                               self.unaligned.table().assign(region='unaligned')])
+            table[['region', 'position', 'reads', 'quality_sum']].to_csv(self.output_file, sep='\t', index=None)
+
+    def merge(self, shard_files):
+        self.open()
+        for shard_file in shard_files:
+            self.read(shard_file)
+        self.close()
+
+    def read(self, input_file):
+        table = pd.read_csv(input_file, sep='\t')
+        self.aligned.add_table(table.loc[table['region'] == 'aligned'])
+        self.unaligned.add_table(table.loc[table['region'] == 'unaligned'])
+        return self
+
+    def profile(self):
+        """(total, xUnaligned, xAligned, yUnaligned, yAligned) as returned by extract_BaseQuality."""
+
+        aligned, unaligned = self.aligned.means(), self.unaligned.means()[::-1]
+        total = int(self.unaligned.counts()[0]) if self.unaligned.length > 0 else 0
+
+        # same axes as the notebook: the unaligned profile ends with the first aligned base (position 0)
+        avg = unaligned + aligned
+        return total, list(range(-len(unaligned), 1)), list(range(len(aligned))), \
+            avg[:len(unaligned) + 1], avg[len(unaligned):]
+
+
+# Handler function (Fig1 notebook: run SSP_1)
+
+def base_quality_handler(ID, path, threads=4):
+    extractor = BaseQuality(f'{path}/{ID}/{ID}-base_quality.tsv')
+    process_bam(f'{path}/{ID}/{ID}-transcriptome_sorted.bam', [extractor], threads=threads)
+
+    total, xUnaligned, xAligned, yUnaligned, yAligned = extractor.profile()
+    print(f'Total number of reads used for calculating base quality: {total} reads')
+
+    return total, xUnaligned, xAligned, yUnaligned, yAligned
@@ -0,0 +1,884 @@
+import os
+import json
+import time
+import heapq
+import filecmp
+import tempfile
+import tracemalloc
+from unittest import mock
+import numpy as np
+import pandas as pd
+import pysam
+import reference
+from multiprocessing import Pool
+from base_quality import BaseQuality
+from bam_features import process_bam, process_bams_sharded, process_shard, plan_tasks, merge_jobs, GenomicStats, TranscriptomicStats, SoftclipFasta, SoftclipBinary
+from softclip_store import SoftclipStore, read_softclips, fasta_to_store
+from ssp_search import search_SSP, SSP_SEQUENCE
+from sl_search import search_spliced_leaders
+from hairpin_search import hairpin_search
+from motif_search import scan_motifs, motif_tables
+import rules
+from dataset import assemble_dataset, run_files, motif_run_files, concatenate_tables
+from liftover import Liftover, read_liftover_files
+from workflow import run_pipeline, run_paths, reference_paths
+from positions import count_positions, position_stats, locus_bias, ssp_at_main_tss, position_counts_handler, \
+    update_position_stats
+from Bio import SeqIO
+from Bio.Seq import reverse_complement
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def random_sequence(rng, length):
+    return ''.join(rng.choice(list('ACGT'), length))
+
+
+def mutate(rng, seq, rate):
+    bases = [rng.choice(list('ACGT')) if rng.random() < rate else base for base in seq]
+    return ''.join(bases)
+
+
+def synthetic_spliced_leaders(nvariants=10, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    # SL1, SL2 and SL2-like variants
+    leaders = {'SL1': 'GGTTTAATTACCCAAGTTTGAG', 'SL2': 'GGTTTTAACCCAGTTACTCAAG'}
+    for i in range(nvariants):
+        leaders[f'SL2_{i}'] = mutate(rng, leaders['SL2'], 0.15)
+
+    return leaders
+
+
+def synthetic_softclips(output_file, leaders, nreads=5000, aligned=20, seed=0):
+
+    rng = np.random.default_rng(seed)
+    names = list(leaders)
+
+    with open(output_file, 'w') as fasta:
+        for i in range(nreads):
+            seq = random_sequence(rng, int(rng.integers(0, 100)))
+
+            # 2/3 of the reads end with a (partial, mutated) SL, a few bases before the alignment start
+            if rng.random() < 0.66:
+                sl = leaders[names[int(rng.integers(0, len(names)))]]
+                seq += mutate(rng, sl[-int(rng.integers(5, len(sl) + 1)):], 0.05) + random_sequence(rng, int(rng.integers(0, 4)))
+
+            seq = (seq + random_sequence(rng, aligned))[-(100 + aligned):]
+
+            # some unknown bases
+            if rng.random() < 0.05:
+                seq = ''.join('N' if rng.random() < 0.05 else base for base in seq)
+
+            fasta.write(f'>read{i}\n{seq}\n')
+
+
+def synthetic_hairpins(output_file, nreads=1000, aligned=80, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    with open(output_file, 'w') as fasta:
+        for i in range(nreads):
+
+            # 5' soft-clip from 0 to 300 bases, half of them folding back on themselves (stem - loop - stem)
+            seq = random_sequence(rng, int(rng.integers(0, 300)))
+            if rng.random() < 0.5:
+                stem = random_sequence(rng, 12)
+                seq += stem + random_sequence(rng, int(rng.integers(1, 10))) + mutate(rng, reverse_complement(stem), 0.1)
+
+            seq += random_sequence(rng, aligned)
+            if rng.random() < 0.05:
+                seq = ''.join('N' if rng.random() < 0.05 else base for base in seq)
+
+            fasta.write(f'>read{i}\n{seq}\n')
+
+
+def synthetic_runs(path, runs, nreads=20000, ngenes=500, seed=0):
+
+    rng = np.random.default_rng(seed)
+    genes = np.array([f'GENE{i}.{i % 5 + 1}' for i in range(ngenes)])
+    strands = {gene: '+' if i % 2 else '-' for i, gene in enumerate(genes)}
+
+    for ID in runs:
+        os.makedirs(f'{path}/{ID}', exist_ok=True)
+
+        reads = np.array([f'{ID}-{i:08x}' for i in rng.permutation(nreads)])
+        gene = genes[rng.integers(0, ngenes, nreads)]
+        start = rng.integers(1, 1500, nreads)
+        length = rng.integers(100, 1500, nreads)
+        sc5 = rng.integers(0, 200, nreads)
+
+        def sample(frame, fraction):
+            return frame[rng.random(len(frame)) < fraction]
+
+        # reads missing from the genome or transcriptome alignments are dropped from the dataset
+        sample(pd.DataFrame({'read': reads, 'chromosome': rng.choice(['I', 'II', 'III', 'IV', 'V', 'X'], nreads),
+                             'genomic_start': start * 7, 'genomic_end': start * 7 + length}), 0.97) \
+            .to_csv(f'{path}/{ID}-genomic_stats.tsv', sep='\t', index=None)
+
+        sample(pd.DataFrame({'read': reads, 'gene': gene, 'isoform': np.char.add(gene, '.1'),
+                             'read_orientation': rng.choice(['sense', 'antisense'], nreads),
+                             'softclip': (sc5 > 80).astype(int), 'transcriptomic_start': start,
+                             'transcriptomic_end': start + length, 'sequence_length': sc5 + length + 20,
+                             'alignment_length': length, 'SC5': -sc5, 'alignment_start': sc5,
+                             'alignment_end': sc5 + length, 'SC3': length + 20}), 0.97) \
+            .to_csv(f'{path}/{ID}-transcriptome_stats.tsv', sep='\t', index=None)
+
+        ssp_score = rng.integers(0, 27, nreads) * (rng.random(nreads) < 0.3)
+        pd.DataFrame({'read': reads, 'SSP_score': ssp_score, 'SSP_size': np.where(ssp_score > 0, 26, 0),
+                      'SSP_dist': np.where(ssp_score > 0, -rng.integers(0, 300, nreads), np.nan)}) \
+            .to_csv(f'{path}/{ID}/{ID}-SSP_search.tsv', sep='\t', index=None)
+
+        for name, fraction in [('SL_search', 0.6), ('SL_search_(2nd_pass)', 0.7)]:
+            sample(pd.DataFrame({'read': reads, 'SL': rng.choice(['SL1', 'SL2', 'SL2 / SL2_1'], nreads),
+                                 'score': rng.integers(5, 23, nreads), 'distance_to_start': -rng.integers(0, 8, nreads)}),
+                   fraction).to_csv(f'{path}/{ID}/{ID}-{name}.tsv', sep='\t', index=None)
+
+        score = rng.integers(0, 13, nreads)
+        stem1 = [f'({s}, {s + 12})' if value > 0 else None for s, value in zip(-sc5 + 10, score)]
+        stem2 = [f'({s}, {s + 12})' if value > 0 else None for s, value in zip(-sc5 + 30, score)]
+        pd.DataFrame({'read': reads, 'HAIRPIN_score': score, 'HAIRPIN_stem1': stem1, 'HAIRPIN_stem2': stem2,
+                      'HAIRPIN_loop': np.where(score > 0, rng.integers(0, 10, nreads), np.nan)}) \
+            .to_csv(f'{path}/{ID}/{ID}-HAIRPIN_search.tsv', sep='\t', index=None)
+
+    return strands
+
+
+def synthetic_annotation(gtf_file, exons_file, ntranscripts=2000, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    lines, exonics_positions = [], {}
+    position = 1000
+    for t in range(ntranscripts):
+        transcript, strand = f'T{t}.1', '+-'[t % 2]
+
+        lengths = rng.integers(50, 300, int(rng.integers(1, 7)))
+        introns = rng.integers(50, 2000, len(lengths))
+        starts = position + np.cumsum(introns) + np.r_[0, np.cumsum(lengths)[:-1]]
+        ends = starts + lengths - 1
+        position = int(ends[-1]) + 5000
+
+        attributes = f'gene_id "G{t}"; transcript_id "{transcript}";'
+        lines.append(f'I\tWormBase\ttranscript\t{starts[0]}\t{ends[-1]}\t.\t{strand}\t.\t{attributes}')
+
+        # exons are numbered along the transcript: from the right on the minus strand
+        order = range(len(lengths)) if strand == '+' else reversed(range(len(lengths)))
+        exons, first = {}, 1
+        for number, i in enumerate(order, 1):
+            lines.append(f'I\tWormBase\texon\t{starts[i]}\t{ends[i]}\t.\t{strand}\t.\t'
+                         f'{attributes} exon_number "{number}"; exon_id "{transcript}.e{number}";')
+            exons[str(number)] = [first, first + int(lengths[i]) - 1]
+            first += int(lengths[i])
+
+        exonics_positions[transcript] = exons
+
+        # a few transcripts with exons listed out of order (the notebook stops at the last exon number)
+        if t % 50 == 0 and len(exons) > 2:
+            keys = list(exonics_positions[transcript])
+            keys = [keys[0], keys[-1]] + keys[1:-1] if t % 100 == 0 else [keys[1], keys[0]] + keys[2:]
+            exonics_positions[transcript] = {key: exonics_positions[transcript][key] for key in keys}
+
+    with open(gtf_file, 'w') as gtf:
+        gtf.write('\n'.join(lines) + '\n')
+
+    with open(exons_file, 'w') as file:
+        json.dump(exonics_positions, file)
+
+    return exonics_positions
+
+
+def synthetic_bam(output_file, nreads=20000, ntranscripts=200, seed=0, qualities=False):
+
+    rng = np.random.default_rng(seed)
+
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'},
+              'SQ': [{'SN': f'SYN{i}.{i % 3 + 1}', 'LN': 3000} for i in range(ntranscripts)]}
+
+    reads = []
+    for i in range(nreads):
+
+        # 5' soft-clip of 0 to 200 bases (SL, SSP or adapter), aligned region, short 3' soft-clip
+        sc5, aln, sc3 = int(rng.integers(0, 200)), int(rng.integers(100, 1000)), int(rng.integers(0, 20))
+
+        read = pysam.AlignedSegment()
+        read.query_name = f'read{i}'
+        read.query_sequence = random_sequence(rng, sc5 + aln + sc3)
+        read.reference_id = int(rng.integers(0, ntranscripts))
+        read.reference_start = int(rng.integers(0, 1500))
+        read.cigartuples = [(op, length) for op, length in [(4, sc5), (0, aln), (4, sc3)] if length > 0]
+        read.mapping_quality = 60
+        if qualities:
+            read.query_qualities = pysam.qualitystring_to_array(''.join(rng.choice(list('+5?IS'), sc5 + aln + sc3)))
+
+        # unmapped, secondary and supplementary reads are filtered out
+        read.flag = int(rng.choice([0, 16, 256, 2048, 4], p=[0.45, 0.45, 0.04, 0.04, 0.02]))
+        if read.is_unmapped:
+            read.reference_id, read.reference_start, read.cigartuples = -1, -1, None
+
+        reads.append(read)
+
+    reads.sort(key=lambda read: (read.reference_id if read.reference_id >= 0 else ntranscripts, read.reference_start))
+
+    with pysam.AlignmentFile(output_file, 'wb', header=header) as bam:
+        for read in reads:
+            bam.write(read)
+
+    pysam.index(output_file)
+
+
+def benchmark_bam_features(nreads=20000, threads=4):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        bam = f'{tmp}/SYN-transcriptome_sorted.bam'
+        synthetic_bam(bam, nreads)
+
+        def separate_passes():
+            reference.genomic_stats(bam, f'{tmp}/old-genomic_stats.tsv')
+            reference.transcriptomic_stats(bam, f'{tmp}/old-transcriptome_stats.tsv')
+            reference.extract_full_softclip(bam, f'{tmp}/old-full.fa', ALN=80)
+            reference.extract_softclip_end(bam, f'{tmp}/old-end.fa', SC=100, ALN=20)
+
+        def single_pass():
+            process_bam(bam, [GenomicStats(f'{tmp}/new-genomic_stats.tsv'),
+                              TranscriptomicStats(f'{tmp}/new-transcriptome_stats.tsv'),
+                              SoftclipFasta(f'{tmp}/new-full.fa', ALN=80),
+                              SoftclipFasta(f'{tmp}/new-end.fa', SC=100, ALN=20)], threads=threads)
+
+        _, old_time = timed(separate_passes)
+        _, new_time = timed(single_pass)
+
+        identical = all(filecmp.cmp(f'{tmp}/old-{name}', f'{tmp}/new-{name}', shallow=False)
+                        for name in ['genomic_stats.tsv', 'transcriptome_stats.tsv', 'full.fa', 'end.fa'])
+
+        print(f'BAM features - {nreads} reads ({os.path.getsize(bam) / 1e6:.1f} MB)')
+        print(f'  separate passes: {old_time:.3f}s')
+        print(f'  single pass ({threads} threads): {new_time:.3f}s')
+        print(f'  identical outputs: {identical}')
+
+
+def benchmark_base_quality(nreads=20000, workers=4):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        bam = f'{tmp}/SYN-transcriptome_sorted.bam'
+        synthetic_bam(bam, nreads, qualities=True)
+
+        def notebook():
+            with pysam.AlignmentFile(bam, 'rb') as alignments:
+                return reference.extract_BaseQuality(alignments)
+
+        def streaming():
+            extractor = BaseQuality(f'{tmp}/base_quality.tsv')
+            process_bam(bam, [extractor], threads=1)
+            return extractor.profile()
+
+        tracemalloc.start()
+        old, old_time = timed(notebook)
+        old_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        new, new_time = timed(streaming)
+        new_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        # shards tables summed into the same profile
+        process_bams_sharded([(bam, [BaseQuality(f'{tmp}/sharded.tsv')])], workers=workers, min_reads=0)
+        sharded = BaseQuality(None).read(f'{tmp}/sharded.tsv').profile()
+
+        print(f'Base quality profile - {nreads} reads, {old[0]} antisense reads with a long soft-clip')
+        print(f'  nested lists: {old_time:.3f}s, peak memory {old_memory / 1e6:.1f} MB')
+        print(f'  running sums: {new_time:.3f}s, peak memory {new_memory / 1e6:.1f} MB')
+        print(f'  same profiles: {tuple(old) == tuple(new)} | sharded ({workers} workers): {tuple(old) == tuple(sharded)}')
+
+
+def bam_jobs(bam, prefix):
+    return bam, [TranscriptomicStats(f'{prefix}-transcriptome_stats.tsv'), SoftclipFasta(f'{prefix}-full.fa', ALN=80),
+                 SoftclipFasta(f'{prefix}-end.fa', SC=100, ALN=20)]
+
+
+def process_job(job):
+    process_bam(*job, threads=1)
+
+
+def benchmark_softclip_store(nreads=20000, searched=2000):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        bam = f'{tmp}/SYN-transcriptome_sorted.bam'
+        synthetic_bam(bam, nreads)
+
+        process_bam(bam, [SoftclipFasta(f'{tmp}/full.fa', ALN=80), SoftclipBinary(f'{tmp}/full.softclips', ALN=80)])
+        process_bams_sharded([(bam, [SoftclipBinary(f'{tmp}/sharded.softclips', ALN=80)])], workers=2, region_size=500)
+
+        fasta, fasta_time = timed(lambda: [(record.id, str(record.seq)) for record in SeqIO.parse(f'{tmp}/full.fa', 'fasta')])
+        store, store_time = timed(lambda: list(SoftclipStore(f'{tmp}/full.softclips')))
+        views, views_time = timed(lambda: list(SoftclipStore(f'{tmp}/full.softclips').views()))
+
+        same_records = fasta == store == list(read_softclips(f'{tmp}/sharded.softclips')) == \
+            [(name, seq.tobytes().decode()) for name, seq in views]
+
+        print(f'Soft-clip store - {len(store)} reads ({os.path.getsize(f"{tmp}/full.fa") / 1e6:.1f} MB fasta, '
+              f'{os.path.getsize(f"{tmp}/full.softclips") / 1e6:.1f} MB store)')
+        print(f'  reading - SeqIO: {fasta_time:.3f}s | store: {store_time:.3f}s | store (uint8 views): {views_time:.3f}s | '
+              f'same records (sharded too): {same_records}')
+
+        # searches on the first reads, from the fasta file and from the store
+        with open(f'{tmp}/subset.fa', 'w') as file:
+            file.writelines(f'>{name}\n{seq}\n' for name, seq in fasta[:searched])
+        fasta_to_store(f'{tmp}/subset.fa', f'{tmp}/subset.softclips')
+
+        leaders = synthetic_spliced_leaders()
+        for name, search in [('SSP', lambda file, out: search_SSP(file, out, offset=80)),
+                             ('SL', lambda file, out: search_spliced_leaders(file, out, leaders, offset=80)),
+                             ('HAIRPIN', lambda file, out: hairpin_search(file, out, offset_value=80))]:
+            _, fasta_time = timed(search, f'{tmp}/subset.fa', f'{tmp}/fasta-{name}.tsv')
+            _, store_time = timed(search, f'{tmp}/subset.softclips', f'{tmp}/store-{name}.tsv')
+            identical = filecmp.cmp(f'{tmp}/fasta-{name}.tsv', f'{tmp}/store-{name}.tsv', shallow=False)
+            print(f'  {name} search ({searched} reads) - fasta: {fasta_time:.3f}s | store: {store_time:.3f}s | identical: {identical}')
+
+
+def makespan(durations, workers):
+
+    # pool.map with chunksize=1: tasks are taken in order by the first free worker
+    finish = [0.0] * workers
+    for duration in durations:
+        heapq.heappush(finish, heapq.heappop(finish) + duration)
+
+    return max(finish)
+
+
+def timed_tasks(jobs, workers, **kwargs):
+
+    # tasks of process_bams_sharded timed one by one, to estimate the run time of the pool on several cores
+    tasks, job_shards = plan_tasks(jobs, workers, **kwargs)
+    durations = [timed(process_shard, task)[1] for task in tasks]
+    _, merge_time = timed(merge_jobs, jobs, job_shards)
+
+    return len(tasks), sum(durations), makespan(durations, workers) + merge_time
+
+
+def benchmark_sharded(sizes=(60000, 10000, 10000, 10000), workers=4):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        # one large run (the straggler) and several small ones
+        bams = [f'{tmp}/RUN{i}.bam' for i in range(len(sizes))]
+        for i, (bam, nreads) in enumerate(zip(bams, sizes)):
+            synthetic_bam(bam, nreads, seed=i)
+
+        with Pool(workers) as p:
+            _, run_time = timed(p.map, process_job, [bam_jobs(bam, f'{bam}.runs') for bam in bams])
+
+        # default threshold (runs under 2M reads processed whole) & sharding forced on the straggler
+        _, default_time = timed(process_bams_sharded, [bam_jobs(bam, f'{bam}.default') for bam in bams], workers)
+        _, shard_time = timed(process_bams_sharded, [bam_jobs(bam, f'{bam}.shards') for bam in bams], workers,
+                              min_reads=0)
+
+        # regions smaller than the transcripts, reads overlapping two regions are processed once
+        process_bams_sharded([bam_jobs(bam, f'{bam}.regions') for bam in bams], workers, region_size=500, min_reads=0)
+
+        identical = all(filecmp.cmp(f'{bam}.runs-{name}', f'{bam}.{mode}-{name}', shallow=False)
+                        for bam in bams for mode in ['default', 'shards', 'regions']
+                        for name in ['transcriptome_stats.tsv', 'full.fa', 'end.fa'])
+
+        print(f'Sharded BAM features - runs of {", ".join(map(str, sizes))} reads, {workers} workers, '
+              f'{os.cpu_count()} cores available')
+        print(f'  one process per run: {run_time:.3f}s')
+        print(f'  default (straggler under min_reads, runs processed whole): {default_time:.3f}s')
+        print(f'  sharded straggler: {shard_time:.3f}s')
+        print(f'  identical outputs: {identical}')
+
+        # run time of the pool on {workers} cores, from the time of each task on a single one
+        for name, min_reads in [('one task per run', None), ('sharded straggler', 0)]:
+            kwargs = {'min_reads': min_reads} if min_reads is not None else {}
+            ntasks, cpu_time, estimate = timed_tasks([bam_jobs(bam, f'{bam}.timed') for bam in bams], workers, **kwargs)
+            print(f'  {name}: {ntasks} tasks, {cpu_time:.3f}s of cpu time, {estimate:.3f}s estimated on {workers} cores')
+
+        # BAM without mapped reads: outputs with their header only
+        synthetic_bam(f'{tmp}/EMPTY.bam', 0)
+        process_job(bam_jobs(f'{tmp}/EMPTY.bam', f'{tmp}/EMPTY.runs'))
+        process_bams_sharded([bam_jobs(f'{tmp}/EMPTY.bam', f'{tmp}/EMPTY.shards')], workers, min_reads=0)
+
+        identical = all(filecmp.cmp(f'{tmp}/EMPTY.runs-{name}', f'{tmp}/EMPTY.shards-{name}', shallow=False)
+                        for name in ['transcriptome_stats.tsv', 'full.fa', 'end.fa'])
+        print(f'  identical outputs of a BAM without mapped reads: {identical}')
+
+
+def synthetic_ssp_softclips(output_file, nreads=5000, aligned=80, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    with open(output_file, 'w') as fasta:
+        for i in range(nreads):
+            seq = random_sequence(rng, int(rng.integers(0, 200)))
+
+            # 1/3 of the reads with a (partial, mutated) SSP before the alignment start
+            if rng.random() < 0.33:
+                seq += mutate(rng, SSP_SEQUENCE[-int(rng.integers(10, len(SSP_SEQUENCE) + 1)):], 0.08)
+
+            seq += random_sequence(rng, aligned)
+            if rng.random() < 0.05:
+                seq = ''.join('N' if rng.random() < 0.05 else base for base in seq)
+
+            fasta.write(f'>read{i}\n{seq}\n')
+
+
+def benchmark_ssp_search(nreads=5000):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        synthetic_ssp_softclips(f'{tmp}/softclips.fa', nreads)
+
+        _, old_time = timed(reference.search_SSP, f'{tmp}/softclips.fa', f'{tmp}/old-SSP_search.tsv', offset=80)
+        _, new_time = timed(search_SSP, f'{tmp}/softclips.fa', f'{tmp}/new-SSP_search.tsv', offset=80)
+
+        print(f'SSP search - {nreads} reads')
+        print(f'  notebook: {old_time:.3f}s')
+        print(f'  engine: {new_time:.3f}s')
+        print(f'  identical outputs: {filecmp.cmp(f"{tmp}/old-SSP_search.tsv", f"{tmp}/new-SSP_search.tsv", shallow=False)}')
+
+
+def benchmark_sl_search(nreads=5000):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        leaders = synthetic_spliced_leaders()
+        with open(f'{tmp}/SL_sequences.fasta', 'w') as fasta:
+            fasta.writelines(f'>{name}\n{seq}\n' for name, seq in leaders.items())
+
+        synthetic_softclips(f'{tmp}/softclips.fa', leaders, nreads)
+
+        _, old_time = timed(reference.search_spliced_leaders, f'{tmp}/softclips.fa', f'{tmp}/old-SL_search.tsv',
+                            f'{tmp}/SL_sequences.fasta', offset=20)
+        _, new_time = timed(search_spliced_leaders, f'{tmp}/softclips.fa', f'{tmp}/new-SL_search.tsv', leaders,
+                            offset=20)
+
+        print(f'SL search - {nreads} reads, {len(leaders)} SL sequences')
+        print(f'  notebook: {old_time:.3f}s')
+        print(f'  engine: {new_time:.3f}s')
+
+
+def benchmark_hairpin_search(nreads=1000):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        synthetic_hairpins(f'{tmp}/softclips.fa', nreads)
+
+        _, old_time = timed(reference.hairpin_search, f'{tmp}/softclips.fa', f'{tmp}/old-HAIRPIN_search.tsv',
+                            offset_value=80)
+        _, new_time = timed(hairpin_search, f'{tmp}/softclips.fa', f'{tmp}/new-HAIRPIN_search.tsv', offset_value=80)
+
+        print(f'Hairpin search - {nreads} reads')
+        print(f'  notebook: {old_time:.3f}s')
+        print(f'  vectorized: {new_time:.3f}s')
+
+
+def synthetic_paired_softclips(full_file, end_file, names, leaders, seed=0):
+
+    rng = np.random.default_rng(seed)
+    sl_names = list(leaders)
+
+    with open(full_file, 'w') as full, open(end_file, 'w') as end:
+        for name in names:
+            softclip = random_sequence(rng, int(rng.integers(0, 250)))
+
+            # SL, SSP or hairpin at the end of the soft-clip
+            motif = rng.random()
+            if motif < 0.4:
+                sl = leaders[sl_names[int(rng.integers(0, len(sl_names)))]]
+                softclip += mutate(rng, sl[-int(rng.integers(5, len(sl) + 1)):], 0.05)
+            elif motif < 0.45:
+                # full SL out of the soft-clip end, only its last bases (not robust) in the soft-clip end:
+                # SL found by the 2nd pass
+                sl = leaders[sl_names[int(rng.integers(0, len(sl_names)))]]
+                softclip += sl + random_sequence(rng, 110) + sl[-8:] + random_sequence(rng, 6)
+            elif motif < 0.6:
+                softclip += mutate(rng, SSP_SEQUENCE[-int(rng.integers(10, len(SSP_SEQUENCE) + 1)):], 0.08)
+            elif motif < 0.8:
+                stem = random_sequence(rng, 12)
+                softclip += stem + random_sequence(rng, int(rng.integers(1, 10))) + mutate(rng, reverse_complement(stem), 0.1)
+
+            seq = softclip + random_sequence(rng, 80)
+            start = len(softclip)
+
+            # extract_full_softclip (ALN=80) & extract_softclip_end (SC=100, ALN=20)
+            full.write(f'>{name}\n{seq[:start + 80]}\n')
+            end.write(f'>{name}\n{seq[start - 100:start + 20] if start > 100 else seq[:start + 20]}\n')
+
+
+def same_values(table, other):
+    try:
+        pd.testing.assert_frame_equal(table.reset_index(drop=True), other.reset_index(drop=True), check_dtype=False)
+        return True
+    except AssertionError:
+        return False
+
+
+def benchmark_motif_search(nreads=2000):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        ID = 'RUN_1'
+        strands = synthetic_runs(tmp, [ID], nreads)
+        names = pd.read_csv(f'{tmp}/{ID}/{ID}-SSP_search.tsv', sep='\t')['read']
+
+        leaders = synthetic_spliced_leaders()
+        full, end = f'{tmp}/{ID}/full.fa', f'{tmp}/{ID}/end.fa'
+        synthetic_paired_softclips(full, end, names, leaders)
+
+        files = run_files(ID, tmp) | motif_run_files(ID, tmp)
+
+        def separate_searches():
+            search_SSP(full, files['SSP'], offset=80)
+            search_spliced_leaders(end, files['SL'], leaders, offset=20)
+            search_spliced_leaders(full, files['SL_2nd_pass'], leaders, offset=80)
+            hairpin_search(full, files['HAIRPIN'], offset_value=80)
+
+        _, separate_time = timed(separate_searches)
+        _, scan_time = timed(scan_motifs, full, end, files['motifs'], leaders, offset=80, end_offset=20)
+        _, full_scan_time = timed(scan_motifs, full, end, f'{tmp}/full_scan.tsv', leaders, offset=80, end_offset=20,
+                                  full_second_pass=True)
+
+        tables = motif_tables(pd.read_csv(f'{tmp}/full_scan.tsv', sep='\t'))
+        same_tables = all(same_values(tables[name], pd.read_csv(files[name], sep='\t')) for name in tables)
+
+        liftover = lambda isoforms, positions: positions + 100
+        assemble_dataset([ID], tmp, f'{tmp}/separate-dataset.tsv', strands, liftover)
+        assemble_dataset([ID], tmp, f'{tmp}/scan-dataset.tsv', strands, liftover, files=motif_run_files)
+
+        print(f'Motif search - {nreads} reads, SSP + {len(leaders)} SL (2 passes) + hairpin')
+        print(f'  separate searches: {separate_time:.3f}s')
+        print(f'  single scan: {scan_time:.3f}s (2nd pass on every read: {full_scan_time:.3f}s)')
+        print(f'  same search results (2nd pass on every read): {same_tables} | identical dataset: '
+              f'{filecmp.cmp(f"{tmp}/separate-dataset.tsv", f"{tmp}/scan-dataset.tsv", shallow=False)}')
+
+
+def peak_memory(func, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, duration, peak / 1024 ** 2
+
+
+def same_rows(table_file, other_file):
+
+    # compared as text, row order is not part of the result
+    tables = [pd.read_csv(file, sep='\t', dtype=str, keep_default_na=False).sort_values('read', ignore_index=True)
+              for file in [table_file, other_file]]
+
+    return tables[0].equals(tables[1])
+
+
+def benchmark_dataset_assembly(nreads=5000, part_size=512 * 1024):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        runs = [f'RUN_{i}' for i in range(6)]
+        strands = synthetic_runs(tmp, runs, nreads)
+
+        print(f'Dataset assembly - {nreads} reads per run')
+
+        for nruns in [2, 6]:
+            table, old_time, old_peak = peak_memory(reference.assemble_dataset, runs[:nruns], tmp, strands,
+                                                    lambda isoform, position: position + 100)
+            table.to_csv(f'{tmp}/old-dataset.tsv', sep='\t', index=None)
+
+            _, new_time, new_peak = peak_memory(assemble_dataset, runs[:nruns], tmp, f'{tmp}/new-dataset.tsv', strands,
+                                                lambda isoforms, positions: positions + 100, part_size=part_size)
+
+            print(f'  {nruns} runs | notebook: {old_time:.3f}s, peak {old_peak:.1f} MB | '
+                  f'streaming: {new_time:.3f}s, peak {new_peak:.1f} MB | '
+                  f'same rows: {same_rows(f"{tmp}/old-dataset.tsv", f"{tmp}/new-dataset.tsv")}')
+
+
+def benchmark_liftover(nreads=100000):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        exonics_positions = synthetic_annotation(f'{tmp}/test.gtf', f'{tmp}/transcript_exons.json')
+        reference.read_liftover_reference(f'{tmp}/test.gtf', f'{tmp}/transcript_exons.json')
+
+        rng = np.random.default_rng(0)
+        transcripts = list(exonics_positions)
+        table = pd.DataFrame({'isoform': rng.choice(transcripts, nreads), 'transcriptomic_start': rng.integers(-5, 1500, nreads)})
+
+        _, old_time = timed(table.apply, lambda x: reference.transcriptome_based_correction(x['isoform'], x['transcriptomic_start']), axis=1)
+
+        liftover, build_time = timed(Liftover, *read_liftover_files(f'{tmp}/test.gtf', f'{tmp}/transcript_exons.json'))
+        new, new_time = timed(liftover, table['isoform'], table['transcriptomic_start'])
+
+        print(f'Liftover - {nreads} positions, {len(transcripts)} transcripts ({np.isnan(new).mean():.0%} outside exons)')
+        print(f'  notebook (apply): {old_time:.3f}s')
+        print(f'  vectorized: {new_time:.3f}s (+ {build_time:.3f}s to build the exon arrays)')
+
+
+def synthetic_results(nrows=200000, ngenes=1000, seed=0):
+
+    rng = np.random.default_rng(seed)
+    genes = np.array([f'GENE{i}.1' for i in range(ngenes)], dtype=object)
+
+    table = pd.DataFrame({'gene': genes[rng.integers(0, ngenes, nrows)],
+                          'genomic_start': rng.integers(1, 10 ** 6, nrows).astype(float),
+                          'read_orientation': rng.choice(['sense', 'antisense'], nrows),
+                          'SC5': -rng.integers(0, 300, nrows).astype(float),
+                          'SSP_dist': np.where(rng.random(nrows) < 0.3, -rng.integers(0, 400, nrows), np.nan),
+                          'SL': np.where(rng.random(nrows) < 0.6, rng.choice(['SL1', 'SL2', 'SL2 / SL2_1'], nrows).astype(object), None),
+                          'score': rng.integers(5, 23, nrows).astype(float),
+                          'distance_to_start': -rng.integers(0, 8, nrows).astype(float),
+                          'HAIRPIN_score': rng.integers(0, 13, nrows)})
+
+    table['genomic_end'] = table['genomic_start'] + rng.integers(100, 2000, nrows)
+    table['ROBUST_SL_FOUND'] = np.where(rng.random(nrows) < 0.1, np.nan, rng.choice(['FOUND', 'NOT FOUND'], nrows).astype(object))
+
+    # missing SL values: NaN once read from a tsv, None and empty strings are false for the notebook rules
+    table.loc[table.index % 7 == 0, 'SL'] = np.nan
+    table.loc[table.index % 11 == 0, 'SL'] = ''
+
+    return table, {gene: '+' if i % 2 else '-' for i, gene in enumerate(genes)}
+
+
+def benchmark_rules(nrows=200000):
+
+    table, strands = synthetic_results(nrows)
+    orientation = table.apply(lambda x: strands[x['gene']], axis=1)
+
+    # notebook (row by row) and vectorized versions of each rule
+    rule_pairs = {
+        'gene orientation': (lambda: table.apply(lambda x: strands[x['gene']], axis=1),
+                             lambda: rules.gene_orientation(table['gene'], strands)),
+        'start / end swap': (lambda: (table.apply(lambda x: x['genomic_start'] if strands[x['gene']] == '+' else x['genomic_end'], axis=1),
+                                      table.apply(lambda x: x['genomic_end'] if strands[x['gene']] == '+' else x['genomic_start'], axis=1)),
+                             lambda: rules.oriented_positions(table['genomic_start'], table['genomic_end'], orientation)),
+        'SSP_FOUND': (lambda: table.apply(lambda x: 'FOUND' if x['SSP_dist']==x['SSP_dist'] and x['SSP_dist']-x['SC5']<=80 else 'NOT FOUND', axis=1),
+                      lambda: rules.ssp_found(table['SSP_dist'], table['SC5'])),
+        'ROBUST_SL': (lambda: table.apply(lambda x: reference.robust_SL(SL=x['SL'], score=x['score'], dist=x['distance_to_start']), axis=1),
+                      lambda: rules.robust_SL(table['SL'], table['score'], table['distance_to_start'])),
+        'ROBUST_VARIANT': (lambda: table.apply(lambda x: reference.robust_variant(SL=x['SL'], score=x['score'], dist=x['distance_to_start']), axis=1),
+                           lambda: rules.robust_variant(table['SL'], table['score'], table['distance_to_start'])),
+        'ROBUST_SL (2nd pass)': (lambda: table.apply(lambda x: 'FOUND' if x['SL']==x['SL'] and x['score'] >= 12 else 'NOT FOUND', axis=1),
+                                 lambda: rules.robust_SL_2nd_pass(table['SL'], table['score'])),
+        'HAIRPIN_FOUND': (lambda: table.apply(lambda x: reference.hairpin_found(x['read_orientation'], x['ROBUST_SL_FOUND'], x['HAIRPIN_score']), axis=1),
+                          lambda: rules.hairpin_found(table['read_orientation'], table['ROBUST_SL_FOUND'], table['HAIRPIN_score'])),
+    }
+
+    print(f'Classification rules - {nrows} rows')
+    for name, (row_rule, vectorized_rule) in rule_pairs.items():
+        _, old_time = timed(row_rule)
+        _, new_time = timed(vectorized_rule)
+
+        print(f'  {name:<22} apply: {old_time:7.3f}s | vectorized: {new_time:.4f}s')
+
+
+def synthetic_dataset(output_file, nreads=200000, ngenes=2000, positions_per_gene=20, seed=0):
+
+    rng = np.random.default_rng(seed)
+    genes = np.array([f'GENE{i}.1' for i in range(ngenes)], dtype=object)
+
+    gene = rng.integers(0, ngenes, nreads)
+    position = (gene * 10000 + rng.integers(0, positions_per_gene, nreads) * 7).astype(float)
+    position[rng.random(nreads) < 0.01] = np.nan
+
+    variant = np.where(rng.random(nreads) < 0.4, 'FOUND', 'NOT FOUND')
+    sl = rng.choice(['SL1', 'SL2', 'SL2 / SL2_1', 'SL1 / SL2'], nreads).astype(object)
+    sl[(variant == 'NOT FOUND') & (rng.random(nreads) < 0.5)] = None
+
+    pd.DataFrame({'read': [f'read{i}' for i in range(nreads)], 'gene': genes[gene], 'corrected_genomic_start': position,
+                  'run': rng.choice(['SSP_1', 'SL1_1', 'NP_1'], nreads),
+                  'read_orientation': rng.choice(['sense', 'antisense'], nreads),
+                  'SSP_FOUND': np.where(rng.random(nreads) < 0.2, 'FOUND', 'NOT FOUND'),
+                  'ROBUST_SL_FOUND': np.where(rng.random(nreads) < 0.5, 'FOUND', 'NOT FOUND'),
+                  'HAIRPIN_FOUND': np.where(rng.random(nreads) < 0.1, 'FOUND', 'NOT FOUND'),
+                  'VARIANT_SL_FOUND': variant, 'SL': sl}).to_csv(output_file, sep='\t', index=None)
+
+
+def benchmark_position_stats(nreads=40000, ngenes=400, chunksize=10000):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        synthetic_dataset(f'{tmp}/dataset.tsv', nreads, ngenes)
+        dataset = pd.read_csv(f'{tmp}/dataset.tsv', sep='\t')
+
+        old, old_time = timed(reference.start_positions_stats, dataset)
+        counts, count_time = timed(count_positions, f'{tmp}/dataset.tsv', chunksize)
+        new, stats_time = timed(position_stats, counts)
+
+        old.to_csv(f'{tmp}/old-stats.tsv', sep='\t', index=None)
+        new.to_csv(f'{tmp}/new-stats.tsv', sep='\t', index=None)
+
+        main_tss = old.sort_values('total', kind='mergesort').drop_duplicates('gene', keep='last')[['gene', 'position']]
+        old_bias, bias_time = timed(reference.measure_bias_at_locus, dataset)
+        old_ssp, ssp_time = timed(reference.measure_SSP_at_locus, dataset, main_tss)
+
+        print(f'Position stats - {nreads} reads, {len(new)} positions (dataset read in chunks of {chunksize})')
+        print(f'  notebook loop: {old_time:.3f}s')
+        print(f'  grouped counts: {count_time:.3f}s (reading the table included) + stats: {stats_time:.3f}s')
+        print(f'  identical start_positions_stats: '
+              f'{filecmp.cmp(f"{tmp}/old-stats.tsv", f"{tmp}/new-stats.tsv", shallow=False)}')
+        print(f'  SupFig8 loops: {bias_time + ssp_time:.3f}s | same locus bias: {old_bias.equals(locus_bias(counts))} | '
+              f'same SSP at main TSS: {old_ssp.equals(ssp_at_main_tss(counts, main_tss))}')
+
+
+def benchmark_incremental_stats(nreads=1_000_000, ngenes=1000):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        # one dataset table per run (SSP_1, SL1_1, NP_1), counted once
+        synthetic_dataset(f'{tmp}/dataset.tsv', nreads, ngenes)
+        dataset = pd.read_csv(f'{tmp}/dataset.tsv', sep='\t', dtype={'gene': object, 'SL': object})
+        runs = sorted(dataset['run'].unique())
+        for ID, table in dataset.groupby('run'):
+            os.makedirs(f'{tmp}/{ID}')
+            table.to_csv(f'{tmp}/{ID}/{ID}-dataset.tsv', sep='\t', index=None)
+            position_counts_handler(ID, tmp)
+
+        def full_recompute(IDs):
+            concatenate_tables([f'{tmp}/{ID}/{ID}-dataset.tsv' for ID in IDs], f'{tmp}/merged.tsv')
+            position_stats(count_positions(f'{tmp}/merged.tsv')).to_csv(f'{tmp}/full-stats.tsv', sep='\t', index=None)
+
+        def same_stats():
+            return filecmp.cmp(f'{tmp}/start_positions_stats.tsv', f'{tmp}/full-stats.tsv', shallow=False)
+
+        print(f'Incremental position stats - {nreads} reads, runs {runs}')
+        timed(update_position_stats, runs[:2], tmp)
+
+        _, full_time = timed(full_recompute, runs)
+        _, add_time = timed(update_position_stats, runs, tmp)
+        print(f'  run {runs[2]} added - full recompute: {full_time:.3f}s | folded counts: {add_time:.3f}s | '
+              f'identical stats: {same_stats()}')
+
+        _, full_time = timed(full_recompute, runs[1:])
+        _, remove_time = timed(update_position_stats, runs[1:], tmp)
+        print(f'  run {runs[0]} removed - full recompute: {full_time:.3f}s | folded counts: {remove_time:.3f}s | '
+              f'identical stats: {same_stats()}')
+
+        # a run processed again with fewer reads: its previous counts are replaced
+        dataset.loc[dataset['run'] == runs[2]].iloc[::2].to_csv(f'{tmp}/{runs[2]}/{runs[2]}-dataset.tsv',
+                                                                 sep='\t', index=None)
+        position_counts_handler(runs[2], tmp)
+        _, full_time = timed(full_recompute, runs[1:])
+        _, update_time = timed(update_position_stats, runs[1:], tmp)
+        print(f'  run {runs[2]} updated - full recompute: {full_time:.3f}s | folded counts: {update_time:.3f}s | '
+              f'identical stats: {same_stats()}')
+
+        # update interrupted before the totals are written (stats tables already rewritten), then runs unchanged
+        def interrupted(*args):
+            raise KeyboardInterrupt
+
+        with mock.patch('positions.write_totals', interrupted):
+            try:
+                update_position_stats(runs, tmp)
+            except KeyboardInterrupt:
+                pass
+
+        _, resume_time = timed(update_position_stats, runs[1:], tmp)
+        print(f'  run {runs[0]} added then interrupted - next update: {resume_time:.3f}s | '
+              f'identical stats: {same_stats()}')
+
+
+def synthetic_project(path, runs, nreads=2000, ntranscripts=200):
+
+    # BAM files of each run & reference files, with the folder layout of the pre-processing notebook
+    os.makedirs(f'{path}/ref', exist_ok=True)
+
+    for i, ID in enumerate(runs):
+        os.makedirs(f'{path}/{ID}', exist_ok=True)
+        files = run_paths(ID, path)
+        synthetic_bam(files['genome_bam'], nreads, ntranscripts, seed=i)
+        synthetic_bam(files['transcriptome_bam'], nreads, ntranscripts, seed=i)
+
+    references = reference_paths(path)
+    with open(references['SL'], 'w') as fasta:
+        fasta.writelines(f'>{name}\n{seq}\n' for name, seq in synthetic_spliced_leaders().items())
+
+    genes = [f'SYN{i}.{i % 3 + 1}' for i in range(ntranscripts)]
+    pd.DataFrame({'gene': genes, 'strand': ['+-'[i % 2] for i in range(ntranscripts)]}) \
+        .to_csv(references['strands'], sep='\t', index=None)
+
+    synthetic_annotation(references['gtf'], references['exons'], ntranscripts=ntranscripts)
+
+
+def benchmark_workflow(nreads=2000):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        runs = ['RUN_1', 'RUN_2', 'RUN_3']
+        synthetic_project(tmp, runs, nreads)
+        dataset_file = f'{tmp}/dataset_+SSP+SL+HAIRPIN.tsv'
+
+        def stages(executed):
+            return sorted({stage for stage, ID in executed})
+
+        print(f'Pipeline runner - {len(runs)} runs of {nreads} reads')
+
+        executed, first_time = timed(run_pipeline, runs[:2], tmp)
+        print(f'  first run: {first_time:.3f}s, {len(executed)} tasks')
+
+        executed, cached_time = timed(run_pipeline, runs[:2], tmp)
+        print(f'  nothing changed: {cached_time:.3f}s, {len(executed)} tasks')
+
+        executed, new_run_time = timed(run_pipeline, runs, tmp)
+        print(f'  new run: {new_run_time:.3f}s, {len(executed)} tasks, runs {sorted({ID for _, ID in executed if ID in runs})}')
+
+        # new SL variant: only motif searches (of all runs) & dataset are updated
+        with open(reference_paths(tmp)['SL'], 'a') as fasta:
+            fasta.write('>SL2_new\nGGTTTTAACCCAGTTACTCAGG\n')
+        executed, sl_time = timed(run_pipeline, runs, tmp)
+        print(f'  new SL sequence: {sl_time:.3f}s, {len(executed)} tasks, stages {stages(executed)}')
+
+        # BAM rewritten with the same content: hashed again, nothing to run
+        bam = run_paths(runs[0], tmp)['genome_bam']
+        with open(bam, 'rb') as file:
+            content = file.read()
+        with open(bam, 'wb') as file:
+            file.write(content)
+        executed, touch_time = timed(run_pipeline, runs, tmp)
+        print(f'  BAM rewritten, same content: {touch_time:.3f}s, {len(executed)} tasks')
+
+        with open(dataset_file) as file:
+            incremental = file.read()
+        _, full_time = timed(run_pipeline, runs, tmp, force=True)
+        with open(dataset_file) as file:
+            print(f'  forced full run: {full_time:.3f}s | same dataset as the incremental runs: {file.read() == incremental}')
+        position_stats(count_positions(dataset_file)).to_csv(f'{tmp}/full-stats.tsv', sep='\t', index=None)
+        print(f'  same position stats as the whole dataset: '
+              f'{filecmp.cmp(f"{tmp}/start_positions_stats.tsv", f"{tmp}/full-stats.tsv", shallow=False)}')
+
+        # state lost and one BAM unreadable: the other runs of the failed stage are recorded
+        os.remove(f'{tmp}/pipeline_state.json')
+        with open(bam, 'wb') as file:
+            file.write(b'not a BAM file')
+        try:
+            run_pipeline(runs, tmp, workers=2)
+        except RuntimeError as error:
+            print(f'  failed task: {str(error).splitlines()[0]}')
+
+        with open(bam, 'wb') as file:
+            file.write(content)
+        executed = run_pipeline(runs, tmp, workers=2)
+        print(f'  resumed: genome_features of {sorted(ID for stage, ID in executed if stage == "genome_features")}')
+
+
+if __name__ == '__main__':
+    benchmark_bam_features()
+    benchmark_base_quality()
+    benchmark_softclip_store()
+    benchmark_sharded()
+    benchmark_ssp_search()
+    benchmark_sl_search()
+    benchmark_hairpin_search()
+    benchmark_motif_search()
+    benchmark_dataset_assembly()
+    benchmark_liftover()
+    benchmark_rules()
+    benchmark_position_stats()
+    benchmark_incremental_stats()
+    benchmark_workflow()
@@ -0,0 +1,199 @@
+import os
+import zlib
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import rules
+from liftover import Liftover, read_liftover_files
+from motif_search import motif_tables
+
+
+DATASET_COLUMNS = ['read', 'gene', 'isoform', 'chromosome', 'gene_orientation', 'read_orientation', 'softclip', 'run',
+                   'corrected_genomic_start', 'corrected_genomic_end', 'genomic_start', 'genomic_end',
+                   'transcriptomic_start', 'transcriptomic_end',
+                   'sequence_length', 'alignment_length', 'SC5', 'alignment_start', 'alignment_end', 'SC3']
+
+# clean up columns type (as in the pre-processing notebook)
+# transcriptomic stats are float in the notebook as well: missing values are created by the outer join of the stats
+COL_TYPES = {'read': object, 'gene': object, 'isoform': object, 'chromosome': object,
+             'genomic_start': float, 'genomic_end': float, 'corrected_genomic_start': float, 'corrected_genomic_end': float,
+             'read_orientation': object, 'softclip': int, 'run': object,
+             'transcriptomic_start': float, 'transcriptomic_end': float, 'sequence_length': float,
+             'alignment_length': float, 'SC5': float, 'alignment_start': float, 'alignment_end': float, 'SC3': float}
+
+# columns coming from the search results, fixed so that every written chunk uses the same format
+# (float when missing values are expected for some reads, nullable integers otherwise)
+SEARCH_TYPES = {'SSP_score': 'Int64', 'SSP_size': 'Int64', 'SSP_dist': float,
+                'SL_score': float, 'SL_distance': float, 'HAIRPIN_score': 'Int64', 'HAIRPIN_loop': float}
+
+
+def run_files(ID, path):
+    return {'genome': f'{path}/{ID}-genomic_stats.tsv',
+            'transcriptome': f'{path}/{ID}-transcriptome_stats.tsv',
+            'SSP': f'{path}/{ID}/{ID}-SSP_search.tsv',
+            'SL': f'{path}/{ID}/{ID}-SL_search.tsv',
+            'SL_2nd_pass': f'{path}/{ID}/{ID}-SL_search_(2nd_pass).tsv',
+            'HAIRPIN': f'{path}/{ID}/{ID}-HAIRPIN_search.tsv'}
+
+
+def motif_run_files(ID, path):
+
+    # search results of scan_motifs: a single table instead of SSP, SL, SL_2nd_pass & HAIRPIN
+    return {'genome': f'{path}/{ID}-genomic_stats.tsv',
+            'transcriptome': f'{path}/{ID}-transcriptome_stats.tsv',
+            'motifs': f'{path}/{ID}/{ID}-motif_search.tsv'}
+
+
+def partition_file(input_file, parts, nparts):
+    """Split a table into nparts files by hash of its first column (read name), streaming line by line."""
+
+    outputs = [open(part, 'w') for part in parts]
+
+    with open(input_file) as file:
+        header = file.readline()
+        for output in outputs:
+            output.write(header)
+
+        for line in file:
+            # blank lines (trailing newline at the end of a table) are skipped, tables may have a single column
+            if not line.strip():
+                continue
+            read = line.rstrip('\r\n').split('\t', 1)[0]
+            outputs[zlib.crc32(read.encode()) % nparts].write(line)
+
+    for output in outputs:
+        output.close()
+
+
+# Sequence search results
+
+def spliced_leader_result(sl_result, sl_result_2ndpass):
+
+    # Find robust SL match & robust SL variant
+    sl_result['ROBUST_SL'] = rules.robust_SL(sl_result['SL'], sl_result['score'], sl_result['distance_to_start'])
+    sl_result['ROBUST_VARIANT'] = rules.robust_variant(sl_result['SL'], sl_result['score'], sl_result['distance_to_start'])
+
+    # 2nd pass (whole 5' soft-clip): only high scores, replacing reads without robust SL
+    sl_result_2ndpass['ROBUST_SL'] = rules.robust_SL_2nd_pass(sl_result_2ndpass['SL'], sl_result_2ndpass['score'])
+    sl_result_2ndpass['ROBUST_VARIANT'] = 'NOT FOUND'
+
+    reads_no_sl = sl_result.loc[sl_result['ROBUST_SL'] == 'NOT FOUND', 'read']
+    sl_found_2ndpass = sl_result_2ndpass[(sl_result_2ndpass['ROBUST_SL'] == 'FOUND') & (sl_result_2ndpass['read'].isin(reads_no_sl))]
+
+    sl_result = sl_result.set_index('read')
+    sl_result.update(sl_found_2ndpass.set_index('read'))
+    sl_result = sl_result.reset_index()
+
+    sl_result.columns = ['read', 'SL', 'SL_score', 'SL_distance', 'ROBUST_SL_FOUND', 'VARIANT_SL_FOUND']
+
+    return sl_result
+
+
+def assemble_part(tables, ID, strands, liftover):
+
+    if 'motifs' in tables:
+        tables = {**tables, **motif_tables(tables['motifs'])}
+
+    genome_stats, transcriptome_stats = tables['genome'], tables['transcriptome']
+
+    # only keep reads that are mapped against both genome and transcriptome files
+    final = genome_stats.merge(transcriptome_stats, on='read', how='inner')
+    final = final.loc[(final['genomic_start'].notnull()) & (final['transcriptomic_start'].notnull())]
+    final['run'] = ID
+
+    # gene orientation, genomic start and end set according to it
+    final['gene_orientation'] = rules.gene_orientation(final['gene'], strands)
+    final['genomic_start'], final['genomic_end'] = rules.oriented_positions(final['genomic_start'], final['genomic_end'],
+                                                                            final['gene_orientation'])
+
+    # transcriptomic alignment positions are used to refine genomic positions
+    final['corrected_genomic_start'] = liftover(final['isoform'], final['transcriptomic_start'])
+    final['corrected_genomic_end'] = liftover(final['isoform'], final['transcriptomic_end'])
+
+    final = final.loc[final['gene'].notnull(), DATASET_COLUMNS].astype(COL_TYPES)
+
+    # SSP
+    final = final.merge(tables['SSP'], on='read', how='left')
+    final['SSP_FOUND'] = rules.ssp_found(final['SSP_dist'], final['SC5'])
+
+    # SL
+    final = final.merge(spliced_leader_result(tables['SL'], tables['SL_2nd_pass']), on='read', how='left')
+
+    # HAIRPIN
+    final = final.merge(tables['HAIRPIN'], on='read', how='left')
+    final['HAIRPIN_FOUND'] = rules.hairpin_found(final['read_orientation'], final['ROBUST_SL_FOUND'], final['HAIRPIN_score'])
+
+    return final.astype(SEARCH_TYPES).sort_values('read')
+
+
+def assemble_dataset(runs, path, output_file, strands, liftover, part_size=256 * 1024 ** 2, files=run_files):
+    """Streaming version of sections 3 to 6 of the pre-processing notebook, writing dataset_+SSP+SL+HAIRPIN.tsv.
+
+    Runs are processed one at a time. The tables of a run are split by read name into parts of about
+    part_size bytes, each part is joined in memory and appended to the output: memory use depends on
+    part_size, not on the number or size of the runs.
+
+    strands: gene -> '+' / '-', liftover: function(isoforms, transcriptomic positions) -> genomic positions.
+    files: function(ID, path) -> tables of a run, run_files or motif_run_files (single motif search table).
+    """
+
+    header = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        for ID in runs:
+            inputs = files(ID, path)
+            nparts = max(1, int(np.ceil(sum(os.path.getsize(file) for file in inputs.values()) / part_size)))
+
+            parts = {name: [f'{tmp}/{name}.{k}.tsv' for k in range(nparts)] for name in inputs}
+            for name, file in inputs.items():
+                partition_file(file, parts[name], nparts)
+
+            for k in range(nparts):
+                tables = {name: pd.read_csv(parts[name][k], sep='\t') for name in parts}
+                final = assemble_part(tables, ID, strands, liftover)
+
+                final.to_csv(output_file, sep='\t', index=None, mode='w' if header else 'a', header=header)
+                header = False
+
+            print(f'Completed run {ID}\n')
+
+
+def concatenate_tables(input_files, output_file):
+
+    # tables with the same columns, a single header is kept
+    with open(output_file, 'wb') as output:
+        for i, input_file in enumerate(input_files):
+            with open(input_file, 'rb') as file:
+                if i > 0:
+                    file.readline()
+                shutil.copyfileobj(file, output)
+
+
+# Handler functions (same file names as the pre-processing notebook)
+
+def reference_tables(path):
+
+    # Build dictionnary of gene orientation
+    strand = pd.read_csv(f'{path}/ref/gene&strand.tsv', sep='\t')
+    strands = strand.set_index('gene')['strand'].to_dict()
+
+    liftover = Liftover(*read_liftover_files(f'{path}/ref/c_elegans.PRJNA13758.WS270.canonical_geneset.gtf',
+                                             f'{path}/ref/transcript_exons.json'))
+
+    return strands, liftover
+
+
+def assemble_dataset_handler(runs, path, files=run_files):
+    assemble_dataset(runs, path, f'{path}/dataset_+SSP+SL+HAIRPIN.tsv', *reference_tables(path), files=files)
+
+
+def run_dataset_handler(ID, path, files=run_files):
+
+    # rows of a single run, the dataset table is the concatenation of the runs tables (see merge_run_datasets)
+    assemble_dataset([ID], path, f'{path}/{ID}/{ID}-dataset.tsv', *reference_tables(path), files=files)
+
+
+def merge_run_datasets(runs, path):
+    concatenate_tables([f'{path}/{ID}/{ID}-dataset.tsv' for ID in runs], f'{path}/dataset_+SSP+SL+HAIRPIN.tsv')
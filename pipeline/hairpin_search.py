@@ -0,0 +1,205 @@
+from functools import lru_cache
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from softclip_store import read_softclips
+
+
+HAIRPIN_ALIGN_PARAMS = {'match': 1,
+                        'mismatch': 0,
+                        'gap_open': 2,    # penalty to create a gap
+                        'gap_extend': 1}  # penalty to extend a gap (must have created before)
+
+# A, C, G, T -> 0 to 3, any other base -> 4 (scored 0, as in parasail.matrix_create("ACGT", ...))
+CODES = np.full(256, 4, dtype=np.uint8)
+for i, base in enumerate('ACGT'):
+    CODES[ord(base)] = CODES[ord(base.lower())] = i
+
+# code of the complementary base (A <-> T, C <-> G, other bases stay 4)
+COMPLEMENT = np.array([3, 2, 1, 0, 4], dtype=np.uint8)
+
+# far below any score, without overflowing int16 once gap penalties are subtracted
+NEG_INF = -10000
+
+
+def encode(seq):
+
+    # string, or uint8 array of ascii bases (sequences of a soft-clip store, see read_softclips)
+    if isinstance(seq, str):
+        seq = np.frombuffer(seq.encode(), dtype=np.uint8)
+    return CODES[seq]
+
+
+def semi_global_scores(queries, references, params=HAIRPIN_ALIGN_PARAMS):
+    """Scores of parasail.sg_*(query, reference) for every pair of rows of two (N, m) and (N, n) arrays of codes.
+
+    Semi-global alignment with affine gaps (a gap of size k costs gap_open + (k-1) * gap_extend): leading and
+    trailing gaps are free, the score is the best value of the last row or last column of the DP matrix.
+    """
+    nseq, m = queries.shape
+    n = references.shape[1]
+    gap_open, gap_extend = params['gap_open'], params['gap_extend']
+
+    # (position, pair) layout: each DP column is a contiguous array over all the pairs
+    queries, references = queries.T, np.ascontiguousarray(references.T)
+    known = references < 4
+
+    H = np.zeros((n + 1, nseq), dtype=np.int16)
+    F = np.full((n + 1, nseq), NEG_INF, dtype=np.int16)
+    last_column = np.full(nseq, NEG_INF, dtype=np.int16)
+
+    for i in range(m):
+        query = queries[i]
+        substitution = np.where(known & (query < 4), np.where(query == references, params['match'], params['mismatch']),
+                                0).astype(np.int16)
+
+        # gaps in the reference (vertical) then diagonal moves, from the previous row
+        F = np.maximum(F - gap_extend, H - gap_open)
+        diagonal = H[:-1] + substitution
+
+        # gaps in the query (horizontal), along the current row
+        row = np.zeros((n + 1, nseq), dtype=np.int16)
+        E = np.full(nseq, NEG_INF, dtype=np.int16)
+        for j in range(1, n + 1):
+            E = np.maximum(E - gap_extend, row[j - 1] - gap_open)
+            row[j] = np.maximum(np.maximum(diagonal[j - 1], E), F[j])
+
+        H = row
+        last_column = np.maximum(last_column, H[n])
+
+    return np.maximum(last_column, H[1:].max(axis=0)).astype(np.int64)
+
+
+@lru_cache(maxsize=4096)
+def hairpin_candidates(seq_length, min_index=50, max_loop=10):
+    """(stem2 end, loop size) in the order they are tested by hairpin_search (pre-processing notebook),
+    with the index of the stem2 end group of each candidate."""
+
+    ends = np.arange(min_index, seq_length + 1, 2)[::-1]
+    loops = np.minimum(max_loop, ends - min_index)
+
+    group = np.repeat(np.arange(len(ends)), loops)
+    first = np.repeat(np.cumsum(loops) - loops, loops)
+
+    # loop sizes are tested from the largest to 0
+    loop = np.repeat(loops, loops) - 1 - (np.arange(len(group)) - first)
+
+    return ends[group], loop, group
+
+
+def search_batch(batch, length_s1=12, length_s2=12, offset_value=0, params=HAIRPIN_ALIGN_PARAMS):
+
+    stems1, stems2, reads, groups, candidates = [], [], [], [], []
+
+    for i, (name, seq) in enumerate(batch):
+        seq_length = len(seq)
+        n, loop, group = hairpin_candidates(seq_length)
+
+        if len(n) == 0:
+            continue
+
+        end_s1 = n - length_s2 - 1 - loop
+
+        # stem1 is reverse complemented: seq[start_s1:end_s1] reversed is found at the same place in the reversed read
+        codes = encode(seq)
+        forward = np.lib.stride_tricks.sliding_window_view(codes, length_s2)
+        reverse = np.lib.stride_tricks.sliding_window_view(COMPLEMENT[codes[::-1]], length_s1)
+
+        stems2.append(forward[n - length_s2])
+        stems1.append(reverse[seq_length - end_s1])
+        reads.append(np.full(len(n), i))
+        groups.append(group)
+        candidates.append((n, loop))
+
+    results = [(name, 0, None, None, None) for name, seq in batch]
+
+    if len(reads) == 0:
+        return results
+
+    scores = semi_global_scores(np.concatenate(stems1), np.concatenate(stems2), params)
+    reads = np.concatenate(reads)
+    groups = np.concatenate(groups)
+
+    index = np.arange(len(scores))
+    starts = np.flatnonzero(np.r_[True, reads[1:] != reads[:-1]])
+    ends = np.r_[starts[1:], len(scores)]
+    read_of = np.repeat(np.arange(len(starts)), ends - starts)
+
+    # the search stops after the stem2 end where a first score >= 10 is found
+    first_found = np.minimum.reduceat(np.where(scores >= 10, index, len(scores)), starts)
+    found = first_found < ends
+    last_group = groups[np.minimum(first_found, len(scores) - 1)]
+    tested = ~found[read_of] | (groups <= last_group[read_of])
+
+    # first best score among the tested candidates, kept if higher than 0
+    tested_scores = np.where(tested, scores, -1)
+    best_score = np.maximum.reduceat(tested_scores, starts)
+    best = np.minimum.reduceat(np.where(tested_scores == best_score[read_of], index, len(scores)), starts)
+
+    for k, (start, position) in enumerate(zip(starts, best)):
+        if best_score[k] <= 0:
+            continue
+
+        i = int(reads[start])
+        name, seq = batch[i]
+        n, loop = candidates[k]
+        n, loop = int(n[position - start]), int(loop[position - start])
+
+        offset = offset_value - len(seq)
+        end_s1 = n - length_s2 - 1 - loop
+
+        results[i] = (name, int(best_score[k]), (end_s1 - length_s1 + offset, end_s1 + offset),
+                      (n - length_s2 + offset, n + offset), loop)
+
+    return results
+
+
+def read_batches(input_file, max_candidates=200000):
+
+    # batches are limited by their number of candidate hairpins (~5 per base of soft-clip)
+    # sequences are read as uint8 arrays: views of the store, encoded without decoding them to strings
+    batch, size = [], 0
+    for name, seq in read_softclips(input_file, views=True):
+        batch.append((name, seq))
+        size += len(seq) * 5
+        if size >= max_candidates:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def search_worker_batch(args):
+    return search_batch(*args)
+
+
+def hairpin_search(input_file, output_file, length_s1=12, length_s2=12, offset_value=0, workers=1,
+                   params=HAIRPIN_ALIGN_PARAMS):
+
+    batches = ((batch, length_s1, length_s2, offset_value, params) for batch in read_batches(input_file))
+
+    if workers > 1:
+        with Pool(workers) as p:
+            results = list(p.imap(search_worker_batch, batches))
+    else:
+        results = [search_worker_batch(batch) for batch in batches]
+
+    rows = [row for result in results for row in result]
+
+    read, scores, first_stem, second_stem, loop_scores = (list(column) for column in zip(*rows)) if rows else ([],) * 5
+
+    result = pd.DataFrame(dict(read=read, HAIRPIN_score=scores, HAIRPIN_stem1=first_stem, HAIRPIN_stem2=second_stem,
+                               HAIRPIN_loop=loop_scores))
+
+    result.to_csv(output_file, sep='\t', index=None)
+
+
+# Handler function (same file names as the pre-processing notebook)
+
+def hairpin_search_handler(ID, path, workers=1):
+    input_file = f'{path}/{ID}/{ID}-five_prime_softclip[SC=FULL|ALN=80].fa'
+    output_file = f'{path}/{ID}/{ID}-HAIRPIN_search.tsv'
+
+    hairpin_search(input_file, output_file, length_s1=12, length_s2=12, offset_value=80, workers=workers)
+
+    print(f'Completed run {ID}\n')
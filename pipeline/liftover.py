@@ -0,0 +1,107 @@
+import json
+import numpy as np
+import pandas as pd
+
+
+def read_liftover_files(gtf_file, exons_file):
+    """Same tables as section 3.b of the pre-processing notebook: transcript strands, exons genomic
+    coordinates ({'Start': {exon_id: ...}, 'End': {exon_id: ...}}) and exons transcriptomic coordinates."""
+    import pyranges as pr
+
+    gtf = pr.read_gtf(gtf_file)
+    gtf = gtf.df
+
+    strand = gtf.loc[gtf['Feature'] == 'transcript'].set_index('transcript_id')['Strand'].to_dict()
+    exons = gtf.loc[~gtf['exon_id'].isna()][['exon_id', 'Start', 'End']].set_index('exon_id')[['Start', 'End']].to_dict()
+
+    with open(exons_file, 'r') as dico:
+        exonics_positions = json.loads(dico.read())
+
+    return exonics_positions, strand, exons
+
+
+class Liftover:
+    """Transcriptomic -> genomic positions, same result as transcriptome_based_correction (pre-processing notebook).
+
+    Exons of all transcripts are stored in flat arrays, sorted by transcript then transcriptomic end.
+    All positions are converted with a single searchsorted on (transcript, position) keys: the first exon
+    ending after the position contains it if it starts before it. Positions outside exons, or on
+    transcripts missing from the annotation, are converted to NaN.
+    """
+
+    def __init__(self, exonics_positions, strand, exons):
+
+        transcripts, starts, ends, genomic, reverse = [], [], [], [], []
+        self.unordered = {}
+        last_end = 0
+
+        for code, (transcript, transcript_exons) in enumerate(exonics_positions.items()):
+
+            # exons are tested in order, the search stops at the last exon number
+            rows = []
+            for exon, (start, end) in transcript_exons.items():
+                exon_id = f'{transcript}.e{exon}'
+                rows.append((start, end, exons['Start'].get(exon_id, np.nan), exons['End'].get(exon_id, np.nan)))
+                if int(exon) >= len(transcript_exons):
+                    break
+
+            rows = np.array(rows, dtype=float).reshape(-1, 4)
+            last_end = max(last_end, rows[:, 1].max(initial=0))
+
+            # the first matching exon is the one found by searchsorted only if exons do not overlap and are sorted
+            if np.any(rows[1:, 0] <= rows[:-1, 1]) or np.any(rows[:, 0] > rows[:, 1]):
+                self.unordered[code] = rows
+                continue
+
+            minus = strand.get(transcript) != '+'
+            transcripts.append(np.full(len(rows), code))
+            starts.append(rows[:, 0])
+            ends.append(rows[:, 1])
+            genomic.append(rows[:, 3] if minus else rows[:, 2])
+            reverse.append(np.full(len(rows), minus))
+
+        self.codes = pd.Index(list(exonics_positions))
+        self.strand = np.array([strand.get(transcript) != '+' for transcript in exonics_positions])
+
+        self.transcripts = np.concatenate(transcripts) if transcripts else np.array([], dtype=int)
+        self.starts = np.concatenate(starts) if starts else np.array([])
+        self.ends = np.concatenate(ends) if ends else np.array([])
+        self.genomic = np.concatenate(genomic) if genomic else np.array([])
+        self.reverse = np.concatenate(reverse) if reverse else np.array([], dtype=bool)
+
+        # transcriptomic ends are made unique across transcripts by an offset per transcript
+        self.span = float(last_end) + 1
+        self.keys = self.transcripts * self.span + self.ends
+
+    def lift(self, isoforms, positions):
+        codes = self.codes.get_indexer(pd.Index(isoforms))
+        positions = np.asarray(positions, dtype=float)
+        result = np.full(len(positions), np.nan)
+
+        valid = (codes >= 0) & ~np.isnan(positions) & (positions < self.span)
+
+        if len(self.keys) > 0:
+            exon = np.searchsorted(self.keys, codes * self.span + positions, side='left')
+            found = valid & (exon < len(self.keys))
+            exon = np.minimum(exon, len(self.keys) - 1)
+            found &= (self.transcripts[exon] == codes) & (self.starts[exon] <= positions)
+        else:
+            exon = found = np.zeros(len(positions), dtype=bool)
+
+        delta = positions[found] - self.starts[exon[found]]
+        result[found] = np.where(self.reverse[exon[found]], self.genomic[exon[found]] - delta,
+                                 self.genomic[exon[found]] + delta)
+
+        # transcripts whose exons are not ordered: exons tested one by one
+        for code, rows in self.unordered.items():
+            for i in np.flatnonzero((codes == code) & valid):
+                match = np.flatnonzero((rows[:, 0] <= positions[i]) & (positions[i] <= rows[:, 1]))
+                if len(match) > 0:
+                    start, end, genomic_start, genomic_end = rows[match[0]]
+                    delta = positions[i] - start
+                    result[i] = genomic_end - delta if self.strand[code] else genomic_start + delta
+
+        return result
+
+    def __call__(self, isoforms, positions):
+        return self.lift(isoforms, positions)
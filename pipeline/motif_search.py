@@ -0,0 +1,146 @@
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+import rules
+from softclip_store import read_softclips
+from ssp_search import SSPSearch, SSP_ALIGN_PARAMS, SSP_SEQUENCE
+from sl_search import SplicedLeaderSearch, read_spliced_leaders, SL_ALIGN_PARAMS
+from hairpin_search import search_batch as hairpin_batch, HAIRPIN_ALIGN_PARAMS
+
+
+MOTIF_COLUMNS = ['read', 'SSP_score', 'SSP_size', 'SSP_dist',
+                 'SL', 'SL_score', 'SL_distance', 'SL_2nd_pass', 'SL_2nd_pass_score', 'SL_2nd_pass_distance',
+                 'HAIRPIN_score', 'HAIRPIN_stem1', 'HAIRPIN_stem2', 'HAIRPIN_loop']
+
+
+class MotifScanner:
+    """SSP, SL (both passes) and hairpin searches of the pre-processing notebook on the same reads.
+
+    Each read comes with its full 5' soft-clip (SC=FULL|ALN=80: SSP, SL 2nd pass & hairpin searches)
+    and the end of its soft-clip (SC=100|ALN=20: SL search). Results are the values of the separate
+    search tables (search_SSP, search_spliced_leaders & hairpin_search), in a single row per read.
+
+    The dataset only uses the SL 2nd pass of reads whose first SL match is not robust (see
+    spliced_leader_result): the 2nd pass is only run on these reads, unless full_second_pass is set.
+    """
+
+    def __init__(self, spliced_leaders, sensitivity=0.7, offset=80, end_offset=20, ssp_motif=SSP_SEQUENCE,
+                 ssp_params=SSP_ALIGN_PARAMS, sl_params=SL_ALIGN_PARAMS, hairpin_params=HAIRPIN_ALIGN_PARAMS,
+                 length_s1=12, length_s2=12, full_second_pass=False):
+        self.ssp = SSPSearch(ssp_motif, ssp_params, sensitivity)
+        self.sl = SplicedLeaderSearch(spliced_leaders, sl_params, sensitivity=sensitivity)
+        self.offset = offset
+        self.end_offset = end_offset
+        self.hairpin = dict(length_s1=length_s1, length_s2=length_s2, offset_value=offset, params=hairpin_params)
+        self.full_second_pass = full_second_pass
+
+    def spliced_leader(self, seq, offset):
+        match = self.sl.search(seq)
+        if match is None:
+            return None, None, None
+
+        # account for bases aligned at the beginning
+        sl, score, distance = match
+        return sl, score, -(distance - offset)
+
+    def second_pass_needed(self, first_pass):
+        if self.full_second_pass:
+            return np.ones(len(first_pass), dtype=bool)
+
+        SL, score, distance = (list(column) for column in zip(*first_pass))
+        return np.array([sl is not None for sl in SL]) & (rules.robust_SL(SL, score, distance) == 'NOT FOUND')
+
+    def scan_batch(self, batch):
+        hairpins = hairpin_batch([(name, full) for name, full, end in batch], **self.hairpin)
+        first_pass = [self.spliced_leader(end, self.end_offset) for name, full, end in batch]
+        needed = self.second_pass_needed(first_pass)
+
+        rows = []
+        for (name, full, end), sl, second, (_, *hairpin) in zip(batch, first_pass, needed, hairpins):
+            score, size, distance = self.ssp.search(full)
+            ssp = (0, 0, None) if score is None else (score, size, -(distance - self.offset))
+            sl_2nd_pass = self.spliced_leader(full, self.offset) if second else (None, None, None)
+
+            rows.append((name, *ssp, *sl, *sl_2nd_pass, *hairpin))
+
+        return rows
+
+
+def read_paired_batches(full_file, end_file, max_candidates=200000):
+
+    # both soft-clip files are written by the same pass over the BAM: same reads, same order
+    # batches are limited by their number of candidate hairpins (~5 per base of soft-clip)
+    batch, size = [], 0
+    for (name, full), (end_name, end) in zip(read_softclips(full_file), read_softclips(end_file), strict=True):
+        if name != end_name:
+            raise ValueError(f'{full_file} and {end_file} do not list the same reads ({name}, {end_name})')
+
+        batch.append((name, full, end))
+        size += len(full) * 5
+        if size >= max_candidates:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+# the SL profiles can not be pickled, each worker builds its own scanner
+_SCANNER = None
+
+
+def init_worker(spliced_leaders, settings):
+    global _SCANNER
+    _SCANNER = MotifScanner(spliced_leaders, **settings)
+
+
+def scan_worker_batch(batch):
+    return _SCANNER.scan_batch(batch)
+
+
+def scan_motifs(full_file, end_file, output_file, spliced_leaders, workers=1, **settings):
+    """Single pass version of search_SSP, search_spliced_leaders (1st & 2nd pass) and hairpin_search,
+    writing one table with a row per read (columns of MOTIF_COLUMNS, see motif_tables).
+    settings: see MotifScanner."""
+
+    batches = read_paired_batches(full_file, end_file)
+
+    if workers > 1:
+        with Pool(workers, initializer=init_worker, initargs=(spliced_leaders, settings)) as p:
+            results = list(p.imap(scan_worker_batch, batches))
+    else:
+        scanner = MotifScanner(spliced_leaders, **settings)
+        results = [scanner.scan_batch(batch) for batch in batches]
+
+    rows = [row for result in results for row in result]
+
+    table = pd.DataFrame(rows, columns=MOTIF_COLUMNS)
+    table.to_csv(output_file, sep='\t', index=None)
+
+
+def motif_tables(table):
+    """Split a motif search table into the SSP, SL, SL 2nd pass & hairpin tables of the separate searches.
+
+    Without full_second_pass, the SL 2nd pass table only lists matches of the reads searched again."""
+
+    sl_columns = ['read', 'SL', 'score', 'distance_to_start']
+    first_pass = table.loc[table['SL'].notnull(), ['read', 'SL', 'SL_score', 'SL_distance']]
+    second_pass = table.loc[table['SL_2nd_pass'].notnull(), ['read', 'SL_2nd_pass', 'SL_2nd_pass_score',
+                                                              'SL_2nd_pass_distance']]
+
+    return {'SSP': table[['read', 'SSP_score', 'SSP_size', 'SSP_dist']],
+            'SL': first_pass.set_axis(sl_columns, axis=1).reset_index(drop=True),
+            'SL_2nd_pass': second_pass.set_axis(sl_columns, axis=1).reset_index(drop=True),
+            'HAIRPIN': table[['read', 'HAIRPIN_score', 'HAIRPIN_stem1', 'HAIRPIN_stem2', 'HAIRPIN_loop']]}
+
+
+# Handler function (same soft-clip file names as the pre-processing notebook)
+
+def scan_motifs_handler(ID, path, workers=1):
+    full_file = f'{path}/{ID}/{ID}-five_prime_softclip[SC=FULL|ALN=80].fa'
+    end_file = f'{path}/{ID}/{ID}-five_prime_softclip[SC=100|ALN=20].fa'
+    output_file = f'{path}/{ID}/{ID}-motif_search.tsv'
+
+    scan_motifs(full_file, end_file, output_file, read_spliced_leaders(f'{path}/ref/SL_sequences.fasta'),
+                sensitivity=0.7, offset=80, end_offset=20, workers=workers)
+
+    print(f'Completed run {ID}\n')
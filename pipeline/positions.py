@@ -0,0 +1,302 @@
+import os
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+# columns of the dataset table used to count reads at each start position
+COUNT_COLUMNS = ['gene', 'corrected_genomic_start', 'run', 'read_orientation',
+                 'SSP_FOUND', 'ROBUST_SL_FOUND', 'HAIRPIN_FOUND', 'VARIANT_SL_FOUND', 'SL']
+
+# read counts per (gene, position), all additive: counts of several tables are summed
+COUNTS = ['total', 'SSP', 'SL', 'HAIRPIN', 'SL1_variants', 'SL2_variants', 'antisense']
+
+STATS_COLUMNS = ['gene', 'position', 'total', 'SSP', '%SSP', 'SL', 'HAIRPIN', 'UNIDENTIFIED',
+                 '%SL', '%HAIRPIN', '%UNIDENTIFIED', 'SL1_variants', 'SL2_variants', 'SL2_ratio']
+
+
+def position_counts(dataset, excluded_antisense_runs=('SL1_1',)):
+    """Read counts of each (gene, corrected_genomic_start) of a dataset table, index sorted by gene & position.
+
+    SL1 / SL2 variants are counted on robust variants, without the antisense reads of excluded_antisense_runs
+    (SL1_1 in the pre-processing notebook).
+    """
+
+    # reads without gene or position are not part of any group (as in groupby)
+    dataset = dataset.loc[dataset['gene'].notnull() & dataset['corrected_genomic_start'].notnull()]
+
+    antisense = (dataset['read_orientation'] == 'antisense').to_numpy()
+    evaluated = ~(dataset['run'].isin(excluded_antisense_runs).to_numpy() & antisense)
+    variant = evaluated & (dataset['VARIANT_SL_FOUND'] == 'FOUND').to_numpy()
+    sl1 = dataset['SL'].astype('string').str.contains('SL1').fillna(False).to_numpy(dtype=bool)
+
+    flags = pd.DataFrame({'gene': dataset['gene'].to_numpy(), 'position': dataset['corrected_genomic_start'].to_numpy(),
+                          'total': np.ones(len(dataset), dtype=np.int64),
+                          'SSP': (dataset['SSP_FOUND'] == 'FOUND').to_numpy(),
+                          'SL': (dataset['ROBUST_SL_FOUND'] == 'FOUND').to_numpy(),
+                          'HAIRPIN': (dataset['HAIRPIN_FOUND'] == 'FOUND').to_numpy(),
+                          'SL1_variants': variant & sl1, 'SL2_variants': variant & ~sl1,
+                          'antisense': antisense})
+
+    return flags.groupby(['gene', 'position'], sort=True).sum().astype(np.int64)
+
+
+def count_positions(dataset_file, chunksize=2_000_000, excluded_antisense_runs=('SL1_1',)):
+
+    # counts are summed over chunks of the dataset table: memory depends on the number of positions
+    chunks = pd.read_csv(dataset_file, sep='\t', usecols=COUNT_COLUMNS, chunksize=chunksize,
+                         dtype={'gene': object, 'SL': object, 'run': object})
+    counts = [position_counts(chunk, excluded_antisense_runs) for chunk in chunks]
+
+    return add_counts(counts)
+
+
+def add_counts(counts):
+    counts = [table for table in counts if len(table) > 0]
+    if len(counts) == 0:
+        return pd.DataFrame(columns=COUNTS, dtype=np.int64,
+                            index=pd.MultiIndex.from_arrays([[], []], names=['gene', 'position']))
+    if len(counts) == 1:
+        return counts[0]
+    return pd.concat(counts).groupby(level=['gene', 'position'], sort=True).sum()
+
+
+def percent(count, total):
+
+    # python round of each value, as in the notebook (np.round may differ on the last decimal)
+    return [round(value, 2) for value in (count / total * 100).tolist()]
+
+
+def position_stats(counts):
+    """start_positions_stats table (cell 94 of the pre-processing notebook) from position counts."""
+
+    stats = counts.reset_index()
+    total = stats['total'].to_numpy()
+
+    unidentified = total - (stats['SL'] + stats['HAIRPIN']).to_numpy()
+    variants = (stats['SL1_variants'] + stats['SL2_variants']).to_numpy()
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = np.where(variants > 0, stats['SL2_variants'].to_numpy() / variants, np.nan)
+
+    stats = pd.DataFrame({'gene': stats['gene'], 'position': stats['position'].astype(np.int64),
+                          'total': total, 'SSP': stats['SSP'], '%SSP': percent(stats['SSP'].to_numpy(), total),
+                          'SL': stats['SL'], 'HAIRPIN': stats['HAIRPIN'], 'UNIDENTIFIED': unidentified,
+                          '%SL': percent(stats['SL'].to_numpy(), total),
+                          '%HAIRPIN': percent(stats['HAIRPIN'].to_numpy(), total),
+                          '%UNIDENTIFIED': percent(unidentified, total),
+                          'SL1_variants': stats['SL1_variants'], 'SL2_variants': stats['SL2_variants'],
+                          'SL2_ratio': ratio}, columns=STATS_COLUMNS)
+
+    return stats.sort_values(['gene', 'position'])
+
+
+def mimic_positions(stats):
+    """SL_&_mimic_positions table loaded by the app (SL, hairpin mimic & unidentified reads at each position)."""
+
+    return stats[['gene', 'position', 'total', '%SL', '%HAIRPIN', '%UNIDENTIFIED', 'SL2_ratio']] \
+        .rename(columns={'%HAIRPIN': '%hairpin', '%UNIDENTIFIED': '%unidentified'})
+
+
+def locus_bias(counts):
+    """Same table as measure_bias_at_locus (SupFig8 notebook)."""
+
+    bias = counts.reset_index()[['gene', 'position', 'total', 'antisense']].rename(columns={'total': 'total_exp'})
+    bias['sense'] = bias['total_exp'] - bias['antisense']
+    bias['antisense_ratio'] = round(bias['antisense'] / bias['total_exp'], 2)
+
+    return bias
+
+
+def ssp_at_main_tss(counts, main_tss):
+    """Same table as measure_SSP_at_locus (SupFig8 notebook): reads at the main TSS of each gene."""
+
+    counts = counts.reset_index()
+    main_tss_positions = counts['gene'].map(main_tss.set_index('gene')['position'])
+    counts = counts.loc[counts['position'] == main_tss_positions].reset_index(drop=True)
+
+    SSP_stats = pd.DataFrame(dict(gene=counts['gene'], total=counts['total'], SSP_reads=counts['SSP'],
+                                  antisense_reads=counts['antisense'], SL_reads=counts['SL'],
+                                  HAIRPIN_reads=counts['HAIRPIN']))
+
+    SSP_stats['%SSP'] = round(SSP_stats['SSP_reads'] / SSP_stats['total'] * 100, 2)
+    SSP_stats['%SL'] = round(SSP_stats['SL_reads'] / SSP_stats['total'] * 100, 2)
+    SSP_stats['%HAIRPIN'] = round(SSP_stats['HAIRPIN_reads'] / SSP_stats['total'] * 100, 2)
+    SSP_stats['antisense_ratio'] = round(SSP_stats['antisense_reads'] / SSP_stats['total'] * 100, 2)
+
+    return SSP_stats
+
+
+# Incremental update: per-run counts are added to / removed from the total counts
+
+def write_counts(counts, output_file):
+    counts.reset_index().to_csv(output_file, sep='\t', index=None)
+
+
+def read_counts(input_file):
+    counts = pd.read_csv(input_file, sep='\t', dtype={'gene': object, 'position': float})
+    return counts.set_index(['gene', 'position'])[COUNTS].astype(np.int64)
+
+
+def fold_counts(totals, added=(), removed=()):
+    """totals + added - removed, positions left without reads are dropped.
+    Returns the new totals and the positions whose counts changed."""
+
+    touched = [table.index for table in [*added, *removed]]
+    touched = touched[0].append(touched[1:]).unique() if touched else totals.index[:0]
+
+    totals = pd.concat([totals, *added, *(-table for table in removed)]).groupby(level=['gene', 'position'],
+                                                                                  sort=True).sum()
+
+    return totals.loc[totals['total'] > 0].astype(np.int64), touched
+
+
+def update_stats(stats, totals, touched):
+    """start_positions_stats table with the rows of the touched positions recomputed from the total counts."""
+
+    keys = pd.MultiIndex.from_arrays([stats['gene'], stats['position'].astype(float)])
+    kept = stats.loc[~keys.isin(touched)]
+    updated = position_stats(totals.loc[totals.index.intersection(touched)])
+
+    if len(kept) == 0:
+        return updated
+    return pd.concat([kept, updated], ignore_index=True).sort_values(['gene', 'position'])
+
+
+def file_digest(file, chunk_size=1 << 20):
+
+    # sha256 read in chunks (hashlib.file_digest needs python 3.11)
+    digest = hashlib.sha256()
+    with open(file, 'rb') as content:
+        for chunk in iter(lambda: content.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def counts_files(path):
+    return {'total': f'{path}/position_counts.tsv', 'folded': f'{path}/position_counts'}
+
+
+def folded_file(path, ID, digest):
+
+    # one file per content: a run replaced by new counts never overwrites the counts still part of the totals
+    return f"{counts_files(path)['folded']}/{ID}-{digest[:16]}.tsv"
+
+
+def write_totals(totals, folded, stats_digest, output_file):
+    """Total counts with the runs they contain, two header lines: '# stats' & the sha256 of the stats table
+    computed from them, '# folded' & ID=sha256 of the counts file of each run.
+
+    Written to a temporary file then renamed: the totals and the list of folded runs are replaced together.
+    """
+
+    with open(f'{output_file}.tmp', 'w') as file:
+        file.write(f'# stats\t{stats_digest}\n')
+        file.write('\t'.join(['# folded', *(f'{ID}={digest}' for ID, digest in sorted(folded.items()))]) + '\n')
+        totals.reset_index().to_csv(file, sep='\t', index=None)
+    os.replace(f'{output_file}.tmp', output_file)
+
+
+def read_totals(input_file):
+    """(total counts, {run ID: sha256}, sha256 of the stats table) of position_counts.tsv,
+    None when the file is missing or has no header lines."""
+
+    if not os.path.exists(input_file):
+        return None
+
+    with open(input_file) as file:
+        stats, folded = (file.readline().rstrip('\n').split('\t') for _ in range(2))
+        if stats[0] != '# stats' or folded[0] != '# folded':
+            return None
+
+        counts = pd.read_csv(file, sep='\t', dtype={'gene': object, 'position': float})
+
+    folded = dict(run.split('=', 1) for run in folded[1:])
+    return counts.set_index(['gene', 'position'])[COUNTS].astype(np.int64), folded, stats[1]
+
+
+def write_table(table, output_file):
+    table.to_csv(f'{output_file}.tmp', sep='\t', index=None)
+    os.replace(f'{output_file}.tmp', output_file)
+
+
+def update_position_stats(runs, path, rebuild=False):
+    """Update start_positions_stats.tsv & SL_&_mimic_positions.tsv for a new list of runs.
+
+    position_counts.tsv holds the sum of the counts of the folded runs and the sha256 of their counts
+    file, a copy of which is kept in the position_counts folder: new runs are added, runs no longer listed
+    are removed, runs whose counts file changed are replaced, and only the positions of these runs are
+    recomputed. rebuild=True sums the counts of all runs again.
+
+    position_counts.tsv is written last (renamed over the previous one): an interrupted update leaves
+    the previous totals, and is done again from them on the next call (the stats table is recomputed
+    when it is not the one recorded with the totals).
+    """
+
+    files = counts_files(path)
+    stats_file = f'{path}/start_positions_stats.tsv'
+    os.makedirs(files['folded'], exist_ok=True)
+
+    saved = None if rebuild else read_totals(files['total'])
+
+    if saved is None:
+        totals, folded, stats = add_counts([]), {}, None
+    else:
+        totals, folded, stats_digest = saved
+
+        # a stats table written by an interrupted update is recomputed from the totals
+        stats = None
+        if os.path.exists(stats_file) and file_digest(stats_file) == stats_digest:
+            stats = pd.read_csv(stats_file, sep='\t', dtype={'gene': object}, float_precision='round_trip')
+
+    added, removed, changed = [], [], {}
+
+    for ID in runs:
+        run_file = f'{path}/{ID}/{ID}-position_counts.tsv'
+        digest = file_digest(run_file)
+        if folded.get(ID) == digest:
+            continue
+        if ID in folded:
+            removed.append(read_counts(folded_file(path, ID, folded[ID])))
+        added.append(read_counts(run_file))
+        changed[ID] = digest
+
+    dropped = set(folded) - set(runs)
+    for ID in dropped:
+        removed.append(read_counts(folded_file(path, ID, folded[ID])))
+
+    # copies of the new counts first: they are only part of the totals once position_counts.tsv is renamed
+    for ID, digest in changed.items():
+        shutil.copyfile(f'{path}/{ID}/{ID}-position_counts.tsv', f'{folded_file(path, ID, digest)}.tmp')
+        os.replace(f'{folded_file(path, ID, digest)}.tmp', folded_file(path, ID, digest))
+
+    totals, touched = fold_counts(totals, added, removed)
+    stats = position_stats(totals) if stats is None else update_stats(stats, totals, touched)
+
+    write_table(stats, stats_file)
+    write_table(mimic_positions(stats), f'{path}/SL_&_mimic_positions.tsv')
+
+    folded = {ID: digest for ID, digest in {**folded, **changed}.items() if ID in set(runs)}
+    write_totals(totals, folded, file_digest(stats_file), files['total'])
+
+    # copies of the counts no longer part of the totals
+    kept = {os.path.basename(folded_file(path, ID, digest)) for ID, digest in folded.items()}
+    for file in set(os.listdir(files['folded'])) - kept:
+        os.remove(f"{files['folded']}/{file}")
+
+    print(f'Position stats: {len(changed)} runs added or updated, {len(dropped)} removed, '
+          f'{len(touched)} positions updated\n')
+
+
+# Handler functions (same file names as the pre-processing notebook)
+
+def position_stats_handler(path):
+    stats = position_stats(count_positions(f'{path}/dataset_+SSP+SL+HAIRPIN.tsv'))
+
+    stats.to_csv(f'{path}/start_positions_stats.tsv', sep='\t', index=None)
+    mimic_positions(stats).to_csv(f'{path}/SL_&_mimic_positions.tsv', sep='\t', index=None)
+
+
+def position_counts_handler(ID, path):
+    write_counts(count_positions(f'{path}/{ID}/{ID}-dataset.tsv'), f'{path}/{ID}/{ID}-position_counts.tsv')
@@ -0,0 +1,774 @@
+# Reference implementations copied from the pre-processing notebook.
+# The pipeline modules are checked against them (see benchmarks.py), do not optimize them.
+
+import re
+import json
+import numpy as np
+import pysam
+import parasail
+import pandas as pd
+from Bio import SeqIO
+from Bio.Seq import Seq
+
+
+def isoform_to_gene(isoform):
+
+    match = re.search(r"\w+.\d+", isoform)
+
+    if match is not None:
+        return match.group(0)
+    else:
+        return None
+
+
+def genomic_stats(input_file, output_file):
+
+    name = []
+    start = []
+    end = []
+    chrom = []
+
+    alignment = pysam.AlignmentFile(input_file, 'rb')
+
+    for read in alignment:
+
+        # Only take into account primary reads
+        if not read.is_supplementary and not read.is_secondary and not read.is_unmapped and read.seq is not None:
+
+            name.append(read.query_name)
+            chrom.append(alignment.get_reference_name(read.reference_id))
+            start.append(read.reference_start+1)
+            end.append(read.reference_end)
+
+    table = pd.DataFrame(dict(read=name, chromosome=chrom, genomic_start=start, genomic_end=end))
+    table.to_csv(output_file, sep='\t', index=None)
+
+    alignment.close()
+
+
+def transcriptomic_stats(input_file, output_file):
+
+    rows = []
+
+    transcriptome = pysam.AlignmentFile(input_file, 'rb')
+
+    for read in transcriptome:
+
+        # Only take into account primary reads
+        if not read.is_unmapped and not read.is_secondary and not read.is_supplementary and read.seq is not None:
+
+            name = read.query_name
+            isoform = transcriptome.get_reference_name(read.reference_id)
+
+            transcript_start = read.reference_start+1
+            transcript_end = read.reference_end
+
+            orientation = 'antisense' if read.is_reverse else 'sense'
+
+            seq = read.seq
+            seq_length = len(str(seq))
+
+            aln_start = read.query_alignment_start
+            aln_end = read.query_alignment_end
+            aln_length = len(seq[aln_start:aln_end])
+
+            five_prime_sc = -aln_start
+            three_prime_sc = len(seq[aln_start:])
+
+            softclip = 1 if aln_start > 80 else 0
+
+            read_row = {'read':name, 'isoform':isoform, 'read_orientation':orientation, 'softclip':softclip,
+                        'transcriptomic_start':transcript_start, 'transcriptomic_end':transcript_end,
+                        'sequence_length':seq_length, 'alignment_length':aln_length,
+                        'SC5':five_prime_sc, 'alignment_start':aln_start, 'alignment_end':aln_end, 'SC3':three_prime_sc}
+
+            rows.append(read_row)
+
+    dataframe = pd.DataFrame(rows)
+
+    dataframe['gene'] = dataframe['isoform'].apply(isoform_to_gene)
+
+    dataframe = dataframe[['read', 'gene', 'isoform', 'read_orientation', 'softclip', 'transcriptomic_start', 'transcriptomic_end',
+                           'sequence_length', 'alignment_length', 'SC5', 'alignment_start', 'alignment_end', 'SC3']]
+
+    dataframe.to_csv(output_file, sep='\t', index=None)
+
+
+def extract_full_softclip(input_file, output_file, ALN=0):
+
+    with open(output_file, 'w+') as file:
+
+        alignments = pysam.AlignmentFile(input_file, 'rb')
+
+        for read in alignments:
+
+            if not read.is_unmapped and not read.is_supplementary and not read.is_secondary and read.seq is not None:
+
+                name = read.query_name
+
+                start = read.query_alignment_start
+                seq = str(read.seq[0:(start+ALN)])
+
+                file.write(f'>{name}\n{seq}\n')
+
+
+def extract_softclip_end(input_file, output_file, SC, ALN=0):
+
+    alignments = pysam.AlignmentFile(input_file, 'rb')
+
+    with open(output_file, 'w+') as fasta:
+
+        for read in alignments:
+
+            if not read.is_secondary and not read.is_supplementary and not read.is_unmapped and read.seq is not None:
+
+                name = read.query_name
+                start = read.query_alignment_start
+
+                if start > SC:
+                    seq = read.seq[(start-SC) :(start+ALN)]
+
+                elif start <= SC:
+                    seq = read.seq[:(start+ALN)]
+
+                fasta.write(f'>{name}\n{seq}\n')
+
+
+SSP_ALIGN_PARAMS = {'match': 1,
+                    'mismatch': 0,
+                    'gap_open': 2,    # penalty to create a gap
+                    'gap_extend': 1}  # penalty to extend a gap (must have created before)
+
+
+def evaluate_alignment(sequence, motif, seqtype, sensitivity=0.7):
+    
+    ref = len(motif)
+    
+    # initialize
+    aln_score = None
+    aln_size = None
+    aln_dist = None
+    
+    # initial alignment (full seq)
+    aln = semi_global_alignment(sequence, motif, params=SSP_ALIGN_PARAMS)
+    score = aln.score
+    
+    # shorter alignments
+    if score < len(motif) * sensitivity:
+        
+        for pos in reversed(range(15, len(motif), 1)):
+            
+            if seqtype == "5SC":
+                aln = semi_global_alignment(sequence, motif[-pos:], params=SSP_ALIGN_PARAMS)
+            elif seqtype == "3SC":
+                aln = semi_global_alignment(sequence, motif[:pos], params=SSP_ALIGN_PARAMS)
+            else:
+                break
+                
+            score = aln.score
+
+            if score < sensitivity * pos:
+                continue
+            else:
+                aln_score = score
+                aln_size = pos
+                aln_dist = len(sequence) - (int(aln.end_query) + 1)
+                break
+
+    else:
+        aln_score = score
+        aln_size = len(motif)
+        aln_dist = len(sequence) - (int(aln.end_query) + 1)
+        
+    return aln_score, aln_size, aln_dist
+
+
+def search_SSP(input_file, output_file, offset=0):
+    
+    reads = []
+    SSP_scores = []
+    SSP_sizes = []
+    SSP_distances = []
+    
+    for read in SeqIO.parse(input_file, "fasta"):
+        
+        name = read.id
+        SC5_sequence = str(read.seq)
+        
+        score, size, dist = evaluate_alignment(SC5_sequence, 'TTTCTGTTGGTGCTGATATTGCTGGG', '5SC')
+
+        if score is None:
+            reads.append(name)
+            SSP_scores.append(0)
+            SSP_sizes.append(0)
+            SSP_distances.append(None)
+        else:
+            reads.append(name)
+            SSP_scores.append(score)
+            SSP_sizes.append(size)
+            SSP_distances.append(-(dist-offset))
+
+    data = pd.DataFrame(dict(read=reads, SSP_score=SSP_scores, SSP_size=SSP_sizes, SSP_dist=SSP_distances))
+    data = data.set_index('read')
+    data.to_csv(output_file, sep='\t', index=True)
+
+
+SL_ALIGN_PARAMS = {'match': 1,
+                   'mismatch': -1,
+                   'gap_open': 2,    # penalty to create a gap
+                   'gap_extend': 1}  # penalty to extend a gap (must have created before)
+
+
+def semi_global_alignment(reference, query, params):
+
+    subs_mat = parasail.matrix_create("ACGT", params['match'], params['mismatch'])
+    alignment = parasail.sg_trace_striped_32(reference, query, params['gap_open'], params['gap_extend'], subs_mat)
+
+    return alignment
+
+
+# sl_file replaces f'{path}/ref/SL_sequences.fasta'
+def search_spliced_leaders(input_file, output_file, sl_file, sensitivity=0.7, offset=0):
+
+    seq_file = open(sl_file)
+    SPLICELEADERS = {record.id: str(record.seq) for record in SeqIO.parse(seq_file, "fasta")}
+
+    reads = {}
+
+    for record in SeqIO.parse(input_file, "fasta"):
+
+        ref = len(record.seq)
+
+        aln_scores = {}
+        position = {}
+        distance = {}
+
+        for sl_name in SPLICELEADERS:
+
+            sl_seq = SPLICELEADERS[sl_name]
+
+            sl_length = len(sl_seq)
+
+            aln = semi_global_alignment(str(record.seq), sl_seq, params=SL_ALIGN_PARAMS)
+            score = aln.score
+
+            if score < sl_length * sensitivity:
+
+                for pos in reversed(range(7, sl_length, 1)):
+
+                    aln = semi_global_alignment(str(record.seq), sl_seq[-pos:], params=SL_ALIGN_PARAMS)
+                    score = aln.score
+
+                    if score < sensitivity * pos:
+                        continue
+                    else:
+                        aln_scores[sl_name] = score
+                        position[sl_name] = pos
+                        distance[sl_name] = ref - (int(aln.end_query) + 1)
+                        break
+            else:
+                aln_scores[sl_name] = score
+                position[sl_name] = sl_length
+                distance[sl_name] = ref - (int(aln.end_query) + 1)
+
+        if len(aln_scores) > 0:
+
+            top_score = max(aln_scores.values())
+            best_matches = [sl for sl, value in aln_scores.items() if value == top_score]
+
+            if len(best_matches) == 1:
+
+                sl_found = best_matches[0]
+                distance = distance[sl_found]
+                reads[record.id] = (sl_found, top_score, distance)
+
+            else:
+
+                distance = [dist for sl, dist in distance.items() if sl in best_matches]
+                small_dist = min(distance)
+                ix = [n for n, dist in enumerate(distance) if dist == small_dist]
+
+                closest_match = [sl for n, sl in enumerate(best_matches) if n in ix]
+
+                sl_found = ' / '.join(closest_match)
+
+                reads[record.id] = (sl_found, top_score, small_dist)
+
+    final = pd.DataFrame.from_dict(reads, orient='index')
+    final.columns = ['SL','score','distance_to_start']
+
+    final['distance_to_start'] = -(final['distance_to_start'] - offset)
+
+    final.index.name = 'read'
+    final.to_csv(output_file, sep='\t', index=True)
+
+
+HAIRPIN_ALIGN_PARAMS = {'match': 1,
+                        'mismatch': 0,
+                        'gap_open': 2,    # penalty to create a gap
+                        'gap_extend': 1}  # penalty to extend a gap (must have created before)
+
+
+def hairpin_search(input_file, output_file, length_s1=12, length_s2=12, offset_value=0):
+
+    read = []
+    scores = []
+    first_stem = []
+    second_stem = []
+    loop_scores = []
+
+    for record in SeqIO.parse(input_file, "fasta"):
+
+        seq = record.seq
+        seq_length = len(seq)
+        min_index = 50
+        offset = offset_value - seq_length
+
+        hairpin_found = False
+        best_score = 0
+        last_best_n = 0
+        s1 = None
+        s2 = None
+        loop_size = None
+
+        for n in reversed(range(min_index, seq_length+1, 2)):
+
+            available_loop = n - min_index
+            max_loop = 10 if available_loop > 10 else available_loop
+
+            for loop in reversed(range(0, max_loop, 1)):
+
+                end_s2 = n
+                start_s2 = end_s2 - length_s2
+                stem2 = str(seq[start_s2:end_s2])
+
+                end_s1 = start_s2 - 1 - loop
+                start_s1 = end_s1 - length_s1
+                stem1 = str(Seq(seq[start_s1:end_s1]).reverse_complement())
+
+                aln = semi_global_alignment(stem1, stem2, params=HAIRPIN_ALIGN_PARAMS)
+                score = aln.score
+
+                if score > best_score:
+
+                    best_score = score
+                    s1 = (start_s1+offset, end_s1+offset)
+                    s2 = (start_s2+offset, end_s2+offset)
+                    loop_size = loop
+
+                    if score >= 10:
+                        hairpin_found = True
+                        continue
+
+            if hairpin_found:
+                break
+
+        read.append(record.id)
+        scores.append(best_score)
+        first_stem.append(s1)
+        second_stem.append(s2)
+        loop_scores.append(loop_size)
+
+    result = pd.DataFrame(dict(read=read, HAIRPIN_score=scores, HAIRPIN_stem1=first_stem, HAIRPIN_stem2=second_stem, HAIRPIN_loop=loop_scores))
+
+    result.to_csv(output_file, sep='\t', index=None)
+
+
+# Sections 3 to 6 of the notebook (cells 23-24, 29-30, 46-49, 63-76 & 87-90) gathered in a single function.
+# liftover(isoform, position) replaces transcriptome_based_correction.
+def assemble_dataset(runs, path, strands, liftover):
+
+    dflist = []
+
+    for ID in runs:
+
+        genome = f'{path}/{ID}-genomic_stats.tsv'
+        transcriptome = f'{path}/{ID}-transcriptome_stats.tsv'
+
+        genome_stats = pd.read_csv(genome, sep='\t')
+        genome_stats = genome_stats.set_index('read')
+
+        transcriptome_stats = pd.read_csv(transcriptome, sep='\t')
+        transcriptome_stats = transcriptome_stats.set_index('read')
+
+        final = pd.concat([genome_stats, transcriptome_stats], join='outer', axis=1)
+
+        final = final.loc[(final['genomic_start'].notnull()) & (final['transcriptomic_start'].notnull())]
+
+        final.index.name = 'read'
+        final = final.reset_index()
+
+        final['run'] = ID
+
+        final = final[['read', 'gene', 'isoform', 'chromosome', 'read_orientation', 'softclip', 'run',
+                       'genomic_start', 'genomic_end', 'transcriptomic_start', 'transcriptomic_end',
+                       'sequence_length', 'alignment_length', 'SC5', 'alignment_start', 'alignment_end', 'SC3']]
+
+        dflist.append(final)
+
+    stats = pd.concat(dflist, ignore_index=True)
+
+    stats['gene_orientation'] = stats.apply(lambda x: strands[x['gene']], axis=1)
+
+    stats['start'] = stats.apply(lambda x: x['genomic_start'] if strands[x['gene']] == '+' else x['genomic_end'], axis=1)
+    stats['end'] = stats.apply(lambda x: x['genomic_end'] if strands[x['gene']] == '+' else x['genomic_start'], axis=1)
+
+    stats['genomic_start'] = stats['start']
+    stats['genomic_end'] = stats['end']
+
+    table = stats[['read', 'gene', 'isoform', 'chromosome', 'gene_orientation', 'read_orientation', 'softclip', 'run',
+                   'genomic_start', 'genomic_end', 'transcriptomic_start', 'transcriptomic_end',
+                   'sequence_length', 'alignment_length', 'SC5', 'alignment_start', 'alignment_end', 'SC3']]
+
+    # correct_genomic_position
+    table['corrected_genomic_start'] = table.apply(lambda x: liftover(x['isoform'], x['transcriptomic_start']), axis=1)
+    table['corrected_genomic_end'] = table.apply(lambda x: liftover(x['isoform'], x['transcriptomic_end']), axis=1)
+
+    table = table.loc[table['gene'].notnull()]
+
+    final = table[['read', 'gene', 'isoform', 'chromosome', 'gene_orientation', 'read_orientation', 'softclip', 'run',
+                   'corrected_genomic_start', 'corrected_genomic_end', 'genomic_start', 'genomic_end',
+                   'transcriptomic_start', 'transcriptomic_end',
+                   'sequence_length', 'alignment_length', 'SC5', 'alignment_start', 'alignment_end', 'SC3']]
+
+    col_types = {'read':object, 'gene':object, 'isoform':object, 'chromosome':object,
+                 'genomic_start':float, 'genomic_end':float, 'corrected_genomic_start':float, 'corrected_genomic_end':float,
+                 'read_orientation':object, 'softclip':int, 'run':object}
+
+    corrected_dataset = final.astype(col_types)
+
+    # SSP
+    df_list = []
+    for ID in runs:
+        df = pd.read_csv(f'{path}/{ID}/{ID}-SSP_search.tsv', sep='\t')
+        df_list.append(df)
+    ssp_result = pd.concat(df_list, axis=0)
+
+    dataset_SSP = corrected_dataset.merge(ssp_result, on='read', how='left')
+    dataset_SSP['SSP_FOUND'] = dataset_SSP.apply(lambda x: 'FOUND' if x['SSP_dist']==x['SSP_dist'] and x['SSP_dist']-x['SC5']<=80 else 'NOT FOUND', axis=1)
+
+    # SL
+    sl_result = pd.DataFrame()
+    for ID in runs:
+        df = pd.read_csv(f'{path}/{ID}/{ID}-SL_search.tsv', sep='\t')
+        sl_result = pd.concat([sl_result, df], axis=0)
+
+    sl_result['ROBUST_SL'] = sl_result.apply(lambda x: robust_SL(SL=x['SL'], score=x['score'], dist=x['distance_to_start']), axis=1)
+    sl_result['ROBUST_VARIANT'] = sl_result.apply(lambda x: robust_variant(SL=x['SL'], score=x['score'], dist=x['distance_to_start']), axis=1)
+
+    reads_not_sl = sl_result[sl_result['ROBUST_SL']=='NOT FOUND']
+
+    sl_result_2ndpass = pd.DataFrame()
+    for ID in runs:
+        df = pd.read_csv(f'{path}/{ID}/{ID}-SL_search_(2nd_pass).tsv', sep='\t')
+        sl_result_2ndpass = pd.concat([sl_result_2ndpass, df], axis=0)
+
+    sl_result_2ndpass['ROBUST_SL'] = sl_result_2ndpass.apply(lambda x: 'FOUND' if x['SL']==x['SL'] and x['score'] >= 12 else 'NOT FOUND', axis=1)
+    sl_result_2ndpass['ROBUST_VARIANT'] = 'NOT FOUND'
+
+    reads_no_sl = list(reads_not_sl['read'])
+    sl_found_2ndpass = sl_result_2ndpass[(sl_result_2ndpass['ROBUST_SL']=='FOUND') & (sl_result_2ndpass['read'].isin(reads_no_sl))]
+
+    sl_result.set_index('read', inplace=True)
+    sl_result.update(sl_found_2ndpass.set_index('read'))
+    sl_result = sl_result.reset_index()
+
+    sl_result.columns = ['read','SL', 'SL_score', 'SL_distance', 'ROBUST_SL_FOUND', 'VARIANT_SL_FOUND']
+
+    dataset_SSP_SL = dataset_SSP.merge(sl_result, on='read', how='left')
+
+    # HAIRPIN
+    df_list = []
+    for ID in runs:
+        df = pd.read_csv(f'{path}/{ID}/{ID}-HAIRPIN_search.tsv', sep='\t')
+        df_list.append(df)
+
+    hairpin_result = pd.concat(df_list)
+
+    dataset_SSP_SL_hairpin = dataset_SSP_SL.merge(hairpin_result, on='read', how='left')
+    dataset_SSP_SL_hairpin['HAIRPIN_FOUND'] = dataset_SSP_SL_hairpin.apply(lambda x: hairpin_found(x['read_orientation'], x['ROBUST_SL_FOUND'], x['HAIRPIN_score']), axis=1)
+
+    return dataset_SSP_SL_hairpin
+
+
+def robust_SL(SL, score, dist):
+
+    if SL:
+        if score > 9 or dist > -3:
+            return 'FOUND'
+        else:
+            return 'NOT FOUND'
+    else:
+        return 'NOT FOUND'
+
+
+def robust_variant(SL, score, dist):
+
+    if SL:
+
+        if score > 9 :
+            return 'FOUND'
+
+        else:
+            if score > 7 and dist > -3 :
+                return 'FOUND'
+            else:
+                return 'NOT FOUND'
+    else:
+        return 'NOT FOUND'
+
+
+def hairpin_found(read_orientation, sl_found, hairpin_score):
+
+    if read_orientation == 'antisense' and sl_found != 'FOUND' and hairpin_score >= 10:
+        return 'FOUND'
+    else:
+        return 'NOT FOUND'
+
+
+# Section 3.b: the notebook reads these tables as globals (see read_liftover_reference)
+exonics_positions, strand, gtf = {}, {}, {}
+
+
+def read_liftover_reference(gtf_file, exons_file):
+    global exonics_positions, strand, gtf
+    import pyranges as pr
+
+    gtf = pr.read_gtf(gtf_file)
+    gtf = gtf.df
+
+    strand = gtf.loc[gtf['Feature'] == 'transcript'].set_index('transcript_id')['Strand'].to_dict()
+
+    gtf = gtf.loc[~gtf['exon_id'].isna()][['exon_id', 'Start', 'End']].set_index('exon_id')[['Start', 'End']].to_dict()
+
+    with open(exons_file, 'r') as dico:
+        exonics_positions = json.loads(dico.read())
+
+
+def transcriptome_based_correction(transcript, transcriptome_position):
+
+    exons = exonics_positions[transcript]
+
+    for exon, i in exons.items():
+
+        if i[0] <= transcriptome_position <= i[1]:
+
+            delta = transcriptome_position - i[0]
+
+            if strand[transcript] == '+':
+                exon_start = gtf['Start'][f'{transcript}.e{exon}']
+                genomic_position = exon_start + delta
+            else:
+                exon_start = gtf['End'][f'{transcript}.e{exon}']
+                genomic_position = exon_start - delta
+
+            return genomic_position
+
+        else:
+            if int(exon) < len(exons):
+                continue
+            else:
+                return np.nan
+
+
+# Section 7 (cell 94), returns the table saved as start_positions_stats.tsv
+def start_positions_stats(dataset_SSP_SL_hairpin):
+
+    rows = []
+
+    for (gene, position), reads in dataset_SSP_SL_hairpin.groupby(['gene','corrected_genomic_start']):
+
+        # Total of reads at a given position
+        total = len(reads)
+
+        position = int(position)
+        
+        ###########################
+        # Measure number of SSP  at the position 
+        # (this is measured independantly from SL/hairpin/unidentified)
+        ###########################
+        ssp_reads = len(reads[reads['SSP_FOUND'] == 'FOUND'])
+        ssp_percent = round(ssp_reads/total*100, 2)
+        
+        ###########################
+        # Measure number of SL / hairpin / unidentified at the position
+        ###########################
+        sl_reads = len(reads[reads['ROBUST_SL_FOUND'] == 'FOUND'])
+        sl_percent = round(sl_reads/total*100, 2)
+        
+        hairpin_reads = len(reads[reads['HAIRPIN_FOUND'] == 'FOUND'])
+        hairpin_percent = round(hairpin_reads/total*100, 2)
+        
+        unidentified_reads = total - (sl_reads+hairpin_reads)
+        unidentified_percent = round(unidentified_reads/total*100, 2)
+        
+
+        ###########################
+        # Measure ratio SL1 / SL2
+        ###########################
+        
+        # Sense reads from SL1_1 experiment are not used for counting SL1/SL2/Hairpin percentages
+        evaluated_reads = reads[~((reads['run'] == 'SL1_1') & (reads['read_orientation'] == 'antisense'))]
+        evaluated = len(evaluated_reads)
+        
+        if evaluated > 0:
+        
+            # robust variants are used to measure SL1/SL2 ratio 
+            # (-> subgroup of ROBUST SL for which we have a ROBUST VARIANT)
+            robust_variant = evaluated_reads[evaluated_reads['VARIANT_SL_FOUND'] == 'FOUND']
+            
+            # count SL1 and SL2 variants
+            sl1 = len(robust_variant[robust_variant['SL'].str.contains('SL1')])
+            sl2 = len(robust_variant[~(robust_variant['SL'].str.contains('SL1'))])
+            
+            # measure SL2/SL1 ratio
+            sl2_ratio = sl2/(sl1+sl2) if (sl1+sl2)>0 else None
+            
+        else:
+            sl1 = 0
+            sl2 = 0
+            sl2_ratio = None
+            
+        # Put numbers into a dictionnary
+        row = {'gene':gene, 'position':position, 'total':total, 'SSP':ssp_reads, '%SSP':ssp_percent,
+               'SL':sl_reads, 'HAIRPIN':hairpin_reads, 'UNIDENTIFIED':unidentified_reads,
+               '%SL':sl_percent, '%HAIRPIN':hairpin_percent, '%UNIDENTIFIED':unidentified_percent,
+               'SL1_variants':sl1, 'SL2_variants':sl2, 'SL2_ratio':sl2_ratio }
+        
+        rows.append(row)
+        
+    # create dataframe
+    result = pd.DataFrame(rows)
+    result = result.sort_values(['gene','position'])
+
+    return result
+
+
+# SupFig8 notebook
+def measure_bias_at_locus(dataset):
+    
+    genes = []
+    positions = []
+    total_reads = []
+    antisense_reads = []
+
+    for (gene, position), table in dataset.groupby(['gene','corrected_genomic_start']):
+        genes.append(gene)
+        positions.append(position)
+        total_reads.append(len(table))
+        antisense_reads.append(len(table[table['read_orientation']=='antisense']))
+    
+    # build dataframe from lists and measure ratio
+    locus_bias = pd.DataFrame(dict(gene=genes, position=positions, total_exp=total_reads, antisense=antisense_reads))
+    locus_bias['sense'] = locus_bias['total_exp'] - locus_bias['antisense']
+    locus_bias['antisense_ratio'] = round(locus_bias['antisense']/locus_bias['total_exp'], 2)
+    
+    return locus_bias
+
+
+def measure_SSP_at_locus(dataset, main_tss):
+    
+    # determine main tss positions
+    main_tss_positions = main_tss.set_index('gene')['position'].to_dict()
+    
+    # measure %SSP at locus
+    genes = []
+    total = []
+    SSP_reads = []
+    SL_reads = []
+    HAIRPIN_reads = []
+    antisense_reads = []
+
+    for (gene,pos), table in dataset.groupby(['gene','corrected_genomic_start']):
+        
+        if gene in main_tss_positions and pos == main_tss_positions[gene]:
+            genes.append(gene)
+            total.append(len(table))
+            SL_reads.append(len(table[table['ROBUST_SL_FOUND']=='FOUND']))
+            HAIRPIN_reads.append(len(table[table['HAIRPIN_FOUND']=='FOUND']))
+            SSP_reads.append(len(table[table['SSP_FOUND']=='FOUND']))
+            antisense_reads.append(len(table[table['read_orientation']=='antisense']))
+
+    SSP_stats = pd.DataFrame(dict(gene=genes, total=total, SSP_reads=SSP_reads, antisense_reads=antisense_reads,
+                                 SL_reads=SL_reads, HAIRPIN_reads=HAIRPIN_reads))
+    
+    SSP_stats['%SSP'] = round(SSP_stats['SSP_reads']/SSP_stats['total']*100, 2)
+    SSP_stats['%SL'] = round(SSP_stats['SL_reads']/SSP_stats['total']*100, 2)
+    SSP_stats['%HAIRPIN'] = round(SSP_stats['HAIRPIN_reads']/SSP_stats['total']*100, 2)
+    SSP_stats['antisense_ratio'] = round(SSP_stats['antisense_reads']/SSP_stats['total']*100, 2)
+    
+    return SSP_stats
+
+
+# Fig1 notebook (same functions in SupFig4: extract_base_quality)
+def avgNestedLists(nested_vals):
+    
+    output = []
+    maximum = 0
+    for lst in nested_vals:
+        if len(lst) > maximum:
+            maximum = len(lst)
+    
+    for index in range(maximum): # Go through each index of longest list
+        temp = []
+        for lst in nested_vals: # Go through each list
+            if index < len(lst): # If not an index error
+                temp.append(lst[index])
+        output.append(np.nanmean(temp))
+    return output
+
+
+def extract_BaseQuality(alignments):
+    
+    total = 0
+    aligned = []
+    unaligned = []
+    
+    # loop over alignments
+    for read in alignments:
+        
+        # only look primary alignments
+        if not read.is_unmapped and not read.is_secondary and not read.is_supplementary and read.seq is not None:
+            
+            quali = read.query_qualities
+            
+            # filter for antisense reads
+            if quali is not None and read.is_reverse:
+
+                start = read.query_alignment_start
+                end = read.query_alignment_end
+
+                # filter for long soft-clips
+                if start > 80:
+
+                    # aligned region
+                    aligned_qual = list(quali[start:end])
+                    aligned.append(aligned_qual)
+
+                    # unaligned (= softclip) region
+                    sc_qual = list(quali[:start])
+                    sc_qual.reverse()
+                    unaligned.append(sc_qual)
+                    
+                    # count reads
+                    total = total+1
+                    
+    
+    # averaged values
+    avgAligned = avgNestedLists(aligned)
+    
+    avgUnaligned = avgNestedLists(unaligned)
+    avgUnaligned.reverse()
+
+    # base quality on Y axis
+    avg = avgUnaligned + avgAligned
+
+    # X axis values (= base position relative to alignment start)
+    xUnaligned = [i for i in range(-len(avgUnaligned), 1)]
+    xAligned = [i for i in range(0, len(avgAligned))]
+    
+    # Y axis values (= average value)
+    yUnaligned = avg[:len(avgUnaligned)+1]
+    yAligned = avg[len(avgUnaligned):]
+    
+    return total, xUnaligned, xAligned, yUnaligned, yAligned
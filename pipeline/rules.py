@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+
+# Classification rules of the pre-processing notebook, applied to whole columns
+# (same results as the row by row versions in reference.py, see tests/test_rules.py)
+
+def label(condition):
+    return np.where(condition, 'FOUND', 'NOT FOUND')
+
+
+def numbers(column):
+    # missing values (NaN, None, pd.NA) as NaN: comparisons with them are false, as in python
+    return pd.Series(column).to_numpy(dtype=float, na_value=np.nan)
+
+
+def gene_orientation(genes, strands):
+    return pd.Series(genes).map(strands).to_numpy()
+
+
+def oriented_positions(genomic_start, genomic_end, orientation):
+
+    # start & end are swapped on genes of the minus strand
+    forward = np.asarray(orientation) == '+'
+    return np.where(forward, genomic_start, genomic_end), np.where(forward, genomic_end, genomic_start)
+
+
+def ssp_found(ssp_dist, sc5):
+    ssp_dist = numbers(ssp_dist)
+    return label(~np.isnan(ssp_dist) & (ssp_dist - numbers(sc5) <= 80))
+
+
+def robust_SL(SL, score, dist):
+
+    # 'if SL' of the notebook: python truth value of each value (NaN is true, None and '' are false)
+    found = np.asarray(SL, dtype=object).astype(bool)
+
+    # Robust SL are defined based on their alignment score (score of 10 or higher)
+    # or based on how close they are found to the start of the alignment
+    return label(found & ((numbers(score) > 9) | (numbers(dist) > -3)))
+
+
+def robust_variant(SL, score, dist):
+    found = np.asarray(SL, dtype=object).astype(bool)
+    score, dist = numbers(score), numbers(dist)
+
+    # any match which scored 10 or plus, matchs which score 8 or 9 if immediatily near the ATG
+    return label(found & ((score > 9) | ((score > 7) & (dist > -3))))
+
+
+def robust_SL_2nd_pass(SL, score):
+    return label(pd.Series(SL).notnull().to_numpy() & (numbers(score) >= 12))
+
+
+def hairpin_found(read_orientation, sl_found, hairpin_score):
+
+    # hairpin accepted only on antisense reads for which we could not detect an SL sequence
+    return label((np.asarray(read_orientation, dtype=object) == 'antisense') &
+                 (np.asarray(sl_found, dtype=object) != 'FOUND') & (numbers(hairpin_score) >= 10))
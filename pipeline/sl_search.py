@@ -0,0 +1,168 @@
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+import parasail
+from Bio import SeqIO
+from softclip_store import read_softclips
+
+
+SL_ALIGN_PARAMS = {'match': 1,
+                   'mismatch': -1,
+                   'gap_open': 2,    # penalty to create a gap
+                   'gap_extend': 1}  # penalty to extend a gap (must have created before)
+
+
+def read_spliced_leaders(sl_file):
+    with open(sl_file) as seq_file:
+        return {record.id: str(record.seq) for record in SeqIO.parse(seq_file, "fasta")}
+
+
+def read_batches(input_file, batch_size):
+
+    # fasta file or soft-clip store
+    batch = []
+    for name, seq in read_softclips(input_file):
+        batch.append((name, seq))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class SplicedLeaderSearch:
+    """Same result as search_spliced_leaders (pre-processing notebook) for a single read.
+
+    The notebook aligns the full SL, then shorter and shorter SL (shortened on the 5' side) until the
+    score reaches the sensitivity threshold. Aligning the reversed SL against the reversed read gives
+    the scores of all shortened SL from a single DP table: a semi-global alignment of the first pos
+    bases of the reversed SL ends either on its last base (row pos-1) or at the end of the read (last
+    column, rows < pos). Only the alignments of the best SL are traced back, to get their distance.
+    """
+
+    def __init__(self, spliced_leaders, params=SL_ALIGN_PARAMS, sensitivity=0.7, min_length=7):
+        self.params = params
+        self.sequences = dict(spliced_leaders)
+        self.matrix = parasail.matrix_create("ACGT", params['match'], params['mismatch'])
+
+        # name, profile of the reversed sequence, shortened sizes & their minimum score
+        self.leaders = []
+        for name, seq in spliced_leaders.items():
+            sizes = np.array([len(seq)] + list(reversed(range(min_length, len(seq), 1))))
+            self.leaders.append((name, parasail.profile_create_32(seq[::-1], self.matrix), sizes, sensitivity * sizes))
+
+    def prefix_scores(self, profile, reversed_read):
+        result = parasail.sg_table_striped_profile_32(profile, reversed_read, self.params['gap_open'],
+                                                      self.params['gap_extend'])
+
+        # the score table points to the memory of result, which must be kept alive while reading it
+        table = result.score_table
+        scores = np.maximum(table.max(axis=1), np.maximum.accumulate(table[:, -1]))
+
+        return scores
+
+    def first_accepted(self, profile, sizes, thresholds, reversed_read):
+
+        # scores of the full SL then of the shortened SL, in the order they are tested in the notebook
+        scores = self.prefix_scores(profile, reversed_read)[sizes - 1]
+        accepted = np.flatnonzero(scores >= thresholds)
+
+        if len(accepted) == 0:
+            return None
+
+        return int(scores[accepted[0]]), int(sizes[accepted[0]])
+
+    def align(self, sequence, sl_seq):
+        return parasail.sg_trace_striped_32(sequence, sl_seq, self.params['gap_open'], self.params['gap_extend'],
+                                            self.matrix)
+
+    def search(self, sequence):
+        reversed_read = sequence[::-1]
+
+        aln_scores = {}
+        position = {}
+
+        for name, profile, sizes, thresholds in self.leaders:
+            match = self.first_accepted(profile, sizes, thresholds, reversed_read)
+
+            if match is not None:
+                aln_scores[name], position[name] = match
+
+        if len(aln_scores) == 0:
+            return None
+
+        # Get best % match SL
+        top_score = max(aln_scores.values())
+        best_matches = [sl for sl, value in aln_scores.items() if value == top_score]
+
+        distance = [len(sequence) - (int(self.align(sequence, self.sequences[sl][-position[sl]:]).end_query) + 1)
+                    for sl in best_matches]
+
+        # equal scores: closest SL(s) kept
+        small_dist = min(distance)
+        closest_match = [sl for sl, dist in zip(best_matches, distance) if dist == small_dist]
+
+        return ' / '.join(closest_match), top_score, small_dist
+
+    def search_batch(self, batch):
+        return [(name, match) for name, match in ((name, self.search(seq)) for name, seq in batch)
+                if match is not None]
+
+
+# parasail profiles can not be pickled, each worker builds its own search engine
+_ENGINE = None
+
+
+def init_worker(spliced_leaders, sensitivity, params=SL_ALIGN_PARAMS):
+    global _ENGINE
+    _ENGINE = SplicedLeaderSearch(spliced_leaders, params, sensitivity=sensitivity)
+
+
+def search_worker_batch(batch):
+    return _ENGINE.search_batch(batch)
+
+
+def search_spliced_leaders(input_file, output_file, spliced_leaders, sensitivity=0.7, offset=0, workers=1,
+                           batch_size=5000, params=SL_ALIGN_PARAMS):
+
+    batches = read_batches(input_file, batch_size)
+
+    if workers > 1:
+        with Pool(workers, initializer=init_worker, initargs=(spliced_leaders, sensitivity, params)) as p:
+            results = list(p.imap(search_worker_batch, batches))
+    else:
+        engine = SplicedLeaderSearch(spliced_leaders, params, sensitivity=sensitivity)
+        results = [engine.search_batch(batch) for batch in batches]
+
+    reads = {name: match for result in results for name, match in result}
+
+    final = pd.DataFrame.from_dict(reads, orient='index')
+    final.columns = ['SL', 'score', 'distance_to_start']
+
+    # account for bases aligned at the beginning
+    final['distance_to_start'] = -(final['distance_to_start'] - offset)
+
+    final.index.name = 'read'
+    final.to_csv(output_file, sep='\t', index=True)
+
+
+# Handler functions (same file names as the pre-processing notebook)
+
+def search_spliced_leaders_handler(ID, path, workers=1):
+    input_file = f'{path}/{ID}/{ID}-five_prime_softclip[SC=100|ALN=20].fa'
+    output_file = f'{path}/{ID}/{ID}-SL_search.tsv'
+
+    search_spliced_leaders(input_file, output_file, read_spliced_leaders(f'{path}/ref/SL_sequences.fasta'),
+                           sensitivity=0.7, offset=20, workers=workers)
+
+    print(f'Completed run {ID}\n')
+
+
+def search_spliced_leaders_2nd_pass(ID, path, workers=1):
+    input_file = f'{path}/{ID}/{ID}-five_prime_softclip[SC=FULL|ALN=80].fa'
+    output_file = f'{path}/{ID}/{ID}-SL_search_(2nd_pass).tsv'
+
+    search_spliced_leaders(input_file, output_file, read_spliced_leaders(f'{path}/ref/SL_sequences.fasta'),
+                           sensitivity=0.7, offset=80, workers=workers)
+
+    print(f'Completed run {ID}\n')
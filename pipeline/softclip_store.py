@@ -0,0 +1,158 @@
+import tempfile
+import shutil
+from array import array
+import numpy as np
+from Bio import SeqIO
+
+
+# File layout: sequences | names | padding to 8 bytes | sequence offsets | name offsets | footer
+# sequences and names are concatenated ascii bytes, offsets are int64 (nreads + 1 values, starting at 0)
+MAGIC = b'SCSTORE1'
+FOOTER = np.dtype([('nreads', '<i8'), ('sequences', '<i8'), ('names', '<i8'), ('magic', 'S8')])
+
+
+class StoreWriter:
+    """Writes (name, sequence) records to a soft-clip store, one record at a time."""
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.file = None
+
+    def open(self):
+        self.file = open(self.output_file, 'wb')
+        self.names = tempfile.TemporaryFile()
+        self.offsets, self.name_offsets = array('q', [0]), array('q', [0])
+
+    def add(self, name, seq):
+        seq, name = seq.encode(), name.encode()
+        self.file.write(seq)
+        self.names.write(name)
+        self.offsets.append(self.offsets[-1] + len(seq))
+        self.name_offsets.append(self.name_offsets[-1] + len(name))
+
+    def add_store(self, store):
+
+        # records of another store appended as a whole
+        self.file.write(store.sequences)
+        self.names.write(store.names)
+        self.offsets.extend((store.offsets[1:] + self.offsets[-1]).tolist())
+        self.name_offsets.extend((store.name_offsets[1:] + self.name_offsets[-1]).tolist())
+
+    def close(self):
+        self.names.seek(0)
+        shutil.copyfileobj(self.names, self.file)
+        self.names.close()
+
+        size = self.offsets[-1] + self.name_offsets[-1]
+        self.file.write(bytes(-size % 8))
+
+        for offsets in [self.offsets, self.name_offsets]:
+            self.file.write(np.asarray(offsets, dtype='<i8').tobytes())
+
+        footer = np.array([(len(self.offsets) - 1, self.offsets[-1], self.name_offsets[-1], MAGIC)], dtype=FOOTER)
+        self.file.write(footer.tobytes())
+
+        self.file.close()
+        self.file = None
+
+
+class SoftclipStore:
+    """Memory mapped soft-clip store: sequences are read from the file without parsing.
+
+    store.sequence(i) is a uint8 view of the bases of read i (no copy), store.views() gives these
+    views for every read. Iterating over the store gives (name, sequence) strings, decoded by blocks
+    of reads (the SSP & SL searches align strings, only the hairpin search works on the views).
+    """
+
+    def __init__(self, input_file):
+        # plain array on the memory map: slices of a np.memmap are slower to create
+        buffer = np.memmap(input_file, dtype=np.uint8, mode='r').view(np.ndarray)
+        footer = buffer[-FOOTER.itemsize:].view(FOOTER)[0]
+
+        if footer['magic'] != MAGIC:
+            raise ValueError(f'{input_file} is not a soft-clip store')
+
+        nreads, sequences, names = int(footer['nreads']), int(footer['sequences']), int(footer['names'])
+        start = sequences + names + (-(sequences + names) % 8)
+
+        self.sequences = buffer[:sequences]
+        self.names = buffer[sequences:sequences + names]
+        self.offsets = buffer[start:start + 8 * (nreads + 1)].view('<i8')
+        self.name_offsets = buffer[start + 8 * (nreads + 1):start + 16 * (nreads + 1)].view('<i8')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def sequence(self, i):
+        return self.sequences[self.offsets[i]:self.offsets[i + 1]]
+
+    def name(self, i):
+        return self.names[self.name_offsets[i]:self.name_offsets[i + 1]].tobytes().decode()
+
+    def __iter__(self):
+        return self.records()
+
+    def views(self, block_size=10000):
+        for first in range(0, len(self), block_size):
+            last = min(first + block_size, len(self))
+
+            # names decoded by blocks, sequences left in the memory map
+            names = self.names[self.name_offsets[first]:self.name_offsets[last]].tobytes().decode()
+            offsets = self.offsets[first:last + 1].tolist()
+            name_offsets = (self.name_offsets[first:last + 1] - self.name_offsets[first]).tolist()
+
+            for i in range(last - first):
+                yield names[name_offsets[i]:name_offsets[i + 1]], self.sequences[offsets[i]:offsets[i + 1]]
+
+    def records(self, block_size=10000):
+        for first in range(0, len(self), block_size):
+            last = min(first + block_size, len(self))
+
+            # one string per block, sliced into records
+            seqs = self.sequences[self.offsets[first]:self.offsets[last]].tobytes().decode()
+            names = self.names[self.name_offsets[first]:self.name_offsets[last]].tobytes().decode()
+            offsets = (self.offsets[first:last + 1] - self.offsets[first]).tolist()
+            name_offsets = (self.name_offsets[first:last + 1] - self.name_offsets[first]).tolist()
+
+            for i in range(last - first):
+                yield names[name_offsets[i]:name_offsets[i + 1]], seqs[offsets[i]:offsets[i + 1]]
+
+
+def is_store(input_file):
+    with open(input_file, 'rb') as file:
+        file.seek(0, 2)
+        if file.tell() < FOOTER.itemsize:
+            return False
+        file.seek(-len(MAGIC), 2)
+        return file.read() == MAGIC
+
+
+def read_softclips(input_file, views=False):
+    """(name, sequence) of each read of a soft-clip store or of a fasta file.
+
+    views: sequences as uint8 arrays of ascii bases instead of strings (views of the store, without copy).
+    """
+
+    if is_store(input_file):
+        store = SoftclipStore(input_file)
+        yield from store.views() if views else store
+    else:
+        for record in SeqIO.parse(input_file, "fasta"):
+            seq = str(record.seq)
+            yield record.id, np.frombuffer(seq.encode(), dtype=np.uint8) if views else seq
+
+
+def merge_stores(output_file, input_files):
+    writer = StoreWriter(output_file)
+    writer.open()
+    for input_file in input_files:
+        writer.add_store(SoftclipStore(input_file))
+    writer.close()
+
+
+def fasta_to_store(input_file, output_file):
+    writer = StoreWriter(output_file)
+    writer.open()
+    for record in SeqIO.parse(input_file, "fasta"):
+        writer.add(record.id, str(record.seq))
+    writer.close()
@@ -0,0 +1,93 @@
+from multiprocessing import Pool
+import pandas as pd
+from sl_search import SplicedLeaderSearch, read_batches
+
+
+SSP_ALIGN_PARAMS = {'match': 1,
+                    'mismatch': 0,
+                    'gap_open': 2,    # penalty to create a gap
+                    'gap_extend': 1}  # penalty to extend a gap (must have created before)
+
+# strand switching primer, found at the end of the 5' soft-clip
+SSP_SEQUENCE = 'TTTCTGTTGGTGCTGATATTGCTGGG'
+
+
+class SSPSearch(SplicedLeaderSearch):
+    """Same result as evaluate_alignment(sequence, motif, '5SC') (pre-processing notebook).
+
+    The SSP is searched as a single spliced leader: the full motif, then motifs shortened on
+    the 5' side down to 15 bases, scored from a single DP table.
+    """
+
+    def __init__(self, motif=SSP_SEQUENCE, params=SSP_ALIGN_PARAMS, sensitivity=0.7):
+        super().__init__({'SSP': motif}, params, sensitivity=sensitivity, min_length=15)
+        self.motif = motif
+
+    def search(self, sequence):
+        name, profile, sizes, thresholds = self.leaders[0]
+        match = self.first_accepted(profile, sizes, thresholds, sequence[::-1])
+
+        if match is None:
+            return None, None, None
+
+        score, size = match
+        distance = len(sequence) - (int(self.align(sequence, self.motif[-size:]).end_query) + 1)
+
+        return score, size, distance
+
+    def search_batch(self, batch):
+        return [(name, *self.search(seq)) for name, seq in batch]
+
+
+_ENGINE = None
+
+
+def init_worker(motif, params, sensitivity):
+    global _ENGINE
+    _ENGINE = SSPSearch(motif, params, sensitivity)
+
+
+def search_worker_batch(batch):
+    return _ENGINE.search_batch(batch)
+
+
+def search_SSP(input_file, output_file, offset=0, motif=SSP_SEQUENCE, params=SSP_ALIGN_PARAMS, sensitivity=0.7,
+               workers=1, batch_size=5000):
+
+    batches = read_batches(input_file, batch_size)
+
+    if workers > 1:
+        with Pool(workers, initializer=init_worker, initargs=(motif, params, sensitivity)) as p:
+            results = list(p.imap(search_worker_batch, batches))
+    else:
+        engine = SSPSearch(motif, params, sensitivity)
+        results = [engine.search_batch(batch) for batch in batches]
+
+    reads, SSP_scores, SSP_sizes, SSP_distances = [], [], [], []
+
+    for name, score, size, dist in (row for result in results for row in result):
+        reads.append(name)
+        if score is None:
+            SSP_scores.append(0)
+            SSP_sizes.append(0)
+            SSP_distances.append(None)
+        else:
+            SSP_scores.append(score)
+            SSP_sizes.append(size)
+            SSP_distances.append(-(dist - offset))
+
+    # same table as the notebook (missing distances make the column float)
+    data = pd.DataFrame(dict(read=reads, SSP_score=SSP_scores, SSP_size=SSP_sizes, SSP_dist=SSP_distances))
+    data = data.set_index('read')
+    data.to_csv(output_file, sep='\t', index=True)
+
+
+# Handler function (same file names as the pre-processing notebook)
+
+def search_SSP_handler(ID, path, workers=1):
+    input_file = f'{path}/{ID}/{ID}-five_prime_softclip[SC=FULL|ALN=80].fa'
+    output_file = f'{path}/{ID}/{ID}-SSP_search.tsv'
+
+    search_SSP(input_file, output_file, offset=80, workers=workers)
+
+    print(f'Completed run {ID}\n')
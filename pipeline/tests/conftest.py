@@ -0,0 +1,5 @@
+import os
+import sys
+
+# pipeline modules are imported by name, as when running benchmarks.py from the pipeline folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
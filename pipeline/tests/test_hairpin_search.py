@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import parasail
+import pytest
+import reference
+from Bio.Seq import reverse_complement
+from benchmarks import mutate, random_sequence, synthetic_hairpins
+from hairpin_search import HAIRPIN_ALIGN_PARAMS, encode, hairpin_search, semi_global_scores
+from softclip_store import fasta_to_store
+
+
+PARAMS = [HAIRPIN_ALIGN_PARAMS,
+          {'match': 2, 'mismatch': -1, 'gap_open': 3, 'gap_extend': 1},
+          {'match': 1, 'mismatch': -2, 'gap_open': 1, 'gap_extend': 1},
+          {'match': 3, 'mismatch': 0, 'gap_open': 5, 'gap_extend': 2}]
+
+
+def random_pairs(rng, npairs, m, n):
+    # ACGT with a few unknown and lowercase bases
+    alphabet = np.array(list('ACGTNacgtn'))
+    weights = np.array([0.22, 0.22, 0.22, 0.22, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02])
+    return [(''.join(rng.choice(alphabet, m, p=weights)), ''.join(rng.choice(alphabet, n, p=weights)))
+            for _ in range(npairs)]
+
+
+@pytest.mark.parametrize('params', PARAMS)
+@pytest.mark.parametrize('m, n', [(12, 12), (12, 20), (20, 8), (1, 5), (30, 30)])
+def test_semi_global_scores(params, m, n):
+    rng = np.random.default_rng(m * 100 + n)
+    pairs = random_pairs(rng, 300, m, n)
+    # pairs of (nearly) identical sequences, to get high scores as well
+    pairs += [(query, query[:n].ljust(n, 'A')) for query, _ in pairs[:50]]
+
+    matrix = parasail.matrix_create('ACGT', params['match'], params['mismatch'])
+    expected = [parasail.sg_trace_striped_32(query, ref, params['gap_open'], params['gap_extend'], matrix).score
+                for query, ref in pairs]
+
+    queries = np.array([encode(query) for query, _ in pairs])
+    references = np.array([encode(ref) for _, ref in pairs])
+
+    assert semi_global_scores(queries, references, params).tolist() == expected
+
+
+def hairpin(rng, stem):
+    return stem + random_sequence(rng, int(rng.integers(1, 10))) + reverse_complement(stem)
+
+
+def fixed_reads():
+    rng = np.random.default_rng(2)
+    reads = {'no_hairpin': random_sequence(rng, 150),
+             'perfect': random_sequence(rng, 60) + hairpin(rng, random_sequence(rng, 12)) + random_sequence(rng, 80),
+             'mutated': random_sequence(rng, 90) + mutate(rng, hairpin(rng, random_sequence(rng, 12)), 0.1)
+                        + random_sequence(rng, 80),
+             'lowercase': (random_sequence(rng, 70) + hairpin(rng, random_sequence(rng, 12))).lower()
+                          + random_sequence(rng, 80),
+             'unknown_bases': random_sequence(rng, 70) + hairpin(rng, 'ACGNNCGTAGCA') + random_sequence(rng, 80),
+             'shorter_than_search': random_sequence(rng, 45),
+             'minimum_length': random_sequence(rng, 50),
+             'empty': ''}
+
+    # a perfect hairpin followed by a weaker one (2 mismatches) near the end of the read: the notebook search stops
+    # at the first stem2 end with a score >= 10 (from the read end) and never sees the perfect one
+    for k in range(5):
+        weak_stem = random_sequence(rng, 12)
+        weak = list(reverse_complement(weak_stem))
+        for position in (2, 7):
+            weak[position] = {'A': 'C', 'C': 'G', 'G': 'T', 'T': 'A'}[weak[position]]
+        reads[f'early_stop{k}'] = (random_sequence(rng, 60) + hairpin(rng, random_sequence(rng, 12))
+                                   + random_sequence(rng, 20) + weak_stem + 'TTT' + ''.join(weak) + random_sequence(rng, 3))
+
+    return reads
+
+
+def search_both(tmp_path, reads, offset_value=80, store=False, **kwargs):
+    with open(tmp_path / 'softclips.fa', 'w') as fasta:
+        fasta.writelines(f'>{name}\n{seq}\n' for name, seq in reads.items())
+
+    # the vectorized search reads the sequences of a soft-clip store without decoding them
+    input_file = tmp_path / 'softclips.fa'
+    if store:
+        input_file = tmp_path / 'softclips.softclips'
+        fasta_to_store(tmp_path / 'softclips.fa', input_file)
+
+    reference.hairpin_search(tmp_path / 'softclips.fa', tmp_path / 'notebook.tsv', offset_value=offset_value)
+    hairpin_search(input_file, tmp_path / 'vectorized.tsv', offset_value=offset_value, **kwargs)
+
+    return (tmp_path / 'notebook.tsv').read_text(), (tmp_path / 'vectorized.tsv').read_text()
+
+
+@pytest.mark.parametrize('store', [False, True])
+@pytest.mark.parametrize('offset_value', [0, 80])
+def test_fixed_reads(tmp_path, offset_value, store):
+    notebook, vectorized = search_both(tmp_path, fixed_reads(), offset_value, store)
+
+    assert vectorized == notebook
+
+
+def test_early_stop(tmp_path):
+    search_both(tmp_path, fixed_reads())
+    table = pd.read_csv(tmp_path / 'vectorized.tsv', sep='\t', index_col='read')
+
+    # the perfect hairpin (score 12) of these reads is not reached, unless the random parts fold as well
+    early_stop = table.loc[table.index.str.startswith('early_stop'), 'HAIRPIN_score']
+    assert len(early_stop) == 5
+    assert (early_stop >= 10).all()
+    assert (early_stop < 12).sum() >= 3
+
+
+@pytest.mark.parametrize('workers, store', [(1, False), (2, False), (1, True)])
+def test_random_reads(tmp_path, workers, store):
+    synthetic_hairpins(tmp_path / 'random.fa', nreads=150, seed=4)
+    reads = {line[1:].strip(): seq.strip() for line, seq in zip(*[iter(open(tmp_path / 'random.fa'))] * 2)}
+
+    notebook, vectorized = search_both(tmp_path, reads, store=store, workers=workers)
+
+    assert vectorized == notebook
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+import reference
+from benchmarks import synthetic_annotation
+from liftover import Liftover, read_liftover_files
+
+
+EXONICS_POSITIONS = {
+    # plus strand, contiguous transcriptomic coordinates
+    'T1.1': {'1': [1, 100], '2': [101, 250]},
+    # minus strand, with a gap between the transcriptomic coordinates of exons 2 and 3
+    'T2.1': {'1': [1, 50], '2': [51, 120], '3': [130, 200]},
+    # exons listed out of order: the notebook stops at exon 3 and never tests exon 2
+    'T3.1': {'1': [1, 80], '3': [161, 240], '2': [81, 160]},
+    # overlapping exons: the first listed exon containing the position is used
+    'T4.1': {'1': [1, 100], '2': [90, 150], '3': [151, 200]},
+    # single exon on the minus strand
+    'T5.1': {'1': [1, 300]},
+    # exon 3 is missing from the annotation
+    'T6.1': {'1': [1, 60], '2': [61, 90], '3': [91, 150]},
+    # exons listed out of order, all tested by the notebook
+    'T7.1': {'2': [81, 160], '1': [1, 80], '3': [161, 240]},
+}
+
+STRAND = {'T1.1': '+', 'T2.1': '-', 'T3.1': '+', 'T4.1': '-', 'T5.1': '-', 'T6.1': '+', 'T7.1': '-'}
+
+GENOMIC = {'T1.1': [(1000, 1099), (2000, 2149)],
+           'T2.1': [(5951, 6000), (5801, 5870), (5001, 5071)],
+           'T3.1': [(10000, 10079), (10500, 10579), (11000, 11079)],
+           'T4.1': [(20900, 20999), (20700, 20760), (20100, 20149)],
+           'T5.1': [(30000, 30299)],
+           'T6.1': [(40000, 40059), (40100, 40129)],
+           'T7.1': [(50900, 50979), (50500, 50579), (50000, 50079)]}
+
+EXONS = {'Start': {f'{transcript}.e{number}': start
+                   for transcript, exons in GENOMIC.items() for number, (start, end) in enumerate(exons, 1)},
+         'End': {f'{transcript}.e{number}': end
+                 for transcript, exons in GENOMIC.items() for number, (start, end) in enumerate(exons, 1)}}
+
+POSITIONS = [-5, 0, 1, 2, 50, 51, 80, 81, 89, 90, 95, 100, 101, 120, 121, 125, 129, 130, 150, 151, 160, 161, 200, 201,
+             240, 250, 251, 300, 301, 1000, np.nan]
+
+
+@pytest.fixture
+def notebook(monkeypatch):
+    monkeypatch.setattr(reference, 'exonics_positions', EXONICS_POSITIONS)
+    monkeypatch.setattr(reference, 'strand', STRAND)
+    monkeypatch.setattr(reference, 'gtf', EXONS)
+
+    return reference.transcriptome_based_correction
+
+
+def test_fixed_positions(notebook):
+    # the notebook raises a KeyError on positions of exons missing from the annotation
+    table = pd.DataFrame([(transcript, position) for transcript in EXONICS_POSITIONS for position in POSITIONS
+                          if not (transcript == 'T6.1' and 91 <= position <= 150)],
+                         columns=['isoform', 'transcriptomic_start'])
+
+    expected = table.apply(lambda x: notebook(x['isoform'], x['transcriptomic_start']), axis=1).to_numpy(dtype=float)
+    liftover = Liftover(EXONICS_POSITIONS, STRAND, EXONS)
+
+    assert np.array_equal(liftover(table['isoform'], table['transcriptomic_start']), expected, equal_nan=True)
+    # T4 (overlaps) and T7 (out of order) are converted by the exon by exon fallback, T3 is sorted up to exon 3
+    assert sorted(liftover.codes[list(liftover.unordered)]) == ['T4.1', 'T7.1']
+
+
+def test_outside_exons():
+    liftover = Liftover(EXONICS_POSITIONS, STRAND, EXONS)
+    isoforms = ['T1.1', 'T1.1', 'T2.1', 'T3.1', 'T6.1', 'T6.1', 'T9.1', 'T1.1']
+    positions = [0, 251, 125, 100, 95, 60, 10, np.nan]
+
+    lifted = liftover(isoforms, positions)
+
+    # before the first exon, after the last one, in a transcriptomic gap, in an exon never tested by the notebook,
+    # in an exon missing from the annotation, on an unknown transcript, and NaN positions
+    assert np.isnan(lifted[[0, 1, 2, 3, 4, 6, 7]]).all()
+    assert lifted[5] == 40059
+
+
+def test_synthetic_annotation(tmp_path):
+    exonics_positions = synthetic_annotation(tmp_path / 'test.gtf', tmp_path / 'transcript_exons.json', ntranscripts=300)
+    reference.read_liftover_reference(tmp_path / 'test.gtf', tmp_path / 'transcript_exons.json')
+
+    rng = np.random.default_rng(0)
+    table = pd.DataFrame({'isoform': rng.choice(list(exonics_positions), 20000),
+                          'transcriptomic_start': rng.integers(-5, 1500, 20000)})
+
+    expected = table.apply(lambda x: reference.transcriptome_based_correction(x['isoform'], x['transcriptomic_start']),
+                           axis=1).to_numpy(dtype=float)
+    liftover = Liftover(*read_liftover_files(tmp_path / 'test.gtf', tmp_path / 'transcript_exons.json'))
+
+    assert len(liftover.unordered) > 0
+    assert np.array_equal(liftover(table['isoform'], table['transcriptomic_start']), expected, equal_nan=True)
@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+from benchmarks import synthetic_paired_softclips, synthetic_runs, synthetic_spliced_leaders
+from dataset import assemble_dataset, motif_run_files, run_files
+from hairpin_search import hairpin_search
+from motif_search import motif_tables, scan_motifs
+from sl_search import search_spliced_leaders
+from ssp_search import search_SSP
+
+
+@pytest.fixture(scope='module')
+def run(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('motifs')
+
+    ID = 'RUN_1'
+    strands = synthetic_runs(tmp, [ID], nreads=400, ngenes=50)
+    names = pd.read_csv(tmp / ID / f'{ID}-SSP_search.tsv', sep='\t')['read']
+
+    leaders = synthetic_spliced_leaders(nvariants=4)
+    full, end = tmp / ID / 'full.fa', tmp / ID / 'end.fa'
+    synthetic_paired_softclips(full, end, names, leaders)
+
+    # separate searches, written over the tables of synthetic_runs
+    files = run_files(ID, tmp)
+    search_SSP(full, files['SSP'], offset=80)
+    search_spliced_leaders(end, files['SL'], leaders, offset=20)
+    search_spliced_leaders(full, files['SL_2nd_pass'], leaders, offset=80)
+    hairpin_search(full, files['HAIRPIN'], offset_value=80)
+
+    return tmp, ID, strands, leaders, full, end
+
+
+def test_full_second_pass(run):
+    tmp, ID, strands, leaders, full, end = run
+
+    scan_motifs(full, end, tmp / 'full_scan.tsv', leaders, offset=80, end_offset=20, full_second_pass=True)
+    tables = motif_tables(pd.read_csv(tmp / 'full_scan.tsv', sep='\t'))
+
+    for name, table in tables.items():
+        separate = pd.read_csv(run_files(ID, tmp)[name], sep='\t')
+        pd.testing.assert_frame_equal(table.reset_index(drop=True), separate, check_dtype=False)
+
+
+def test_dataset(run):
+    tmp, ID, strands, leaders, full, end = run
+
+    # 2nd pass only on reads without robust SL in the first one
+    scan_motifs(full, end, motif_run_files(ID, tmp)['motifs'], leaders, offset=80, end_offset=20)
+    second_pass = motif_tables(pd.read_csv(motif_run_files(ID, tmp)['motifs'], sep='\t'))['SL_2nd_pass']
+    assert len(second_pass) < len(pd.read_csv(run_files(ID, tmp)['SL_2nd_pass'], sep='\t'))
+    # some of them replace the first pass in the dataset
+    assert (second_pass['score'] >= 12).any()
+
+    liftover = lambda isoforms, positions: positions + 100
+    assemble_dataset([ID], tmp, tmp / 'separate-dataset.tsv', strands, liftover)
+    assemble_dataset([ID], tmp, tmp / 'scan-dataset.tsv', strands, liftover, files=motif_run_files)
+
+    assert (tmp / 'scan-dataset.tsv').read_text() == (tmp / 'separate-dataset.tsv').read_text()
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+import reference
+import rules
+from benchmarks import synthetic_results
+
+
+# rows with missing values in each of the columns used by the rules (tsv blanks are read as NaN)
+MISSING = pd.DataFrame({'gene': ['GENE1.1', 'GENE2.1', 'GENE3.1', 'GENE4.1', 'GENE5.1', 'GENE6.1', 'GENE7.1'],
+                        'genomic_start': [np.nan, 100.0, 200.0, np.nan, 300.0, 400.0, 500.0],
+                        'genomic_end': [150.0, np.nan, 250.0, np.nan, 350.0, 450.0, 550.0],
+                        'read_orientation': ['antisense', 'antisense', 'sense', np.nan, 'antisense', None, 'antisense'],
+                        'SC5': [np.nan, -10.0, np.nan, -100.0, -50.0, -20.0, -5.0],
+                        'SSP_dist': [-10.0, np.nan, np.nan, -30.0, -200.0, -100.0, -85.0],
+                        'SL': [np.nan, None, '', 'SL1', 'SL2 / SL2_1', np.nan, None],
+                        'score': [15.0, 12.0, 20.0, np.nan, 8.0, 12.0, np.nan],
+                        'distance_to_start': [-1.0, np.nan, 0.0, -1.0, np.nan, -5.0, -2.0],
+                        'HAIRPIN_score': [12.0, 10.0, 11.0, 12.0, np.nan, 10.0, 9.0],
+                        'ROBUST_SL_FOUND': [np.nan, 'NOT FOUND', 'FOUND', np.nan, None, 'NOT FOUND', np.nan]})
+
+
+@pytest.fixture(params=['dataframe', 'tsv'])
+def results(request, tmp_path):
+    table, strands = synthetic_results(3000, ngenes=50, seed=5)
+    table = pd.concat([table, MISSING], ignore_index=True)
+
+    # the notebook rules run on tables read back from tsv files: None and '' become NaN
+    if request.param == 'tsv':
+        table.to_csv(tmp_path / 'results.tsv', sep='\t', index=None)
+        table = pd.read_csv(tmp_path / 'results.tsv', sep='\t')
+
+    return table, strands
+
+
+def notebook_rule(table, rule):
+    return table.apply(rule, axis=1).to_numpy(dtype=object)
+
+
+def test_gene_orientation(results):
+    table, strands = results
+
+    expected = notebook_rule(table, lambda x: strands[x['gene']])
+
+    assert rules.gene_orientation(table['gene'], strands).tolist() == expected.tolist()
+
+
+def test_oriented_positions(results):
+    table, strands = results
+    orientation = rules.gene_orientation(table['gene'], strands)
+
+    start = notebook_rule(table, lambda x: x['genomic_start'] if strands[x['gene']] == '+' else x['genomic_end'])
+    end = notebook_rule(table, lambda x: x['genomic_end'] if strands[x['gene']] == '+' else x['genomic_start'])
+    oriented_start, oriented_end = rules.oriented_positions(table['genomic_start'], table['genomic_end'], orientation)
+
+    assert np.array_equal(oriented_start, start.astype(float), equal_nan=True)
+    assert np.array_equal(oriented_end, end.astype(float), equal_nan=True)
+
+
+def test_ssp_found(results):
+    table, _ = results
+
+    expected = notebook_rule(table, lambda x: 'FOUND' if x['SSP_dist'] == x['SSP_dist'] and x['SSP_dist'] - x['SC5'] <= 80
+                             else 'NOT FOUND')
+
+    assert rules.ssp_found(table['SSP_dist'], table['SC5']).tolist() == expected.tolist()
+
+
+def test_robust_SL(results):
+    table, _ = results
+
+    expected = notebook_rule(table, lambda x: reference.robust_SL(SL=x['SL'], score=x['score'], dist=x['distance_to_start']))
+
+    assert rules.robust_SL(table['SL'], table['score'], table['distance_to_start']).tolist() == expected.tolist()
+
+
+def test_robust_variant(results):
+    table, _ = results
+
+    expected = notebook_rule(table, lambda x: reference.robust_variant(SL=x['SL'], score=x['score'],
+                                                                       dist=x['distance_to_start']))
+
+    assert rules.robust_variant(table['SL'], table['score'], table['distance_to_start']).tolist() == expected.tolist()
+
+
+def test_robust_SL_2nd_pass(results):
+    table, _ = results
+
+    expected = notebook_rule(table, lambda x: 'FOUND' if x['SL'] == x['SL'] and x['score'] >= 12 else 'NOT FOUND')
+
+    assert rules.robust_SL_2nd_pass(table['SL'], table['score']).tolist() == expected.tolist()
+
+
+def test_hairpin_found(results):
+    table, _ = results
+
+    expected = notebook_rule(table, lambda x: reference.hairpin_found(x['read_orientation'], x['ROBUST_SL_FOUND'],
+                                                                      x['HAIRPIN_score']))
+
+    assert rules.hairpin_found(table['read_orientation'], table['ROBUST_SL_FOUND'],
+                               table['HAIRPIN_score']).tolist() == expected.tolist()
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+import reference
+from benchmarks import mutate, random_sequence, synthetic_softclips, synthetic_spliced_leaders
+from sl_search import SplicedLeaderSearch, search_spliced_leaders
+
+
+SL1 = 'GGTTTAATTACCCAAGTTTGAG'
+SL2 = 'GGTTTTAACCCAGTTACTCAAG'
+
+LEADERS = {'SL1': SL1, 'SL2': SL2,
+           # same sequence as SL2: every SL2 match is a tie, both names are reported
+           'SL2_1': SL2,
+           # differs from SL2 on its 5' side only: ties on shortened SL, not on the full SL
+           'SL2_2': 'CCAATTAACCCAGTTACTCAAG'}
+
+ALIGNED = 'ACGTTGCAAGCTAGCTTAGC'
+
+
+def fixed_reads():
+    rng = np.random.default_rng(1)
+    reads = {'full_SL1': 'TTGACA' + SL1 + ALIGNED,
+             'full_SL2': 'CATG' + SL2 + 'AC' + ALIGNED,
+             'at_read_start': SL1 + ALIGNED,
+             'mutated_SL1': 'GATTACA' + mutate(rng, SL1, 0.1) + ALIGNED,
+             'no_SL': random_sequence(rng, 60) + ALIGNED,
+             'unknown_bases': 'NNNN' + SL1[:10] + 'N' + SL1[11:] + ALIGNED,
+             'lowercase': 'acgt' + SL2.lower() + ALIGNED,
+             'shorter_than_SL': SL2[-15:],
+             # SL1 then SL2 at different distances from the alignment start: the closest wins on equal scores
+             'two_SL': SL2 + 'TTTT' + SL1 + ALIGNED}
+
+    # shortened SL (5' side), down to sizes under the minimum of 7 bases
+    for size in [21, 18, 15, 12, 10, 8, 7, 6, 5]:
+        reads[f'SL1_last_{size}'] = 'ACACAC' + SL1[-size:] + ALIGNED
+        reads[f'SL2_last_{size}'] = 'TGTGTG' + SL2[-size:] + 'G' + ALIGNED
+
+    return reads
+
+
+def write_fasta(path, records):
+    with open(path, 'w') as fasta:
+        fasta.writelines(f'>{name}\n{seq}\n' for name, seq in records.items())
+
+
+def search_both(tmp_path, reads, leaders, **kwargs):
+    write_fasta(tmp_path / 'SL_sequences.fasta', leaders)
+    write_fasta(tmp_path / 'softclips.fa', reads)
+
+    reference.search_spliced_leaders(tmp_path / 'softclips.fa', tmp_path / 'notebook.tsv', tmp_path / 'SL_sequences.fasta',
+                                     offset=20)
+    search_spliced_leaders(tmp_path / 'softclips.fa', tmp_path / 'engine.tsv', leaders, offset=20, **kwargs)
+
+    return (tmp_path / 'notebook.tsv').read_text(), (tmp_path / 'engine.tsv').read_text()
+
+
+def test_fixed_reads(tmp_path):
+    notebook, engine = search_both(tmp_path, fixed_reads(), LEADERS)
+
+    assert engine == notebook
+
+
+def test_fixed_reads_cover_ties_and_shortened_SL(tmp_path):
+    search_both(tmp_path, fixed_reads(), LEADERS)
+    table = pd.read_csv(tmp_path / 'engine.tsv', sep='\t', index_col='read')
+
+    assert table.loc['full_SL2', 'SL'] == 'SL2 / SL2_1'
+    assert table.loc['SL2_last_12', 'SL'] == 'SL2 / SL2_1 / SL2_2'
+    assert table.loc['SL1_last_10', 'score'] == 10
+    assert 'SL1_last_5' not in table.index
+
+
+@pytest.mark.parametrize('workers, batch_size', [(1, 5000), (1, 7), (2, 50)])
+def test_random_reads(tmp_path, workers, batch_size):
+    leaders = synthetic_spliced_leaders(nvariants=6, seed=3)
+    synthetic_softclips(tmp_path / 'random.fa', leaders, nreads=300, seed=3)
+    reads = {line[1:].strip(): seq.strip() for line, seq in zip(*[iter(open(tmp_path / 'random.fa'))] * 2)}
+
+    notebook, engine = search_both(tmp_path, reads, leaders, workers=workers, batch_size=batch_size)
+
+    assert engine == notebook
+
+
+def test_search_returns_none_without_match():
+    engine = SplicedLeaderSearch(LEADERS)
+
+    assert engine.search('ACGT' * 10) is None
+    assert engine.search(SL1 + ALIGNED) == ('SL1', len(SL1), len(ALIGNED))
@@ -0,0 +1,269 @@
+import os
+import json
+import hashlib
+import traceback
+from multiprocessing import Pool
+from bam_features import process_bam, GenomicStats, TranscriptomicStats, SoftclipBinary
+from ssp_search import SSP_ALIGN_PARAMS, SSP_SEQUENCE
+from sl_search import read_spliced_leaders, SL_ALIGN_PARAMS
+from hairpin_search import HAIRPIN_ALIGN_PARAMS
+from motif_search import scan_motifs
+from dataset import motif_run_files, run_dataset_handler, merge_run_datasets
+from positions import position_counts_handler, update_position_stats, file_digest
+
+
+STATE_FILE = 'pipeline_state.json'
+
+
+def run_paths(ID, path):
+
+    # every file of a run (same file names as the pre-processing notebook)
+    # soft-clips are kept in soft-clip stores instead of fasta files, search results in a single table
+    files = motif_run_files(ID, path)
+    files.update({'dataset': f'{path}/{ID}/{ID}-dataset.tsv',
+                  'position_counts': f'{path}/{ID}/{ID}-position_counts.tsv',
+                  'genome_bam': f'{path}/{ID}/{ID}-genome_sorted.bam',
+                  'transcriptome_bam': f'{path}/{ID}/{ID}-transcriptome_sorted.bam',
+                  'full_softclip': f'{path}/{ID}/{ID}-five_prime_softclip[SC=FULL|ALN=80].softclips',
+                  'softclip_end': f'{path}/{ID}/{ID}-five_prime_softclip[SC=100|ALN=20].softclips'})
+    return files
+
+
+def reference_paths(path):
+    return {'SL': f'{path}/ref/SL_sequences.fasta',
+            'strands': f'{path}/ref/gene&strand.tsv',
+            'gtf': f'{path}/ref/c_elegans.PRJNA13758.WS270.canonical_geneset.gtf',
+            'exons': f'{path}/ref/transcript_exons.json'}
+
+
+class Stage:
+    """A step of the pre-processing notebook.
+
+    files: function(ID, path) -> (input files, output files), run: function(ID, path, **params).
+    Per-run stages are called once per run ID, the others once with the tuple of all runs as ID.
+    params must be json serializable: they are part of the fingerprint of the outputs.
+    """
+
+    def __init__(self, name, files, run, params=None, per_run=True):
+        self.name = name
+        self.files = files
+        self.run = run
+        self.params = params or {}
+        self.per_run = per_run
+
+    def task(self, ID):
+        return f'{self.name}:{ID}' if self.per_run else self.name
+
+
+# Stages (functions are defined at module level so that stages can be sent to worker processes)
+
+def genome_features_files(ID, path):
+    return [run_paths(ID, path)['genome_bam']], [run_paths(ID, path)['genome']]
+
+
+def genome_features(ID, path):
+    files = run_paths(ID, path)
+    process_bam(files['genome_bam'], [GenomicStats(files['genome'])])
+
+
+def transcriptome_features_files(ID, path):
+    files = run_paths(ID, path)
+    return [files['transcriptome_bam']], [files['transcriptome'], files['full_softclip'], files['softclip_end']]
+
+
+def transcriptome_features(ID, path, full_softclip, softclip_end):
+    files = run_paths(ID, path)
+    process_bam(files['transcriptome_bam'], [TranscriptomicStats(files['transcriptome']),
+                                             SoftclipBinary(files['full_softclip'], **full_softclip),
+                                             SoftclipBinary(files['softclip_end'], **softclip_end)])
+
+
+def motif_search_files(ID, path):
+    files = run_paths(ID, path)
+    return [files['full_softclip'], files['softclip_end'], reference_paths(path)['SL']], [files['motifs']]
+
+
+def motif_search(ID, path, **settings):
+    files = run_paths(ID, path)
+    scan_motifs(files['full_softclip'], files['softclip_end'], files['motifs'],
+                read_spliced_leaders(reference_paths(path)['SL']), **settings)
+
+
+def run_dataset_files(ID, path):
+    references = reference_paths(path)
+    inputs = list(motif_run_files(ID, path).values())
+    return inputs + [references['strands'], references['gtf'], references['exons']], [run_paths(ID, path)['dataset']]
+
+
+def run_dataset(ID, path):
+    run_dataset_handler(ID, path, files=motif_run_files)
+
+
+def position_counts_files(ID, path):
+    return [run_paths(ID, path)['dataset']], [run_paths(ID, path)['position_counts']]
+
+
+def position_counts(ID, path):
+    position_counts_handler(ID, path)
+
+
+def dataset_files(runs, path):
+    return [run_paths(ID, path)['dataset'] for ID in runs], [f'{path}/dataset_+SSP+SL+HAIRPIN.tsv']
+
+
+def dataset(runs, path):
+    merge_run_datasets(runs, path)
+
+
+def position_stats_files(runs, path):
+
+    # the counts of the runs are folded into position_counts.tsv: only added, changed or removed runs are read
+    return [run_paths(ID, path)['position_counts'] for ID in runs], \
+        [f'{path}/start_positions_stats.tsv', f'{path}/SL_&_mimic_positions.tsv', f'{path}/position_counts.tsv']
+
+
+def position_stats(runs, path):
+    update_position_stats(list(runs), path)
+
+
+STAGES = [
+    Stage('genome_features', genome_features_files, genome_features),
+    Stage('transcriptome_features', transcriptome_features_files, transcriptome_features,
+          {'full_softclip': {'ALN': 80}, 'softclip_end': {'SC': 100, 'ALN': 20}}),
+    Stage('motif_search', motif_search_files, motif_search,
+          {'sensitivity': 0.7, 'offset': 80, 'end_offset': 20, 'ssp_motif': SSP_SEQUENCE, 'ssp_params': SSP_ALIGN_PARAMS,
+           'sl_params': SL_ALIGN_PARAMS, 'hairpin_params': HAIRPIN_ALIGN_PARAMS, 'length_s1': 12, 'length_s2': 12,
+           'full_second_pass': False}),
+    Stage('run_dataset', run_dataset_files, run_dataset),
+    Stage('position_counts', position_counts_files, position_counts),
+    Stage('dataset', dataset_files, dataset, per_run=False),
+    Stage('position_stats', position_stats_files, position_stats, per_run=False),
+]
+
+
+# Fingerprints
+
+class FileDigests:
+    """sha256 of files, cached by path, size & modification time: BAM files are only read again once modified."""
+
+    def __init__(self, cache=None):
+        self.cache = {} if cache is None else cache
+
+    def __call__(self, file):
+        stat = os.stat(file)
+        key = os.path.abspath(file)
+
+        cached = self.cache.get(key)
+        if cached is not None and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+
+        digest = file_digest(file)
+
+        self.cache[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+        return digest
+
+
+def fingerprint(stage, ID, path, digests):
+
+    # paths relative to the data folder, so that the folder can be moved
+    inputs, _ = stage.files(ID, path)
+    inputs = {os.path.relpath(file, path): digests(file) for file in inputs}
+
+    content = json.dumps({'stage': stage.name, 'run': ID, 'params': stage.params, 'inputs': inputs}, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def up_to_date(stage, ID, path, record, key, digests):
+
+    # same inputs & parameters, outputs unchanged since they were written
+    if record is None or record['fingerprint'] != key:
+        return False
+
+    _, outputs = stage.files(ID, path)
+    return all(os.path.exists(file) and digests(file) == record['outputs'].get(os.path.relpath(file, path))
+               for file in outputs)
+
+
+def read_state(path):
+    if not os.path.exists(f'{path}/{STATE_FILE}'):
+        return {'files': {}, 'tasks': {}}
+    with open(f'{path}/{STATE_FILE}') as state:
+        return json.load(state)
+
+
+def write_state(path, state):
+
+    # written to a temporary file first: an interrupted run never leaves a truncated state
+    with open(f'{path}/{STATE_FILE}.tmp', 'w') as file:
+        json.dump(state, file, indent=1)
+    os.replace(f'{path}/{STATE_FILE}.tmp', f'{path}/{STATE_FILE}')
+
+
+# Runner
+
+def run_task(args):
+
+    # failures are returned with the traceback: the other tasks of the stage are still run and recorded
+    stage, ID, path = args
+    try:
+        stage.run(ID, path, **stage.params)
+    except Exception:
+        return ID, traceback.format_exc()
+    return ID, None
+
+
+def run_pipeline(runs, path, stages=STAGES, workers=1, force=False):
+    """Run the stages in order, skipping the runs whose outputs are up to date.
+
+    Outputs are up to date when the fingerprint of the stage (its parameters and the sha256 of its
+    input files) is the one recorded when they were written, and they were not modified since.
+    The state is saved after each task: an interrupted pipeline resumes where it stopped. A failed task
+    does not stop the other tasks of its stage, the pipeline stops with their tracebacks once they are done.
+    An upstream output rewritten with the same content does not invalidate the next stages.
+
+    Returns the list of (stage, ID) that were run.
+    """
+
+    state = read_state(path)
+    digests = FileDigests(state['files'])
+    executed = []
+
+    for stage in stages:
+        IDs = list(runs) if stage.per_run else [tuple(runs)]
+
+        todo = {}
+        for ID in IDs:
+            key = fingerprint(stage, ID, path, digests)
+            record = state['tasks'].get(stage.task(ID))
+            if force or not up_to_date(stage, ID, path, record, key, digests):
+                todo[ID] = key
+
+        print(f'{stage.name}: {len(IDs) - len(todo)} up to date, {len(todo)} to run')
+
+        tasks = [(stage, ID, path) for ID in todo]
+        pool = Pool(min(workers, len(tasks))) if workers > 1 and len(tasks) > 1 else None
+        done = map(run_task, tasks) if pool is None else pool.imap_unordered(run_task, tasks)
+
+        # each task is recorded as soon as it is done
+        failed = []
+        try:
+            for ID, error in done:
+                if error is not None:
+                    failed.append((ID, error))
+                    continue
+
+                _, outputs = stage.files(ID, path)
+                state['tasks'][stage.task(ID)] = {'fingerprint': todo[ID],
+                                                  'outputs': {os.path.relpath(file, path): digests(file)
+                                                              for file in outputs}}
+                write_state(path, state)
+                executed.append((stage.name, ID))
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        if failed:
+            raise RuntimeError(f'{stage.name}: {len(failed)} of {len(tasks)} tasks failed, the others are recorded\n\n'
+                               + '\n'.join(f'{stage.task(ID)}:\n{error}' for ID, error in failed))
+
+    return executed